@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import importlib.util
 import os
 import environ
 
@@ -39,11 +40,15 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
-    'drf_yasg',
     'testers',
 ]
 
+# drf_yasg isn't an installed app so workers don't import it on startup, its templates and static files
+# for Swagger UI and ReDoc are found without importing the package
+DRF_YASG_DIR = os.path.dirname(importlib.util.find_spec('drf_yasg').origin)
+
 MIDDLEWARE = [
+    'testers.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,7 +63,7 @@ ROOT_URLCONF = 'TesterMatch.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [os.path.join(BASE_DIR, 'templates')],
+        'DIRS': [os.path.join(BASE_DIR, 'templates'), os.path.join(DRF_YASG_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -73,6 +78,11 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'TesterMatch.wsgi.application'
 
+ASGI_APPLICATION = 'TesterMatch.asgi.application'
+
+# Serves match-testers and devices with async views, meant for the ASGI deployment
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', False)
+
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
@@ -84,9 +94,41 @@ DATABASES = {
         'PASSWORD': env.str('POSTGRES_PASSWORD', 'postgres'),
         'HOST': env.str('DB_HOST', 'db'),
         'PORT': env.int('DB_PORT', 5432),
+        # Persistent connections are checked before reuse, keep 0 under ASGI and use a pooler instead
+        'CONN_MAX_AGE': env.int('CONN_MAX_AGE', 0),
+        'CONN_HEALTH_CHECKS': env.bool('CONN_HEALTH_CHECKS', True),
+        # Required behind a transaction pooling PgBouncer
+        'DISABLE_SERVER_SIDE_CURSORS': env.bool('DISABLE_SERVER_SIDE_CURSORS', False),
     }
 }
 
+# Read replicas used by the read-only matching and device list endpoints, e.g. DB_REPLICA_HOSTS=replica1,replica2:5433
+DATABASE_REPLICAS = []
+for i, replica_host in enumerate(env.list('DB_REPLICA_HOSTS', default=[]), 1):
+    replica_host, _, replica_port = replica_host.partition(':')
+    DATABASES['replica{}'.format(i)] = dict(DATABASES['default'], HOST=replica_host,
+                                            PORT=int(replica_port or DATABASES['default']['PORT']),
+                                            TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append('replica{}'.format(i))
+
+DATABASE_ROUTERS = ['testers.routers.ReplicaRouter']
+
+# Hash partitioning of bugs and experience tables on PostgreSQL, applied by the 0008 migration: 'device' lets
+# queries for a few devices read only their partitions, 'tester' spreads every tester's rows to one partition
+BUG_PARTITION_KEY = env.str('BUG_PARTITION_KEY', '')
+BUG_PARTITIONS = env.int('BUG_PARTITIONS', 16)
+
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+# Backends are configured with urls, e.g. locmemcache://, filecache:///var/tmp/django_cache or memcache://host:port
+CACHES = {
+    'default': env.cache_url('CACHE_URL', default='locmemcache://'),
+    'match_testers': env.cache_url('MATCH_CACHE_URL', default='locmemcache://match-testers'),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -114,8 +156,6 @@ TIME_ZONE = 'UTC'
 
 USE_I18N = True
 
-USE_L10N = True
-
 USE_TZ = True
 
 # Static files (CSS, JavaScript, Images)
@@ -125,6 +165,56 @@ STATIC_URL = '/static/'
 
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
+STATICFILES_DIRS = [os.path.join(DRF_YASG_DIR, 'static')]
+
+# Engine used to match testers: 'database' runs the query in PostgreSQL, 'memory' ranks testers in-process
+# from numpy arrays loaded from the database, 'mmap' ranks them from the arrays of a memory mapped match data file
+MATCHING_ENGINE = env.str('MATCHING_ENGINE', 'database')
+
+# Match data file written by export_match_data, read by the 'mmap' engine
+MATCH_DATA_FILE = env.str('MATCH_DATA_FILE', '')
+
+# Number of processes ranking testers in parallel with the 'memory' engine, 1 ranks in the web process
+MATCHING_WORKERS = env.int('MATCHING_WORKERS', 1)
+
+# How often (in seconds) in-process caches check the data version for changes made by other processes
+DATA_VERSION_CHECK_INTERVAL = env.float('DATA_VERSION_CHECK_INTERVAL', 1.0)
+
+# Number of testers fetched from the database at once when streaming match-testers results
+MATCH_STREAM_CHUNK_SIZE = env.int('MATCH_STREAM_CHUNK_SIZE', 2000)
+
+# Largest limit accepted by match-testers, more testers are exported by streaming without a limit
+MATCH_MAX_LIMIT = env.int('MATCH_MAX_LIMIT', 10000)
+
+# Largest limit accepted by the device list
+DEVICE_LIST_MAX_LIMIT = env.int('DEVICE_LIST_MAX_LIMIT', 10000)
+
+# Cache used for match-testers responses and for how long (in seconds) they are kept
+MATCH_CACHE_ALIAS = 'match_testers'
+MATCH_CACHE_TIMEOUT = env.int('MATCH_CACHE_TIMEOUT', 3600)
+
+# How long (in seconds) a ranking snapshot may be served after the data changed, 0 serves only current snapshots
+RANKING_SNAPSHOT_MAX_STALENESS = env.int('RANKING_SNAPSHOT_MAX_STALENESS', 0)
+
+# Maximum number of queries in a single match-testers batch request
+MATCH_BATCH_MAX_QUERIES = env.int('MATCH_BATCH_MAX_QUERIES', 1000)
+
+# Number of testers counted per device by the summaries behind match-testers mode=approx, more counters give
+# smaller errors for rankings of more testers
+APPROX_SKETCH_COUNTERS = env.int('APPROX_SKETCH_COUNTERS', 64)
+
+# Directory with swagger.json and swagger.yaml written by the generate_schema command at build time,
+# without them the schema is generated on the first request of every process
+OPENAPI_SCHEMA_DIR = env.str('OPENAPI_SCHEMA_DIR', '')
+
+# How long (in seconds) clients may cache the schema, it only changes with deployments
+OPENAPI_SCHEMA_MAX_AGE = env.int('OPENAPI_SCHEMA_MAX_AGE', 86400)
+
 SWAGGER_SETTINGS = {
-    'USE_SESSION_AUTH': False
+    'USE_SESSION_AUTH': False,
+    'SPEC_URL': 'schema-json',
+}
+
+REDOC_SETTINGS = {
+    'SPEC_URL': 'schema-json',
 }
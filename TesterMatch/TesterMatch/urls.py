@@ -1,24 +1,14 @@
-from django.conf.urls import url
 from django.contrib import admin
-from django.urls import path, include
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
+from django.urls import path, include, re_path
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Tester Matching API",
-        default_version='v1',
-        description="Simple matching system",
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+from testers.schema import docs_ui_view, schema_view
 
+# Schema is generated once per process or read from a build artifact, drf_yasg is loaded only by these views
 urlpatterns = [
     path('admin/', admin.site.urls),
-    url(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    url(r'^swagger/$', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    url(r'^redoc/$', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
-    url(r'^', include('testers.urls'))
+    re_path(r'^swagger\.json$', schema_view, {'schema_format': '.json'}, name='schema-json'),
+    re_path(r'^swagger\.yaml$', schema_view, {'schema_format': '.yaml'}, name='schema-yaml'),
+    re_path(r'^swagger/$', docs_ui_view, {'renderer': 'swagger'}, name='schema-swagger-ui'),
+    re_path(r'^redoc/$', docs_ui_view, {'renderer': 'redoc'}, name='schema-redoc'),
+    re_path(r'^', include('testers.urls'))
 ]
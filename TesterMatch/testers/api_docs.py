@@ -0,0 +1,90 @@
+"""
+Swagger annotations of the API views. Imported only when the schema is generated, so workers serving the API
+don't import drf_yasg.
+"""
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+
+from .models import SUPPORTED_COUNTRIES
+from .serializers import MatchBatchSerializer, TesterSerializer
+from .views import MATCH_MODES, STREAM_FORMATS, DeviceList, match_testers, match_testers_batch, \
+    match_testers_cache_stats
+
+SUPPORTED_COUNTRIES_VALUES = [c[0] for c in SUPPORTED_COUNTRIES]
+
+api_info = openapi.Info(
+    title="Tester Matching API",
+    default_version='v1',
+    description="Simple matching system",
+)
+
+# Fast path JSON responses have the same format as the serializers
+testers_response = openapi.Response('response description', TesterSerializer(many=True))
+
+devices_param = openapi.Parameter('devices', openapi.IN_QUERY,
+                                  description="devices for which experience should be calculated, empty means all",
+                                  type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_INTEGER))
+countries_param = openapi.Parameter('countries', openapi.IN_QUERY,
+                                    description="countries from which testers should be included, empty means any",
+                                    type=openapi.TYPE_ARRAY,
+                                    explode=True,
+                                    items=openapi.Items(type=openapi.TYPE_STRING, enum=SUPPORTED_COUNTRIES_VALUES),)
+limit_param = openapi.Parameter('limit', openapi.IN_QUERY,
+                                description="maximum number of testers to return, link to the next page is returned "
+                                            "in the 'Link' header",
+                                type=openapi.TYPE_INTEGER, minimum=1)
+cursor_param = openapi.Parameter('cursor', openapi.IN_QUERY,
+                                 description="cursor of the next page taken from the 'Link' header",
+                                 type=openapi.TYPE_STRING)
+since_param = openapi.Parameter('since', openapi.IN_QUERY,
+                                description="only bugs reported on or after this day count towards experience",
+                                type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE)
+until_param = openapi.Parameter('until', openapi.IN_QUERY,
+                                description="only bugs reported on or before this day count towards experience",
+                                type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE)
+decay_param = openapi.Parameter('decay', openapi.IN_QUERY,
+                                description="half-life in days, bugs count half as much for every this many days "
+                                            "before 'until' or today, experience is rounded to whole bugs",
+                                type=openapi.TYPE_INTEGER, minimum=1)
+active_since_param = openapi.Parameter('active_since', openapi.IN_QUERY,
+                                       description="only testers who logged in on or after this day",
+                                       type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE)
+ids_param = openapi.Parameter('ids', openapi.IN_QUERY,
+                              description="only devices with these ids, unknown ids are skipped",
+                              type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_INTEGER))
+device_limit_param = openapi.Parameter('limit', openapi.IN_QUERY,
+                                       description="maximum number of devices to return, link to the next page is "
+                                                   "returned in the 'Link' header",
+                                       type=openapi.TYPE_INTEGER, minimum=1)
+stream_param = openapi.Parameter('stream', openapi.IN_QUERY,
+                                 description="streams the results as newline delimited JSON objects or as a JSON array",
+                                 type=openapi.TYPE_STRING, enum=list(STREAM_FORMATS))
+mode_param = openapi.Parameter('mode', openapi.IN_QUERY,
+                               description="'approx' ranks testers from per device summaries, returning "
+                                           "the top 'limit' (20 by default) testers. The estimated experience "
+                                           "differs from the exact one by at most the 'Experience-Error-Bound' header",
+                               type=openapi.TYPE_STRING, enum=list(MATCH_MODES))
+
+tester_schema = openapi.Schema(type=openapi.TYPE_OBJECT, properties={
+    'experience': openapi.Schema(type=openapi.TYPE_INTEGER),
+    'first_name': openapi.Schema(type=openapi.TYPE_STRING),
+    'last_name': openapi.Schema(type=openapi.TYPE_STRING),
+    'country': openapi.Schema(type=openapi.TYPE_STRING),
+})
+batch_response = openapi.Response('list of testers ordered by experience for every query',
+                                  openapi.Schema(type=openapi.TYPE_ARRAY,
+                                                 items=openapi.Schema(type=openapi.TYPE_ARRAY, items=tester_schema)))
+
+swagger_auto_schema(method='get', manual_parameters=[devices_param, countries_param, limit_param, cursor_param,
+                                                     since_param, until_param, decay_param, active_since_param,
+                                                     stream_param, mode_param],
+                    responses={200: testers_response},
+                    operation_description='Returns list of testers ordered by experience')(match_testers)
+swagger_auto_schema(method='post', request_body=MatchBatchSerializer, responses={200: batch_response},
+                    operation_description='Returns list of testers ordered by experience for each of many queries'
+                    )(match_testers_batch)
+swagger_auto_schema(method='get', operation_description='Returns hit and miss counters of the match-testers cache'
+                    )(match_testers_cache_stats)
+swagger_auto_schema(manual_parameters=[ids_param, device_limit_param, cursor_param],
+                    operation_description='Returns devices ordered by id, unchanged lists are answered with 304 '
+                                          'using ETag and Last-Modified')(DeviceList.get)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class TestersConfig(AppConfig):
     name = 'testers'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,158 @@
+import datetime
+import math
+import random
+import statistics
+import time
+import tracemalloc
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .experience import rebuild_experience
+from .loading import BulkLoader, reset_sequences
+from .models import Bug, Device, Tester, SUPPORTED_COUNTRIES
+from .versioning import bump_data_version
+
+TesterDevice = Tester.devices.through
+
+# Share of bugs reported on devices the tester owns, the rest go to random devices
+OWNED_BUG_SHARE = 0.8
+# Bugs are reported at random times over this period before the dataset is generated
+REPORTING_PERIOD = datetime.timedelta(days=365)
+
+
+def country_weights(skew):
+    # Zipf-like weights, 0 means uniform distribution of testers between countries
+    return [1 / (i + 1) ** skew for i in range(len(SUPPORTED_COUNTRIES))]
+
+
+def generate_dataset(testers, devices, bugs, ownership_density=0.3, country_skew=0.0, seed=0, batch_size=10000,
+                     progress=None):
+    """
+    Inserts a random dataset into empty tables, each tester owns every device with probability ownership_density.
+    """
+    rng = random.Random(seed)
+    loader = BulkLoader(batch_size, progress)
+    now = timezone.now()
+    countries = [c[0] for c in SUPPORTED_COUNTRIES]
+    weights = country_weights(country_skew)
+
+    loader.load(((i, 'Device {}'.format(i)) for i in range(1, devices + 1)),
+                (Device, ('id', 'description'), tuple))
+    loader.load(((i, 'First {}'.format(rng.randrange(testers)), 'Last {}'.format(rng.randrange(testers)),
+                  rng.choices(countries, weights)[0], now) for i in range(1, testers + 1)),
+                (Tester, ('id', 'first_name', 'last_name', 'country', 'last_login'), tuple))
+
+    owned = {t: [d for d in range(1, devices + 1) if rng.random() < ownership_density]
+             for t in range(1, testers + 1)}
+    loader.load(((t, d) for t, tester_devices in owned.items() for d in tester_devices),
+                (TesterDevice, ('tester_id', 'device_id'), tuple))
+
+    def bug_rows():
+        for i in range(1, bugs + 1):
+            tester_id = rng.randint(1, testers)
+            if owned[tester_id] and rng.random() < OWNED_BUG_SHARE:
+                device_id = rng.choice(owned[tester_id])
+            else:
+                device_id = rng.randint(1, devices)
+            yield i, device_id, tester_id, now - rng.random() * REPORTING_PERIOD
+
+    loader.load(bug_rows(), (Bug, ('id', 'device_id', 'tester_id', 'reported_at'), tuple))
+
+    reset_sequences()
+    rebuild_experience()
+    bump_data_version(devices=True)
+
+
+def filter_shapes(seed=0):
+    # Device selections of different sizes combined with country filters
+    rng = random.Random(seed)
+    device_ids = list(Device.objects.order_by('id').values_list('id', flat=True))
+    countries = [c[0] for c in SUPPORTED_COUNTRIES]
+
+    device_selections = [('all devices', [])]
+    for size in (1, max(1, len(device_ids) // 10), max(1, len(device_ids) // 2)):
+        device_selections.append(('{} devices'.format(size), sorted(rng.sample(device_ids, size))))
+
+    country_selections = [('all countries', []), ('1 country', countries[:1]), ('2 countries', countries[:2])]
+
+    return [('{}, {}'.format(d_name, c_name), d, c)
+            for d_name, d in device_selections for c_name, c in country_selections]
+
+
+def percentile(values, p):
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def measure(request_func, repeats, before_request=None):
+    """
+    Times request_func and returns latency percentiles in milliseconds, queries per request and peak memory.
+    Memory is traced in a separate call, tracemalloc slows down the code it measures.
+    """
+    before_request = before_request or (lambda: None)
+    timings, queries, response_bytes = [], [], 0
+    for _ in range(repeats):
+        before_request()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = request_func()
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured.captured_queries))
+        response_bytes = len(response.content)
+
+    before_request()
+    tracemalloc.start()
+    try:
+        request_func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'requests': repeats,
+        'mean_ms': statistics.mean(timings),
+        'p50_ms': percentile(timings, 50),
+        'p95_ms': percentile(timings, 95),
+        'p99_ms': percentile(timings, 99),
+        'queries_per_request': statistics.mean(queries),
+        'peak_memory_bytes': peak_memory,
+        'response_bytes': response_bytes,
+    }
+
+
+def load_test(url, concurrency, requests, timeout=30):
+    """
+    Sends requests to a running server from concurrency threads at once and returns throughput,
+    latency percentiles in milliseconds and the number of failed requests.
+    """
+    def send(_):
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                response.read()
+            ok = True
+        except OSError:
+            # Connection errors, timeouts and error statuses
+            ok = False
+        return ok, (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(send, range(requests)))
+    duration = time.perf_counter() - started
+
+    timings = [t for ok, t in results if ok]
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': requests - len(timings),
+        'requests_per_s': len(timings) / duration,
+        'p50_ms': percentile(timings, 50) if timings else None,
+        'p95_ms': percentile(timings, 95) if timings else None,
+        'p99_ms': percentile(timings, 99) if timings else None,
+    }
@@ -0,0 +1,54 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .versioning import get_data_version
+
+_HITS_KEY = 'match-testers:hits'
+_MISSES_KEY = 'match-testers:misses'
+
+
+def _cache():
+    return caches[settings.MATCH_CACHE_ALIAS]
+
+
+def response_key(devices, countries, **params):
+    # Equivalent queries share a key, the data version makes entries from before any change unreachable
+    normalised = {
+        'devices': sorted(set(devices)),
+        'countries': sorted(set(countries)),
+        'params': sorted(params.items()),
+    }
+    digest = hashlib.sha1(json.dumps(normalised).encode('utf-8')).hexdigest()
+    return 'match-testers:{}:{}'.format(get_data_version(), digest)
+
+
+def response_etag(key):
+    return '"{}"'.format(hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+def get_response(key):
+    cached = _cache().get(key)
+    _count(_HITS_KEY if cached is not None else _MISSES_KEY)
+    return cached
+
+
+def set_response(key, value):
+    _cache().set(key, value, settings.MATCH_CACHE_TIMEOUT)
+
+
+def _count(counter_key):
+    cache = _cache()
+    cache.add(counter_key, 0, None)
+    try:
+        cache.incr(counter_key)
+    except ValueError:
+        # Counter was evicted between add and incr
+        cache.set(counter_key, 1, None)
+
+
+def cache_stats():
+    counters = _cache().get_many([_HITS_KEY, _MISSES_KEY])
+    return {'hits': counters.get(_HITS_KEY, 0), 'misses': counters.get(_MISSES_KEY, 0)}
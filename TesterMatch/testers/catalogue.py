@@ -0,0 +1,89 @@
+import base64
+import binascii
+import gzip
+import hashlib
+import json
+import threading
+from bisect import bisect_right
+
+from .models import Device
+from .serializers import render_devices
+from .versioning import get_device_version
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class InvalidDeviceCursor(ValueError):
+    pass
+
+
+def encode_device_cursor(device_id):
+    return base64.urlsafe_b64encode(json.dumps([device_id]).encode('utf-8')).decode('ascii')
+
+
+def decode_device_cursor(value):
+    # Cursor is the id of the last device on the previous page
+    try:
+        device_id, = json.loads(base64.urlsafe_b64decode(value.encode('ascii')))
+    except (binascii.Error, UnicodeError, TypeError, ValueError):
+        raise InvalidDeviceCursor(value)
+
+    if not isinstance(device_id, int):
+        raise InvalidDeviceCursor(value)
+    return device_id
+
+
+class Catalogue:
+    """
+    All devices ordered by id, rendered and compressed once per device version. The ETag is a hash of the
+    content, so it only changes when the rendered list does.
+    """
+
+    def __init__(self, version, modified_at, rows):
+        self.version = version
+        self.modified_at = modified_at
+        # Rows are (description, id) tuples
+        self.rows = rows
+        self.ids = [device_id for _, device_id in rows]
+        self.rows_by_id = {row[1]: row for row in rows}
+
+        self.content = render_devices(rows)
+        self.etag = hashlib.sha1(self.content).hexdigest()
+        # Precompressed bodies of the whole list in the order of preference, mtime=0 keeps gzip deterministic
+        self.encoded = {}
+        if brotli is not None:
+            self.encoded['br'] = brotli.compress(self.content)
+        self.encoded['gzip'] = gzip.compress(self.content, mtime=0)
+
+    def select(self, ids=None, after=None, limit=None):
+        # Devices with the given ids, after the id of a cursor, at most limit of them
+        if ids is not None:
+            rows = [self.rows_by_id[i] for i in sorted(set(ids)) if i in self.rows_by_id]
+            if after is not None:
+                rows = rows[bisect_right([row[1] for row in rows], after):]
+        else:
+            rows = self.rows[bisect_right(self.ids, after):] if after is not None else self.rows
+        return rows[:limit] if limit is not None else rows
+
+
+_catalogue = {'catalogue': None}
+_catalogue_lock = threading.Lock()
+
+
+def get_catalogue():
+    # Reloaded when the device version changed, Device signals and imports bump it
+    version, modified_at = get_device_version()
+    catalogue = _catalogue['catalogue']
+    if catalogue is not None and catalogue.version == version:
+        return catalogue
+
+    with _catalogue_lock:
+        catalogue = _catalogue['catalogue']
+        if catalogue is None or catalogue.version != version:
+            rows = list(Device.objects.order_by('id').values_list('description', 'id'))
+            catalogue = Catalogue(version, modified_at, rows)
+            _catalogue['catalogue'] = catalogue
+    return catalogue
@@ -0,0 +1,212 @@
+"""
+Match data file, a read-only copy of everything the in-memory engine needs, served without a database.
+
+The file starts with a header (magic bytes and number of sections) followed by a table of sections (name, offset,
+size). Sections are fixed-width little-endian arrays aligned to 64 bytes, so they are used straight from the memory
+mapped file: workers of one machine share the pages through the page cache and loading doesn't read the data.
+Names are stored as string tables, an array of offsets into the concatenated UTF-8 strings.
+"""
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .engine import COUNTRY_CODES, MatchIndex, np
+
+MAGIC = b'TMDATA\x00\x01'
+HEADER = struct.Struct('<8sI')
+SECTION = struct.Struct('<16sQQ')
+ALIGNMENT = 64
+
+# Section names and array types, '' sections are raw bytes
+SECTIONS = {
+    'version': '',
+    'tester_ids': '<i8',
+    'first_names': '<u8',
+    'first_name_data': '',
+    'last_names': '<u8',
+    'last_name_data': '',
+    'country_codes': '<u1',
+    'countries': '<u8',
+    'country_data': '',
+    'device_ids': '<i8',
+    'counts': '<u4',
+    'owned': '|b1',
+    'total_experience': '<u8',
+}
+
+
+class InvalidDataFile(ValueError):
+    pass
+
+
+class StringTable:
+    # Sequence of strings decoded on access, the i-th string is buffer[start + offsets[i]:start + offsets[i + 1]]
+
+    def __init__(self, offsets, buffer, start):
+        self.offsets = offsets
+        self.buffer = buffer
+        self.start = start
+        self._offset = offsets.item
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.buffer[self.start + self._offset(i):self.start + self._offset(i + 1)].decode('utf-8')
+
+
+class CodedStrings:
+    # Sequence of strings stored as codes into a short list of distinct values
+
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.values[self.codes.item(i)]
+
+
+def _string_table(values):
+    data = [v.encode('utf-8') for v in values]
+    offsets = np.zeros(len(data) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(d) for d in data], dtype=np.uint64)
+    return offsets, b''.join(data)
+
+
+def write_data_file(index, path):
+    """
+    Writes the arrays of a MatchIndex to path. The file is written next to it and renamed, so processes
+    serving the previous file never read a partially written one.
+    """
+    # Supported countries keep the codes of the engine, other values are appended
+    countries = list(COUNTRY_CODES) + sorted(set(index.countries) - set(COUNTRY_CODES))
+    country_columns = {c: i for i, c in enumerate(countries)}
+    if len(countries) > 256:
+        raise InvalidDataFile('Too many distinct countries')
+
+    first_names, first_name_data = _string_table(index.first_names)
+    last_names, last_name_data = _string_table(index.last_names)
+    country_offsets, country_data = _string_table(countries)
+    sections = {
+        'version': index.version.encode('utf-8'),
+        'tester_ids': index.tester_ids,
+        'first_names': first_names,
+        'first_name_data': first_name_data,
+        'last_names': last_names,
+        'last_name_data': last_name_data,
+        'country_codes': [country_columns[c] for c in index.countries],
+        'countries': country_offsets,
+        'country_data': country_data,
+        'device_ids': index.device_ids,
+        'counts': index.counts,
+        'owned': index.owned,
+        'total_experience': index.total_experience,
+    }
+    sections = {name: value if SECTIONS[name] == '' else np.ascontiguousarray(value, dtype=SECTIONS[name]).tobytes()
+                for name, value in sections.items()}
+
+    table = []
+    offset = HEADER.size + SECTION.size * len(sections)
+    for name, data in sections.items():
+        offset += -offset % ALIGNMENT
+        table.append((name, offset, len(data)))
+        offset += len(data)
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.match-data-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(table)))
+            for name, offset, size in table:
+                f.write(SECTION.pack(name.encode('ascii'), offset, size))
+            for name, offset, size in table:
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(sections[name])
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return offset
+
+
+def read_data_file(path):
+    # Returns a MatchIndex whose arrays are views of the memory mapped file
+    if np is None:
+        raise ImproperlyConfigured('Match data files require numpy')
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            raise InvalidDataFile('{} is not a match data file'.format(path))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, count = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise InvalidDataFile('{} is not a match data file'.format(path))
+
+    sections = {}
+    for i in range(count):
+        name, offset, size = SECTION.unpack_from(buffer, HEADER.size + i * SECTION.size)
+        if offset + size > len(buffer):
+            raise InvalidDataFile('{} is truncated'.format(path))
+        sections[name.rstrip(b'\0').decode('ascii')] = offset, size
+    if set(sections) != set(SECTIONS):
+        raise InvalidDataFile('{} has unexpected sections'.format(path))
+
+    def section(name):
+        offset, size = sections[name]
+        dtype = np.dtype(SECTIONS[name])
+        return np.frombuffer(buffer, dtype=dtype, count=size // dtype.itemsize, offset=offset)
+
+    def strings(name, data_name):
+        return StringTable(section(name), buffer, sections[data_name][0])
+
+    tester_ids, device_ids = section('tester_ids'), section('device_ids')
+    shape = (len(tester_ids), len(device_ids))
+    country_codes = section('country_codes')
+    countries = strings('countries', 'country_data')
+    version_offset, version_size = sections['version']
+
+    return MatchIndex(buffer[version_offset:version_offset + version_size].decode('utf-8'),
+                      tester_ids=tester_ids,
+                      first_names=strings('first_names', 'first_name_data'),
+                      last_names=strings('last_names', 'last_name_data'),
+                      countries=CodedStrings(country_codes, [countries[i] for i in range(len(countries))]),
+                      device_ids=device_ids.tolist(),
+                      counts=section('counts').reshape(shape),
+                      owned=section('owned').reshape(shape),
+                      country_codes=country_codes,
+                      total_experience=section('total_experience'))
+
+
+_loaded = {'index': None, 'key': None, 'checked_at': 0.0}
+_loaded_lock = threading.Lock()
+
+
+def get_file_index():
+    """
+    Index of the MATCH_DATA_FILE. The file is checked for replacement at most once per
+    DATA_VERSION_CHECK_INTERVAL seconds, a new file is mapped and the previous one released with its index.
+    """
+    now = time.monotonic()
+    if _loaded['index'] is not None and now - _loaded['checked_at'] < settings.DATA_VERSION_CHECK_INTERVAL:
+        return _loaded['index']
+
+    path = settings.MATCH_DATA_FILE
+    if not path:
+        raise ImproperlyConfigured('MATCH_DATA_FILE has to be set for the mmap matching engine')
+
+    with _loaded_lock:
+        stat = os.stat(path)
+        key = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if _loaded['key'] != key:
+            _loaded.update(index=read_data_file(path), key=key)
+        _loaded['checked_at'] = now
+        return _loaded['index']
@@ -0,0 +1,183 @@
+import bisect
+import threading
+from functools import cached_property
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Count, Q
+
+from .models import Bug, Device, Tester, SUPPORTED_COUNTRIES
+from .parallel import ParallelRanker
+from .versioning import get_data_version
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COUNTRY_CODES = {c[0]: i for i, c in enumerate(SUPPORTED_COUNTRIES)}
+
+
+class MatchIndex:
+    """
+    Compact in-memory copy of the data needed for matching testers.
+
+    Testers are stored in the order of (last_name, first_name, id) as sorted by the database, so a stable sort
+    by experience gives exactly the same ordering as the ORM query, including the database collation.
+
+    Columns may be lists or any sequences, country codes and total experience can be passed precomputed
+    when the index is loaded from a match data file. Only an index loaded from the database can ask the
+    database where a changed tester is placed, file indexes compare names by code points instead.
+    """
+
+    def __init__(self, version, tester_ids, first_names, last_names, countries, device_ids, counts, owned,
+                 country_codes=None, total_experience=None, in_database=False):
+        self.version = version
+        self.in_database = in_database
+        self.tester_ids = tester_ids
+        self.first_names = first_names
+        self.last_names = last_names
+        self.countries = countries
+        if country_codes is None:
+            country_codes = np.array([COUNTRY_CODES.get(c, len(COUNTRY_CODES)) for c in countries], dtype=np.uint8)
+        self.country_codes = country_codes
+        self.device_ids = device_ids
+        self.device_columns = {device_id: i for i, device_id in enumerate(device_ids)}
+
+        # Bug counts per tester and device, and a mask of devices the tester currently owns
+        self.counts = counts
+        self.owned = owned
+        self.total_experience = (counts * owned).sum(axis=1) if total_experience is None else total_experience
+
+        self._rankers = {}
+        self._rankers_lock = threading.Lock()
+
+    @cached_property
+    def tester_rows(self):
+        # Only needed to find the position of a pagination cursor
+        return {int(tester_id): row for row, tester_id in enumerate(self.tester_ids)}
+
+    @cached_property
+    def name_keys(self):
+        return [(self.last_names[r], self.first_names[r], int(self.tester_ids[r])) for r in range(len(self.tester_ids))]
+
+    @classmethod
+    def from_database(cls, version):
+        if np is None:
+            raise ImproperlyConfigured('In-memory matching engine requires numpy')
+
+        testers = list(Tester.objects.order_by('last_name', 'first_name', 'id')
+                       .values_list('id', 'first_name', 'last_name', 'country'))
+        device_ids = list(Device.objects.order_by('id').values_list('id', flat=True))
+
+        tester_rows = {t[0]: i for i, t in enumerate(testers)}
+        device_columns = {device_id: i for i, device_id in enumerate(device_ids)}
+
+        # Tables are read by separate queries, testers and devices added in between are skipped here. Adding them
+        # bumps the data version, so the next index includes them.
+        def cells(rows):
+            for tester_id, device_id, *value in rows:
+                row, column = tester_rows.get(tester_id), device_columns.get(device_id)
+                if row is not None and column is not None:
+                    yield row, column, value
+
+        counts = np.zeros((len(testers), len(device_ids)), dtype=np.uint32)
+        bug_counts = Bug.objects.values_list('tester_id', 'device_id').annotate(n=Count('id')).order_by()
+        for row, column, (n,) in cells(bug_counts.iterator()):
+            counts[row, column] = n
+
+        owned = np.zeros((len(testers), len(device_ids)), dtype=np.bool_)
+        ownership = Tester.devices.through.objects.values_list('tester_id', 'device_id')
+        for row, column, _ in cells(ownership.iterator()):
+            owned[row, column] = True
+
+        return cls(version,
+                   tester_ids=[t[0] for t in testers],
+                   first_names=[t[1] for t in testers],
+                   last_names=[t[2] for t in testers],
+                   countries=[t[3] for t in testers],
+                   device_ids=device_ids,
+                   counts=counts,
+                   owned=owned,
+                   in_database=True)
+
+    def _columns(self, devices):
+        return sorted({self.device_columns[d] for d in devices if d in self.device_columns})
+
+    def experience(self, devices=None):
+        if not devices:
+            return self.total_experience
+
+        columns = self._columns(devices)
+        return (self.counts[:, columns] * self.owned[:, columns]).sum(axis=1)
+
+    def ranker(self, workers):
+        # Process pools are started on first use and stopped when the index is replaced
+        with self._rankers_lock:
+            if workers not in self._rankers:
+                self._rankers[workers] = ParallelRanker(self.counts, self.owned, self.country_codes, workers)
+            return self._rankers[workers]
+
+    def rank(self, devices=None, countries=None):
+        # Returns (row, experience) pairs ordered the same way as the ORM query in match_testers
+        codes = [COUNTRY_CODES[c] for c in countries] if countries else None
+        if settings.MATCHING_WORKERS > 1:
+            return self.ranker(settings.MATCHING_WORKERS).rank(self._columns(devices) if devices else None, codes)
+
+        experience = self.experience(devices)
+        if codes:
+            rows = np.flatnonzero(np.isin(self.country_codes, codes))
+        else:
+            rows = np.arange(len(self.tester_ids))
+
+        # Rows are already in name order, so a stable sort keeps the last_name/first_name tiebreak
+        rows = rows[np.argsort(-experience[rows].astype(np.int64), kind='stable')]
+        return [(int(row), int(experience[row])) for row in rows]
+
+    def _cursor_row(self, last_name, first_name, tester_id):
+        row = self.tester_rows.get(tester_id)
+        if row is not None and (self.last_names[row], self.first_names[row]) == (last_name, first_name):
+            return row
+
+        # Tester changed since the cursor was issued, its position among the names is used instead. Rows follow
+        # the database collation, so the database counts the testers placed before the cursor.
+        if self.in_database:
+            before = Tester.objects.filter(Q(last_name__lt=last_name)
+                                           | Q(last_name=last_name, first_name__lt=first_name)
+                                           | Q(last_name=last_name, first_name=first_name, id__lt=tester_id))
+            return before.count() - 0.5
+        return bisect.bisect_left(self.name_keys, (last_name, first_name, tester_id)) - 0.5
+
+    def match(self, devices=None, countries=None, after=None):
+        ranked = self.rank(devices, countries)
+
+        if after is not None:
+            experience, last_name, first_name, tester_id = after
+            cursor_key = (-experience, self._cursor_row(last_name, first_name, tester_id))
+            ranked = ranked[bisect.bisect_right([(-e, row) for row, e in ranked], cursor_key):]
+
+        return [(experience, self.first_names[row], self.last_names[row], self.countries[row],
+                 int(self.tester_ids[row])) for row, experience in ranked]
+
+
+_index = {'index': None}
+_index_lock = threading.Lock()
+
+
+def get_match_index():
+    # Rebuilds the index when the data version changed since it was loaded
+    if settings.MATCHING_ENGINE == 'mmap':
+        from .datafile import get_file_index
+        return get_file_index()
+
+    version = get_data_version()
+    index = _index['index']
+    if index is not None and index.version == version:
+        return index
+
+    with _index_lock:
+        index = _index['index']
+        if index is None or index.version != version:
+            index = MatchIndex.from_database(version)
+            _index['index'] = index
+    return index
@@ -0,0 +1,195 @@
+import datetime
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncDate
+
+from . import sketches
+from .models import Bug, Tester, TesterDeviceDayExperience, TesterDeviceExperience
+
+TesterDevice = Tester.devices.through
+
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def day_number(value):
+    # Days since the epoch in UTC, so the age of a day bucket is plain integer arithmetic in SQL
+    if isinstance(value, datetime.datetime):
+        value = value.astimezone(datetime.timezone.utc).date()
+    return (value - EPOCH).days
+
+
+def increment(tester_id, device_id, delta):
+    # Rows only exist for owned devices, so bugs on devices the tester doesn't have are ignored here
+    updated = TesterDeviceExperience.objects.filter(tester_id=tester_id, device_id=device_id) \
+        .update(bug_count=F('bug_count') + delta)
+    if updated:
+        Tester.objects.filter(id=tester_id).update(total_experience=F('total_experience') + delta)
+        sketches.add_counts(device_id, {tester_id: delta})
+
+
+def increment_day(tester_id, device_id, reported_at, delta):
+    # Bugs without a report time are left out of the day buckets
+    if reported_at is None:
+        return
+
+    day = day_number(reported_at)
+    updated = TesterDeviceDayExperience.objects.filter(tester_id=tester_id, device_id=device_id, day=day) \
+        .update(bug_count=F('bug_count') + delta)
+    if not updated and delta > 0 and TesterDevice.objects.filter(tester_id=tester_id, device_id=device_id).exists():
+        TesterDeviceDayExperience.objects.create(tester_id=tester_id, device_id=device_id, day=day, bug_count=delta)
+
+
+def add_ownership(**ownership_filter):
+    # Creates experience rows for newly owned devices, counting bugs reported on them so far
+    pairs = TesterDevice.objects.filter(**ownership_filter).values_list('tester_id', 'device_id')
+    existing = set(TesterDeviceExperience.objects.filter(**ownership_filter).values_list('tester_id', 'device_id'))
+    missing = [pair for pair in pairs if pair not in existing]
+    if not missing:
+        return
+
+    tester_ids = {t for t, _ in missing}
+    device_ids = {d for _, d in missing}
+    counts = dict(((t, d), n) for t, d, n in Bug.objects
+                  .filter(tester_id__in=tester_ids, device_id__in=device_ids)
+                  .values_list('tester_id', 'device_id')
+                  .annotate(n=Count('id'))
+                  .order_by())
+
+    TesterDeviceExperience.objects.bulk_create(
+        [TesterDeviceExperience(tester_id=t, device_id=d, bug_count=counts.get((t, d), 0)) for t, d in missing])
+    _add_sketch_counts((t, d, counts.get((t, d), 0)) for t, d in missing)
+
+    missing = set(missing)
+    TesterDeviceDayExperience.objects.bulk_create(
+        [TesterDeviceDayExperience(tester_id=t, device_id=d, day=day, bug_count=n)
+         for t, d, day, n in _day_counts(tester_id__in=tester_ids, device_id__in=device_ids) if (t, d) in missing])
+    refresh_total_experience(tester_ids)
+
+
+def remove_ownership(**ownership_filter):
+    removed = list(TesterDeviceExperience.objects.filter(**ownership_filter)
+                   .values_list('tester_id', 'device_id', 'bug_count'))
+    TesterDeviceExperience.objects.filter(**ownership_filter).delete()
+    TesterDeviceDayExperience.objects.filter(**ownership_filter).delete()
+    refresh_total_experience({t for t, _, _ in removed})
+    _add_sketch_counts((t, d, -n) for t, d, n in removed)
+
+
+def _add_sketch_counts(rows):
+    # Adds (tester_id, device_id, delta) rows to the summaries of the devices
+    deltas = defaultdict(dict)
+    for tester_id, device_id, delta in rows:
+        if delta:
+            deltas[device_id][tester_id] = delta
+    for device_id, device_deltas in deltas.items():
+        sketches.add_counts(device_id, device_deltas)
+
+
+def refresh_total_experience(tester_ids=None):
+    # Sets total experience of all testers, or of the given ones, to the sum of their experience rows
+    totals = TesterDeviceExperience.objects.filter(tester_id=OuterRef('pk')).order_by() \
+        .values('tester_id').annotate(total=Sum('bug_count')).values('total')
+    testers = Tester.objects.all() if tester_ids is None else Tester.objects.filter(id__in=tester_ids)
+    return testers.update(total_experience=Coalesce(Subquery(totals), 0))
+
+
+def _day_counts(**bug_filter):
+    # Yields (tester_id, device_id, day, bug count) of bugs with a report time
+    rows = Bug.objects.filter(reported_at__isnull=False, **bug_filter) \
+        .annotate(date=TruncDate('reported_at', tzinfo=datetime.timezone.utc)) \
+        .values_list('tester_id', 'device_id', 'date') \
+        .annotate(n=Count('id')) \
+        .order_by()
+    for tester_id, device_id, date, n in rows.iterator():
+        yield tester_id, device_id, day_number(date), n
+
+
+@transaction.atomic
+def rebuild_experience(tester_ids=None):
+    # Rebuilds all rows, or only rows of the given testers and the summaries of the devices they own or owned
+    if tester_ids is None:
+        TesterDeviceExperience.objects.all().delete()
+        TesterDeviceDayExperience.objects.all().delete()
+        _insert_day_experience()
+        rows = _insert_experience()
+        refresh_total_experience()
+        sketches.rebuild_sketches()
+        return rows
+
+    tester_ids = list(tester_ids)
+    batch_size = connection.features.max_query_params or len(tester_ids) or 1
+    rows, device_ids = 0, set()
+    for i in range(0, len(tester_ids), batch_size):
+        batch = tester_ids[i:i + batch_size]
+        experience_rows = TesterDeviceExperience.objects.filter(tester_id__in=batch)
+        device_ids.update(experience_rows.values_list('device_id', flat=True))
+        experience_rows.delete()
+        TesterDeviceDayExperience.objects.filter(tester_id__in=batch).delete()
+        _insert_day_experience(tester_id__in=batch)
+        rows += _insert_experience('WHERE td.tester_id IN ({}) '.format(', '.join(['%s'] * len(batch))), batch)
+        device_ids.update(experience_rows.values_list('device_id', flat=True))
+        refresh_total_experience(batch)
+    sketches.rebuild_sketches(device_ids)
+    return rows
+
+
+def _insert_day_experience(**bug_filter):
+    # Days are numbered in Python, date arithmetic differs between the databases
+    owned = set(TesterDevice.objects.filter(**bug_filter).values_list('tester_id', 'device_id').iterator())
+    rows = (TesterDeviceDayExperience(tester_id=t, device_id=d, day=day, bug_count=n)
+            for t, d, day, n in _day_counts(**bug_filter) if (t, d) in owned)
+    TesterDeviceDayExperience.objects.bulk_create(rows, batch_size=10000)
+
+
+def _insert_experience(where='', params=()):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {experience} (tester_id, device_id, bug_count) '
+            'SELECT td.tester_id, td.device_id, COUNT(b.id) '
+            'FROM {tester_device} td '
+            'LEFT JOIN {bug} b ON b.tester_id = td.tester_id AND b.device_id = td.device_id '
+            '{where}'
+            'GROUP BY td.tester_id, td.device_id'.format(
+                experience=TesterDeviceExperience._meta.db_table,
+                tester_device=TesterDevice._meta.db_table,
+                bug=Bug._meta.db_table,
+                where=where), params)
+        return cursor.rowcount
+
+
+def live_experience():
+    # The original aggregate over Bug and the tester_device table, used as the source of truth
+    return dict(Tester.objects.annotate(experience=Count('bug', filter=Q(bug__device__in=F('devices'))))
+                .values_list('id', 'experience'))
+
+
+def stored_experience():
+    stored = dict(TesterDeviceExperience.objects.values('tester_id').annotate(experience=Sum('bug_count'))
+                  .values_list('tester_id', 'experience').order_by())
+    return {tester_id: stored.get(tester_id, 0) for tester_id in Tester.objects.values_list('id', flat=True)}
+
+
+def experience_mismatches():
+    # Experience rows and total experience of testers which differ from the live aggregate
+    live = live_experience()
+    stored = stored_experience()
+    totals = dict(Tester.objects.values_list('id', 'total_experience'))
+    mismatches = {}
+    for tester_id, live_count in live.items():
+        for stored_count in (stored.get(tester_id), totals.get(tester_id)):
+            if stored_count != live_count:
+                mismatches[tester_id] = (stored_count, live_count)
+                break
+    return mismatches
+
+
+def day_experience_mismatches():
+    # Day buckets compared with bugs on owned devices counted per day, keyed by (tester_id, device_id, day)
+    owned = set(TesterDevice.objects.values_list('tester_id', 'device_id').iterator())
+    live = {(t, d, day): n for t, d, day, n in _day_counts() if (t, d) in owned}
+    stored = {(t, d, day): n for t, d, day, n in TesterDeviceDayExperience.objects.filter(bug_count__gt=0)
+              .values_list('tester_id', 'device_id', 'day', 'bug_count').iterator()}
+    return {key: (stored.get(key), live.get(key)) for key in live.keys() | stored.keys()
+            if stored.get(key) != live.get(key)}
@@ -0,0 +1,387 @@
+import csv
+import datetime
+import io
+import os
+import time
+from itertools import islice
+
+import pytz
+from django.core.management.color import no_style
+from django.db import connection
+
+from .models import Bug, Device, DeviceSketch, Tester
+from .partitioning import partition_key, table_definitions
+
+DATA_TIMEZONE = pytz.utc
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+TesterDevice = Tester.devices.through
+
+
+def read_rows(path):
+    # Yields rows of a CSV file one by one, skipping the header and empty lines
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if row:
+                yield row
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    batch = list(islice(rows, size))
+    while batch:
+        yield batch
+        batch = list(islice(rows, size))
+
+
+def parse_timestamp(value):
+    return datetime.datetime.strptime(value, TIMESTAMP_FORMAT).replace(tzinfo=DATA_TIMEZONE)
+
+
+def parse_reported_at(row):
+    # Report time is an optional fourth column of bugs.csv
+    return parse_timestamp(row[3]) if len(row) > 3 and row[3] else None
+
+
+# Model, columns and mapping from a CSV row to column values for every imported file
+DEVICES = (Device, ('id', 'description'), lambda row: (int(row[0]), row[1]))
+TESTERS = (Tester, ('id', 'first_name', 'last_name', 'country', 'last_login'),
+           lambda row: (int(row[0]), row[1], row[2], row[3], parse_timestamp(row[4])))
+BUGS = (Bug, ('id', 'device_id', 'tester_id', 'reported_at'),
+        lambda row: (int(row[0]), int(row[1]), int(row[2]), parse_reported_at(row)))
+TESTER_DEVICES = (TesterDevice, ('tester_id', 'device_id'), lambda row: (int(row[0]), int(row[1])))
+# Files which populate_db --workers splits into shards
+SHARDED_TABLES = {'bugs': BUGS, 'tester_devices': TESTER_DEVICES}
+
+
+def insert_defaults(model, columns):
+    # Fields which aren't imported from the files, like denormalised totals, get their defaults on insert
+    return [f for f in model._meta.concrete_fields
+            if f.attname not in columns and not f.primary_key and f.has_default()]
+
+
+class BulkLoader:
+    """
+    Loads CSV rows in batches of batch_size, using COPY FROM STDIN on PostgreSQL and bulk_create elsewhere.
+    """
+
+    def __init__(self, batch_size, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.use_copy = connection.vendor == 'postgresql'
+
+    def load(self, rows, table):
+        model, columns, map_row = table
+        loaded = 0
+        started = time.monotonic()
+
+        for batch in batches(rows, self.batch_size):
+            values = [map_row(row) for row in batch]
+            if self.use_copy:
+                self._copy(model, columns, values)
+            else:
+                model.objects.bulk_create([model(**dict(zip(columns, v))) for v in values])
+
+            loaded += len(values)
+            if self.progress:
+                elapsed = time.monotonic() - started
+                self.progress(model._meta.db_table, loaded, loaded / elapsed if elapsed else 0)
+
+        return loaded
+
+    @staticmethod
+    def _copy(model, columns, values):
+        defaults = insert_defaults(model, columns)
+        columns = tuple(columns) + tuple(f.attname for f in defaults)
+        values = [tuple(v) + tuple(f.get_default() for f in defaults) for v in values]
+        copy_rows(model._meta.db_table, columns, [c for c in columns if model._meta.get_field(c).null], values)
+
+
+def copy_rows(table, columns, nullable, values):
+    # COPY FROM STDIN on PostgreSQL
+    buffer = io.StringIO()
+    # Quoting every value keeps empty strings from being read as NULL, except in nullable columns
+    writer = csv.writer(buffer, quoting=csv.QUOTE_ALL)
+    writer.writerows(values)
+    buffer.seek(0)
+
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv{})'.format(
+            qn(table),
+            ', '.join(qn(c) for c in columns),
+            ', FORCE_NULL ({})'.format(', '.join(qn(c) for c in nullable)) if nullable else ''), buffer)
+
+
+def shard_ranges(path, shards):
+    """
+    Splits the rows of a CSV file after the header into at most shards byte ranges of about the same size,
+    starting at line boundaries. Rows must not contain line breaks.
+    """
+    with open(path, 'rb') as f:
+        f.readline()
+        start, size = f.tell(), os.fstat(f.fileno()).st_size
+        bounds = [start]
+        for i in range(1, shards):
+            offset = start + (size - start) * i // shards
+            if offset <= bounds[-1]:
+                continue
+            # Moves to the start of the next line, unless offset already starts one
+            f.seek(offset - 1)
+            f.readline()
+            if bounds[-1] < f.tell() < size:
+                bounds.append(f.tell())
+    return [(s, e) for s, e in zip(bounds, bounds[1:] + [size]) if s < e]
+
+
+def read_shard(path, start, end):
+    # Yields rows of a byte range from shard_ranges like read_rows
+    with open(path, 'rb') as f:
+        f.seek(start)
+
+        def lines():
+            while f.tell() < end:
+                line = f.readline()
+                if not line:
+                    return
+                yield line.decode('utf-8')
+
+        for row in csv.reader(lines()):
+            if row:
+                yield row
+
+
+class StagingTable:
+    """
+    Table which the shards of a file are loaded into in parallel, by separate processes and connections. Rows of
+    files without ids get ids from their position in the file, so ids are the same as after a single process import.
+
+    On PostgreSQL the table is created like the table of the model and gets its indexes and constraints other than
+    foreign keys before the import transaction. move_into then drops the empty table of the model and renames the
+    staging table in its place, so the transaction only renames objects and checks foreign keys. Partitioned tables
+    and other databases have the rows copied in the order of ids instead.
+    """
+
+    def __init__(self, table, name):
+        self.model, columns, _ = table
+        self.columns = columns if 'id' in columns else ('id',) + tuple(columns)
+        self.name = name
+        self.rows = 0
+
+    def _swapped(self):
+        return connection.vendor == 'postgresql' and partition_key(connection, self.model) is None
+
+    def create(self):
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Copied rows are only needed until the import commits, they skip the write-ahead log
+                cursor.execute('CREATE {}TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING '
+                               'CONSTRAINTS)'.format('' if self._swapped() else 'UNLOGGED ', qn(self.name),
+                                                     qn(self.model._meta.db_table)))
+            else:
+                cursor.execute('CREATE TABLE {} ({})'.format(qn(self.name), ', '.join(
+                    '{} {}'.format(qn(c), self.model._meta.get_field(c).db_type(connection)) for c in self.columns)))
+
+    def load(self, values, batch_size, first_id=None):
+        # Loads tuples of column values, rows without ids are numbered from first_id. Returns their number.
+        defaults = insert_defaults(self.model, self.columns)
+        columns = self.columns + tuple(f.attname for f in defaults)
+        fields = [self.model._meta.get_field(c) for c in columns]
+        qn = connection.ops.quote_name
+        loaded = 0
+        for batch in batches(values, batch_size):
+            rows = [(first_id + loaded + i,) + tuple(v) if first_id is not None else tuple(v)
+                    for i, v in enumerate(batch)]
+            rows = [row + tuple(f.get_default() for f in defaults) for row in rows]
+            if connection.vendor == 'postgresql':
+                copy_rows(self.name, columns, [f.attname for f in fields if f.null], rows)
+            else:
+                with connection.cursor() as cursor:
+                    cursor.executemany('INSERT INTO {} ({}) VALUES ({})'.format(
+                        qn(self.name), ', '.join(qn(c) for c in columns), ', '.join(['%s'] * len(columns))),
+                        [tuple(f.get_db_prep_save(v, connection) for f, v in zip(fields, row)) for row in rows])
+            loaded += len(rows)
+        return loaded
+
+    def _index_name(self, i):
+        return '{}_{}'.format(self.name, i)
+
+    def build_indexes(self):
+        # Indexes, primary and unique keys of the model's table under temporary names, renamed by move_into
+        if not self._swapped():
+            return
+        qn = connection.ops.quote_name
+        indexes, constraints, _, _ = table_definitions(connection, self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            for i, (_, definition) in enumerate(indexes):
+                method = definition[definition.index(' USING '):]
+                cursor.execute('CREATE {}INDEX {} ON {}{}'.format(
+                    'UNIQUE ' if definition.startswith('CREATE UNIQUE') else '', qn(self._index_name(i)),
+                    qn(self.name), method))
+            for i, (_, constraint_type, definition) in enumerate(constraints, len(indexes)):
+                if constraint_type != 'f':
+                    cursor.execute('ALTER TABLE {} ADD CONSTRAINT {} {}'.format(
+                        qn(self.name), qn(self._index_name(i)), definition))
+
+    def move_into(self):
+        # Moves the staged rows into the empty table of the model, returns their number
+        qn = connection.ops.quote_name
+        table = self.model._meta.db_table
+        columns = ', '.join(qn(c) for c in self.columns)
+        with connection.cursor() as cursor:
+            if not self._swapped():
+                cursor.execute('INSERT INTO {} ({}) SELECT {} FROM {} ORDER BY id'.format(
+                    qn(table), columns, columns, qn(self.name)))
+                return cursor.rowcount
+
+            indexes, constraints, identity, sequence = table_definitions(connection, table)
+            if not identity:
+                # Tables created by older Django versions use serial columns, the sequence moves to the new table
+                cursor.execute('ALTER SEQUENCE {} OWNED BY {}.id'.format(sequence, qn(self.name)))
+            cursor.execute('DROP TABLE {}'.format(qn(table)))
+            cursor.execute('ALTER TABLE {} RENAME TO {}'.format(qn(self.name), qn(table)))
+            if identity:
+                cursor.execute('SELECT pg_get_serial_sequence(%s, \'id\')', [table])
+                cursor.execute('ALTER SEQUENCE {} RENAME TO {}'.format(cursor.fetchone()[0],
+                                                                       sequence.split('.')[-1]))
+
+            for i, (name, _) in enumerate(indexes):
+                cursor.execute('ALTER INDEX {} RENAME TO {}'.format(qn(self._index_name(i)), qn(name)))
+            for i, (name, constraint_type, definition) in enumerate(constraints, len(indexes)):
+                if constraint_type == 'f':
+                    # Checks the staged rows against the devices and testers imported in this transaction
+                    cursor.execute('ALTER TABLE {} ADD CONSTRAINT {} {}'.format(qn(table), qn(name), definition))
+                else:
+                    cursor.execute('ALTER TABLE {} RENAME CONSTRAINT {} TO {}'.format(
+                        qn(table), qn(self._index_name(i)), qn(name)))
+        return self.rows
+
+    def drop(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS {}'.format(connection.ops.quote_name(self.name)))
+
+
+def reset_sequences(models=(Device, Tester, Bug, TesterDevice)):
+    # Rows are imported with explicit ids, sequences have to continue after the highest one
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+class IncrementalLoader:
+    """
+    Applies differences between CSV rows and the database, writing only inserted, updated and deleted rows.
+
+    Raw SQL is used so signal handlers don't run per row, experience of the affected testers is rebuilt with
+    rebuild_experience afterwards.
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.affected_testers = set()
+        self._partitioned = {}
+
+    def is_partitioned(self, model):
+        if model not in self._partitioned:
+            self._partitioned[model] = partition_key(connection, model) is not None
+        return self._partitioned[model]
+
+    def _batch_size(self, columns):
+        # SQLite limits the number of parameters in a single query
+        max_params = connection.features.max_query_params
+        return max(1, min(self.batch_size, max_params // columns)) if max_params else self.batch_size
+
+    def upsert(self, rows, table):
+        # Returns ids of all rows in the file together with the number of inserted and updated rows
+        model, columns, map_row = table
+        seen_ids, inserted, updated = set(), 0, 0
+
+        for batch in batches(rows, self._batch_size(len(columns) + len(insert_defaults(model, columns)))):
+            values = [map_row(row) for row in batch]
+            ids = [v[0] for v in values]
+            seen_ids.update(ids)
+
+            existing = {v[0]: v for v in model.objects.filter(id__in=ids).values_list(*columns)}
+            changed = [v for v in values if existing.get(v[0]) != v]
+            if not changed:
+                continue
+
+            new_rows = sum(1 for v in changed if v[0] not in existing)
+            inserted += new_rows
+            updated += len(changed) - new_rows
+            if model is Bug:
+                self.affected_testers.update(v[2] for v in changed)
+                self.affected_testers.update(existing[v[0]][2] for v in changed if v[0] in existing)
+
+            if self.is_partitioned(model):
+                # Partitioned tables have no unique index on id alone and rows can move to another partition
+                updated_ids = [v[0] for v in changed if v[0] in existing]
+                if updated_ids:
+                    self._delete(model, 'id', updated_ids)
+                self._upsert(model, columns, changed, on_conflict=False)
+            else:
+                self._upsert(model, columns, changed)
+
+        return seen_ids, inserted, updated
+
+    @staticmethod
+    def _upsert(model, columns, values, on_conflict=True):
+        # Defaults are only inserted, updates keep the stored values
+        defaults = insert_defaults(model, columns)
+        fields = [model._meta.get_field(c) for c in columns] + defaults
+        values = [tuple(v) + tuple(f.get_default() for f in defaults) for v in values]
+        params = [f.get_db_prep_save(v, connection) for row in values for f, v in zip(fields, row)]
+        qn = connection.ops.quote_name
+
+        with connection.cursor() as cursor:
+            sql = 'INSERT INTO {} ({}) VALUES {}'.format(
+                qn(model._meta.db_table),
+                ', '.join(qn(f.column) for f in fields),
+                ', '.join(['({})'.format(', '.join(['%s'] * len(fields)))] * len(values)))
+            if on_conflict:
+                sql += ' ON CONFLICT (id) DO UPDATE SET {}'.format(
+                    ', '.join('{0} = EXCLUDED.{0}'.format(qn(c)) for c in columns[1:]))
+            cursor.execute(sql, params)
+
+    def delete_missing(self, model, seen_ids):
+        stale_ids = [i for i in model.objects.values_list('id', flat=True).iterator() if i not in seen_ids]
+
+        for batch in batches(stale_ids, self._batch_size(1)):
+            if model is Bug:
+                self.affected_testers.update(Bug.objects.filter(id__in=batch).values_list('tester_id', flat=True))
+            elif model is Tester:
+                self.affected_testers.update(batch)
+            elif model is Device:
+                # Summaries emptied when the device lost its owners are kept, no rebuild removes them
+                self._delete(DeviceSketch, 'device_id', batch)
+            self._delete(model, 'id', batch)
+
+        return len(stale_ids)
+
+    @staticmethod
+    def _delete(model, column, values):
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE {} IN ({})'.format(
+                qn(model._meta.db_table), qn(column), ', '.join(['%s'] * len(values))), values)
+
+    def sync_tester_devices(self, rows):
+        # Returns the number of added and removed relations
+        incoming = {TESTER_DEVICES[2](row) for row in rows}
+        existing = set(TesterDevice.objects.values_list('tester_id', 'device_id').iterator())
+        added, removed = incoming - existing, existing - incoming
+        self.affected_testers.update(t for t, _ in added | removed)
+
+        for batch in batches(sorted(added), self.batch_size):
+            TesterDevice.objects.bulk_create([TesterDevice(tester_id=t, device_id=d) for t, d in batch])
+
+        with connection.cursor() as cursor:
+            for batch in batches(sorted(removed), self.batch_size):
+                cursor.executemany('DELETE FROM {} WHERE tester_id = %s AND device_id = %s'.format(
+                    connection.ops.quote_name(TesterDevice._meta.db_table)), batch)
+
+        return len(added), len(removed)
@@ -0,0 +1,34 @@
+import threading
+
+from django.conf import settings
+
+from .models import Device, SUPPORTED_COUNTRIES
+from .versioning import get_data_version, get_device_version
+
+COUNTRY_CODES = frozenset(c[0] for c in SUPPORTED_COUNTRIES)
+
+_device_ids = {'version': None, 'ids': frozenset()}
+_device_ids_lock = threading.Lock()
+
+
+def device_ids():
+    # Ids of all devices, reloaded when the device version changed, Device signals bump it. Match data files carry
+    # a single data version.
+    version = get_data_version() if settings.MATCHING_ENGINE == 'mmap' else get_device_version()[0]
+    cached = _device_ids
+    if cached['version'] == version:
+        return cached['ids']
+
+    with _device_ids_lock:
+        if _device_ids['version'] != version:
+            if settings.MATCHING_ENGINE == 'mmap':
+                from .engine import get_match_index
+                ids = frozenset(get_match_index().device_ids)
+            else:
+                ids = frozenset(Device.objects.values_list('id', flat=True))
+            _device_ids.update(version=version, ids=ids)
+        return _device_ids['ids']
+
+
+def devices_exist(devices):
+    return device_ids().issuperset(devices)
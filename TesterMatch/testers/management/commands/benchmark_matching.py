@@ -0,0 +1,133 @@
+import json
+import os
+import platform
+import tempfile
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from testers.benchmark import generate_dataset, filter_shapes, measure
+from testers.datafile import write_data_file
+from testers.engine import MatchIndex
+from testers.models import Device, Tester, Bug
+from testers.versioning import stored_data_version
+from testers.views import match_testers
+
+
+class Command(BaseCommand):
+    help = 'Generates a synthetic dataset and measures match-testers latency for different filters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--testers', type=int, default=1000)
+        parser.add_argument('--devices', type=int, default=100)
+        parser.add_argument('--bugs', type=int, default=100000)
+        parser.add_argument('--ownership-density', type=float, default=0.3,
+                            help='Probability that a tester owns a device')
+        parser.add_argument('--country-skew', type=float, default=1.0,
+                            help='Exponent of the Zipf-like distribution of testers between countries, 0 is uniform')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--requests', type=int, default=50, help='Number of requests per filter shape')
+        parser.add_argument('--engine', choices=('database', 'memory', 'mmap'), default=None,
+                            help='Matching engine, MATCHING_ENGINE setting by default. The mmap engine serves '
+                                 'the data exported to a temporary match data file')
+        parser.add_argument('--workers', type=int, nargs='+',
+                            help='Numbers of ranking processes of the memory engine to compare, '
+                                 'MATCHING_WORKERS setting by default')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Keeps the response cache between requests instead of clearing it')
+        parser.add_argument('--existing-data', action='store_true',
+                            help='Benchmarks data already in the database instead of generating a dataset')
+        parser.add_argument('--clear', action='store_true',
+                            help='Deletes all devices, testers and bugs before generating a dataset')
+        parser.add_argument('--output', help='File to write the JSON results to, printed when not set')
+
+    def handle(self, *args, **options):
+        if not options['existing_data']:
+            self._generate(options)
+
+        engine = options['engine'] or settings.MATCHING_ENGINE
+        data_file = settings.MATCH_DATA_FILE
+        if options['engine'] == 'mmap':
+            data_dir = tempfile.TemporaryDirectory()
+            data_file = os.path.join(data_dir.name, 'match.data')
+            write_data_file(MatchIndex.from_database(stored_data_version()), data_file)
+
+        results = []
+        for workers in options['workers'] or [settings.MATCHING_WORKERS]:
+            with override_settings(MATCHING_ENGINE=engine, MATCHING_WORKERS=workers, MATCH_DATA_FILE=data_file):
+                results.extend(self._run(options, workers))
+
+        report = {
+            'started_at': timezone.now().isoformat(),
+            'environment': {
+                'database': connection.vendor,
+                'engine': engine,
+                'warm_cache': options['warm_cache'],
+                'cpus': os.cpu_count(),
+                'python': platform.python_version(),
+            },
+            'dataset': {
+                'testers': Tester.objects.count(),
+                'devices': Device.objects.count(),
+                'bugs': Bug.objects.count(),
+                'tester_devices': Tester.devices.through.objects.count(),
+                'ownership_density': None if options['existing_data'] else options['ownership_density'],
+                'country_skew': None if options['existing_data'] else options['country_skew'],
+                'seed': options['seed'],
+            },
+            'results': results,
+        }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stdout.write('Results written to {}'.format(options['output']))
+        else:
+            self.stdout.write(output)
+
+    @transaction.atomic
+    def _generate(self, options):
+        if Device.objects.exists() or Tester.objects.exists() or Bug.objects.exists():
+            if not options['clear']:
+                raise CommandError('Device, Tester and Bug tables are not empty, use --clear to delete the data')
+            Bug.objects.all().delete()
+            Tester.objects.all().delete()
+            Device.objects.all().delete()
+
+        self.stdout.write('Generating {testers} testers, {devices} devices and {bugs} bugs'.format(**options))
+        generate_dataset(options['testers'], options['devices'], options['bugs'],
+                         ownership_density=options['ownership_density'], country_skew=options['country_skew'],
+                         seed=options['seed'], batch_size=options['batch_size'],
+                         progress=lambda table, loaded, rate: self.stdout.write(
+                             '{}: {} rows loaded ({:.0f} rows/s)'.format(table, loaded, rate)))
+
+    def _run(self, options, workers):
+        factory = RequestFactory()
+        cache = caches[settings.MATCH_CACHE_ALIAS]
+        before_request = None if options['warm_cache'] else cache.clear
+
+        results = []
+        for i, (name, devices, countries) in enumerate(filter_shapes(options['seed'])):
+            def request_func():
+                response = match_testers(factory.get('/match-testers/', {'devices': devices,
+                                                                         'countries': countries}))
+                # Fast path JSON responses are already rendered
+                return response.render() if hasattr(response, 'render') else response
+
+            if i == 0:
+                # Loads the in-memory index and starts the ranking processes before measuring
+                request_func()
+
+            self.stdout.write('Measuring {} with {} workers'.format(name, workers))
+            result = {'shape': name, 'devices': len(devices), 'countries': countries, 'workers': workers}
+            result.update(measure(request_func, options['requests'], before_request))
+            results.append(result)
+
+        return results
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from testers.datafile import write_data_file
+from testers.engine import MatchIndex, np
+from testers.versioning import stored_data_version
+
+
+class Command(BaseCommand):
+    help = 'Exports testers, devices, bug counts and device ownership to a match data file for the mmap engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File the data is written to, an existing file is replaced atomically')
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError('Exporting match data requires numpy')
+
+        index = MatchIndex.from_database(stored_data_version())
+        size = write_data_file(index, options['path'])
+        self.stdout.write('Exported {} testers and {} devices of data version {} to {} ({} bytes)'.format(
+            len(index.tester_ids), len(index.device_ids), index.version, options['path'], size))
@@ -0,0 +1,20 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from testers.schema import SCHEMA_FORMATS, generate_schema
+
+
+class Command(BaseCommand):
+    help = 'Writes swagger.json and swagger.yaml served by the API when OPENAPI_SCHEMA_DIR points to the directory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir', help='Directory the schema files are written to')
+
+    def handle(self, *args, **options):
+        os.makedirs(options['output_dir'], exist_ok=True)
+        for schema_format in SCHEMA_FORMATS:
+            path = os.path.join(options['output_dir'], 'swagger' + schema_format)
+            with open(path, 'wb') as f:
+                f.write(generate_schema(schema_format))
+            self.stdout.write('Wrote {}'.format(path))
@@ -0,0 +1,64 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from testers.benchmark import load_test
+
+
+class Command(BaseCommand):
+    help = 'Sends concurrent requests to running deployments and reports how much concurrency each one sustains'
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', metavar='NAME=URL',
+                            help='Deployments to compare, e.g. wsgi=http://127.0.0.1:8001/match-testers/')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64],
+                            help='Numbers of concurrent clients, every level is measured separately')
+        parser.add_argument('--requests', type=int, default=200, help='Number of requests per concurrency level')
+        parser.add_argument('--workers', type=int, default=1, help='Number of worker processes of each deployment')
+        parser.add_argument('--max-p99-ms', type=float, default=1000,
+                            help='Highest p99 latency at which a concurrency level counts as sustained')
+        parser.add_argument('--timeout', type=float, default=30, help='Timeout of a single request in seconds')
+        parser.add_argument('--output', help='File to write the JSON results to, printed when not set')
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['targets']:
+            name, separator, url = target.partition('=')
+            if not separator or not url:
+                raise CommandError('Targets must be given as NAME=URL, got {}'.format(target))
+            targets.append((name, url))
+
+        report = {
+            'started_at': timezone.now().isoformat(),
+            'workers': options['workers'],
+            'max_p99_ms': options['max_p99_ms'],
+            'deployments': [self._run(name, url, options) for name, url in targets],
+        }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stdout.write('Results written to {}'.format(options['output']))
+        else:
+            self.stdout.write(output)
+
+    def _run(self, name, url, options):
+        levels = []
+        for concurrency in sorted(options['concurrency']):
+            self.stdout.write('Measuring {} with {} concurrent clients'.format(name, concurrency))
+            levels.append(load_test(url, concurrency, options['requests'], options['timeout']))
+
+        # Highest concurrency served without errors within the latency limit
+        sustained = [level for level in levels
+                     if not level['errors'] and level['p99_ms'] <= options['max_p99_ms']]
+        sustained_concurrency = max((level['concurrency'] for level in sustained), default=0)
+        return {
+            'name': name,
+            'url': url,
+            'sustained_concurrency': sustained_concurrency,
+            'sustained_concurrency_per_worker': sustained_concurrency / options['workers'],
+            'max_requests_per_s_per_worker': max(level['requests_per_s'] for level in levels) / options['workers'],
+            'levels': levels,
+        }
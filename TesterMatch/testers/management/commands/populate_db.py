@@ -1,10 +1,18 @@
 import csv
 import datetime
+import os
+import uuid
 import pytz
 
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
+from django.db import connection, transaction
+from testers.experience import rebuild_experience
+from testers.loading import BulkLoader, IncrementalLoader, StagingTable, parse_reported_at, read_rows, \
+    reset_sequences, shard_ranges, DEVICES, TESTERS, BUGS, TESTER_DEVICES, SHARDED_TABLES
 from testers.models import Device, Tester, Bug
+from testers.sharding import stage_shards
+from testers.snapshots import refresh_snapshots
+from testers.versioning import bump_data_version
 
 
 class Command(BaseCommand):
@@ -15,16 +23,80 @@ class Command(BaseCommand):
         self._DATA_TIMEZONE = pytz.utc
 
         self._INITIAL_DATA_PATH = 'testers/initial_data/'
-        self._DEVICES_FILE_PATH = self._INITIAL_DATA_PATH + 'devices.csv'
-        self._TESTERS_FILE_PATH = self._INITIAL_DATA_PATH + 'testers.csv'
-        self._BUGS_FILE_PATH = self._INITIAL_DATA_PATH + 'bugs.csv'
-        self._TESTER_DEVICE_FILE_PATH = self._INITIAL_DATA_PATH + 'tester_device.csv'
+        self._DEVICES_FILE_NAME = 'devices.csv'
+        self._TESTERS_FILE_NAME = 'testers.csv'
+        self._BUGS_FILE_NAME = 'bugs.csv'
+        self._TESTER_DEVICE_FILE_NAME = 'tester_device.csv'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--data-dir', default=self._INITIAL_DATA_PATH,
+                            help='Directory with devices.csv, testers.csv, bugs.csv and tester_device.csv files')
+        parser.add_argument('--fast', action='store_true',
+                            help='Streams the files in batches and loads them with COPY on PostgreSQL')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Updates non-empty tables, applying only rows which were added, changed or removed')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Number of rows loaded at once in the fast, incremental and parallel modes')
+        parser.add_argument('--workers', type=int,
+                            help='Splits bugs.csv and tester_device.csv into shards loaded by this number of processes')
 
-    @transaction.atomic
     def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size has to be a positive number')
+
+        workers = options['workers']
+        if workers is not None and workers < 1:
+            raise CommandError('Number of workers has to be a positive number')
+        if workers and options['incremental']:
+            raise CommandError('Workers can\'t be combined with an incremental import')
+
+        data_dir = options['data_dir']
+        self._DEVICES_FILE_PATH = os.path.join(data_dir, self._DEVICES_FILE_NAME)
+        self._TESTERS_FILE_PATH = os.path.join(data_dir, self._TESTERS_FILE_NAME)
+        self._BUGS_FILE_PATH = os.path.join(data_dir, self._BUGS_FILE_NAME)
+        self._TESTER_DEVICE_FILE_PATH = os.path.join(data_dir, self._TESTER_DEVICE_FILE_NAME)
+
+        if not workers:
+            self._populate(options)
+            return
+
+        # Shards are staged by the workers on their own connections, the import transaction only moves staged rows
+        self._check_empty()
+        shards, staged = self._shards(workers), []
+        try:
+            self._stage(shards, workers, options['batch_size'], staged)
+            self._populate(options, staged)
+        finally:
+            for staging in staged:
+                staging.drop()
+
+    @transaction.atomic
+    def _populate(self, options, staged=None):
+        if options['incremental']:
+            self._incremental_import(options['batch_size'])
+            return
+
+        self._check_empty()
+        if staged is not None:
+            self._parallel_import(staged, options['batch_size'])
+        elif options['fast']:
+            self._fast_import(options['batch_size'])
+        else:
+            self._import()
+
+        reset_sequences()
+
+        # Bulk inserts skip the signal handlers, so experience is calculated once at the end
+        self.stdout.write('Rebuilt {} tester device experience rows'.format(rebuild_experience()))
+        bump_data_version(devices=True)
+        self._refresh_rankings()
+
+    @staticmethod
+    def _check_empty():
         if Device.objects.exists() or Tester.objects.exists() or Bug.objects.exists():
             raise CommandError('Device, Tester and Bug tables are not empty')
 
+    def _import(self):
         # Populating device table
         new_devices = self._read_data(self._DEVICES_FILE_PATH, self._map_device)
         self.stdout.write('Adding {} devices'.format(len(new_devices)))
@@ -41,12 +113,95 @@ class Command(BaseCommand):
         Bug.objects.bulk_create(new_bugs)
 
         # Populating tester and device relation
-        device_tester_relations = self._read_device_tester_data()
-        for tester_id, devices in device_tester_relations.items():
-            self.stdout.write('Adding {} device tester relations'.format(len(devices)))
-            t = Tester.objects.get(id=tester_id)
-            t.devices.add(*devices)
-            t.save()
+        device_tester_relations = self._read_data(self._TESTER_DEVICE_FILE_PATH, self._map_tester_device)
+        self.stdout.write('Adding {} device tester relations'.format(len(device_tester_relations)))
+        Tester.devices.through.objects.bulk_create(device_tester_relations)
+
+    def _fast_import(self, batch_size):
+        loader = BulkLoader(batch_size, progress=self._report_progress)
+
+        for path, table in ((self._DEVICES_FILE_PATH, DEVICES),
+                            (self._TESTERS_FILE_PATH, TESTERS),
+                            (self._BUGS_FILE_PATH, BUGS),
+                            (self._TESTER_DEVICE_FILE_PATH, TESTER_DEVICES)):
+            loaded = loader.load(read_rows(path), table)
+            self.stdout.write('Added {} rows from {}'.format(loaded, path))
+
+    def _shards(self, workers):
+        # (table name, staging table, path, start, end) of every shard, all shards of a file share a staging table
+        # unique for the import
+        run = uuid.uuid4().hex[:8]
+        shards = []
+        for name, path in (('bugs', self._BUGS_FILE_PATH), ('tester_devices', self._TESTER_DEVICE_FILE_PATH)):
+            staging_name = '{}_staging_{}'.format(SHARDED_TABLES[name][0]._meta.db_table, run)
+            shards.extend((name, staging_name, path, start, end) for start, end in shard_ranges(path, workers))
+        return shards
+
+    def _stage(self, shards, workers, batch_size, staged):
+        # Staging tables are added to staged before they are created, so they are dropped even if loading fails
+        tables = {}
+        for name, staging_name, *_ in shards:
+            if staging_name not in tables:
+                tables[staging_name] = StagingTable(SHARDED_TABLES[name], staging_name)
+                staged.append(tables[staging_name])
+                tables[staging_name].create()
+        results = stage_shards(shards, workers, connection.settings_dict, batch_size)
+
+        for (_, staging_name, path, start, end), (first_id, result) in zip(shards, results):
+            if isinstance(result, list):
+                result = tables[staging_name].load(result, batch_size, first_id)
+            tables[staging_name].rows += result
+            self.stdout.write('Staged {} rows from bytes {}-{} of {}'.format(result, start, end, path))
+
+        # Indexes are built before the import transaction, which then only swaps the staging tables in
+        for staging in staged:
+            staging.build_indexes()
+
+    def _parallel_import(self, staged, batch_size):
+        loader = BulkLoader(batch_size, progress=self._report_progress)
+        for path, table in ((self._DEVICES_FILE_PATH, DEVICES), (self._TESTERS_FILE_PATH, TESTERS)):
+            self.stdout.write('Added {} rows from {}'.format(loader.load(read_rows(path), table), path))
+
+        for staging in staged:
+            self.stdout.write('Added {} rows from {}'.format(staging.move_into(), staging.name))
+
+    def _incremental_import(self, batch_size):
+        loader = IncrementalLoader(batch_size)
+
+        # Inserts and updates go in dependency order, deletes in the reverse one
+        seen_ids, changes = {}, {}
+        for path, table in ((self._DEVICES_FILE_PATH, DEVICES),
+                            (self._TESTERS_FILE_PATH, TESTERS),
+                            (self._BUGS_FILE_PATH, BUGS)):
+            model = table[0]
+            seen_ids[model], inserted, updated = loader.upsert(read_rows(path), table)
+            changes[model] = [inserted, updated, 0]
+
+        added, removed = loader.sync_tester_devices(read_rows(self._TESTER_DEVICE_FILE_PATH))
+
+        for model in (Bug, Tester, Device):
+            changes[model][2] = loader.delete_missing(model, seen_ids[model])
+
+        for model in (Device, Tester, Bug):
+            self.stdout.write('{}: {} inserted, {} updated, {} deleted'.format(
+                model._meta.verbose_name_plural, *changes[model]))
+        self.stdout.write('device tester relations: {} added, {} removed'.format(added, removed))
+
+        if not any(sum(c) for c in changes.values()) and not added and not removed:
+            self.stdout.write('No changes')
+            return
+
+        reset_sequences()
+        self.stdout.write('Rebuilt {} tester device experience rows for {} testers'.format(
+            rebuild_experience(loader.affected_testers), len(loader.affected_testers)))
+        bump_data_version(devices=any(changes[Device]))
+        self._refresh_rankings()
+
+    def _refresh_rankings(self):
+        self.stdout.write('Refreshed {} ranking snapshots'.format(len(refresh_snapshots())))
+
+    def _report_progress(self, table, loaded, rows_per_second):
+        self.stdout.write('{}: {} rows loaded ({:.0f} rows/s)'.format(table, loaded, rows_per_second))
 
     @staticmethod
     def _read_data(path, map_func):
@@ -73,17 +228,8 @@ class Command(BaseCommand):
 
     @staticmethod
     def _map_bugs(row):
-        return Bug(id=row[0], device_id=row[1], tester_id=row[2])
-
-    def _read_device_tester_data(self):
-        relations = {}
-        with open(self._TESTER_DEVICE_FILE_PATH) as f:
-            reader = csv.reader(f)
+        return Bug(id=row[0], device_id=row[1], tester_id=row[2], reported_at=parse_reported_at(row))
 
-            # Skipping header
-            next(reader, None)
-            for row in reader:
-                if row:
-                    relations.setdefault(row[0], []).append(row[1])
-
-        return relations
+    @staticmethod
+    def _map_tester_device(row):
+        return Tester.devices.through(tester_id=row[0], device_id=row[1])
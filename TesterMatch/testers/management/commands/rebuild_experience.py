@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from testers.experience import rebuild_experience, day_experience_mismatches, experience_mismatches
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the tester device experience table and checks it against the live aggregate'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check-only', action='store_true',
+                            help='Only compare the stored experience with the live aggregate')
+
+    def handle(self, *args, **options):
+        if not options['check_only']:
+            rows = rebuild_experience()
+            self.stdout.write('Rebuilt {} tester device experience rows'.format(rows))
+
+        mismatches = experience_mismatches()
+        for tester_id, (stored, live) in sorted(mismatches.items()):
+            self.stderr.write('Tester {}: stored experience {}, live experience {}'.format(tester_id, stored, live))
+
+        day_mismatches = day_experience_mismatches()
+        for (tester_id, device_id, day), (stored, live) in sorted(day_mismatches.items()):
+            self.stderr.write('Tester {}, device {}, day {}: stored experience {}, live experience {}'.format(
+                tester_id, device_id, day, stored, live))
+
+        if mismatches:
+            raise CommandError('Experience table doesn\'t match the live aggregate for {} testers'
+                               .format(len(mismatches)))
+        if day_mismatches:
+            raise CommandError('Day experience table doesn\'t match the live aggregate for {} days'
+                               .format(len(day_mismatches)))
+        self.stdout.write('Experience table matches the live aggregate')
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from testers.snapshots import refresh_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Precomputes rankings of all testers on all devices per country, served by match-testers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Keeps running and checks for data changes every INTERVAL seconds')
+        parser.add_argument('--force', action='store_true', help='Refreshes snapshots even if data didn\'t change')
+
+    def handle(self, *args, **options):
+        if options['interval'] is not None and options['interval'] <= 0:
+            raise CommandError('Interval has to be a positive number')
+
+        self._refresh(options['force'])
+        while options['interval']:
+            time.sleep(options['interval'])
+            # Long running process, connections are closed when they outlive CONN_MAX_AGE or break
+            close_old_connections()
+            self._refresh(False)
+
+    def _refresh(self, force):
+        refreshed = refresh_snapshots(force)
+        if refreshed:
+            self.stdout.write('Refreshed ranking snapshots: {}'.format(
+                ', '.join(country or 'all countries' for country in refreshed)))
+        else:
+            self.stdout.write('Ranking snapshots are up to date')
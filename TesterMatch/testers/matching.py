@@ -0,0 +1,185 @@
+import base64
+import binascii
+import datetime
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import ExpressionWrapper, F, FilteredRelation, FloatField, IntegerField, Q, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Power, Round
+from django.utils import timezone
+
+from .experience import day_number
+from .models import Tester, TesterDeviceExperience
+
+TESTER_FIELDS = ('experience', 'first_name', 'last_name', 'country')
+# Matched testers are tuples of these fields, id is only used for pagination
+ROW_FIELDS = TESTER_FIELDS + ('id',)
+ORDERING = ('-experience', 'last_name', 'first_name', 'id')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(row):
+    experience, first_name, last_name, _, tester_id = row
+    key = [experience, last_name, first_name, tester_id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(value):
+    # Cursor is the sort key (experience, last_name, first_name, id) of the last tester on the previous page
+    try:
+        experience, last_name, first_name, tester_id = json.loads(base64.urlsafe_b64decode(value.encode('ascii')))
+    except (binascii.Error, UnicodeError, TypeError, ValueError):
+        raise InvalidCursor(value)
+
+    # Integers have to fit in a database bigint to be compared with the sort key
+    if not all(isinstance(v, int) and -2 ** 63 <= v < 2 ** 63 for v in (experience, tester_id)) or \
+            not all(isinstance(v, str) for v in (last_name, first_name)):
+        raise InvalidCursor(value)
+    return experience, last_name, first_name, tester_id
+
+
+def tester_query(devices=None, countries=None, after=None, since=None, until=None, decay=None, active_since=None):
+    query_set = Tester.objects
+    query_set = query_set.filter(country__in=countries) if countries else query_set.all()
+    if active_since is not None:
+        query_set = query_set.filter(
+            last_login__gte=datetime.datetime.combine(active_since, datetime.time(), tzinfo=datetime.timezone.utc))
+
+    # Experience is summed from the precomputed rows, which only exist for devices the tester owns. Filters are part
+    # of the join, so on partitioned tables only the partitions of the selected devices are read.
+    if since is not None or until is not None or decay is not None:
+        query_set = query_set.annotate(
+            window_experience=FilteredRelation('day_experience', condition=window_condition(devices, since, until)),
+        ).annotate(experience=windowed_experience('window_experience', until, decay))
+    elif devices:
+        query_set = query_set.annotate(
+            selected_experience=FilteredRelation('device_experience',
+                                                 condition=Q(device_experience__device__in=devices)),
+        ).annotate(experience=Coalesce(Sum('selected_experience__bug_count'), 0))
+    else:
+        # Experience on all devices is stored on the tester, rankings are read in the order of its index
+        query_set = query_set.annotate(experience=F('total_experience'))
+
+    # Keyset pagination, testers strictly after the cursor in the result ordering
+    if after is not None:
+        experience, last_name, first_name, tester_id = after
+        query_set = query_set.filter(
+            Q(experience__lt=experience) |
+            Q(experience=experience, last_name__gt=last_name) |
+            Q(experience=experience, last_name=last_name, first_name__gt=first_name) |
+            Q(experience=experience, last_name=last_name, first_name=first_name, id__gt=tester_id))
+
+    return query_set.order_by(*ORDERING).values_list(*ROW_FIELDS)
+
+
+def window_condition(devices=None, since=None, until=None):
+    # Day buckets of bugs reported between since and until (dates, both inclusive) on the devices
+    condition = Q()
+    if devices:
+        condition &= Q(day_experience__device__in=devices)
+    if since is not None:
+        condition &= Q(day_experience__day__gte=day_number(since))
+    if until is not None:
+        condition &= Q(day_experience__day__lte=day_number(until))
+    return condition
+
+
+def windowed_experience(relation, until=None, decay=None):
+    """
+    Experience summed from the day buckets joined as relation. With decay every bug counts half as much for every
+    decay days between its report and until or today, weighted experience is rounded to whole bugs so ordering
+    and cursors work the same way.
+    """
+    if decay is None:
+        return Coalesce(Sum(relation + '__bug_count'), 0)
+
+    reference_day = day_number(until if until is not None else timezone.now())
+    age = ExpressionWrapper((Value(reference_day) - F(relation + '__day')) / Value(float(decay)),
+                            output_field=FloatField())
+    weighted = Sum(ExpressionWrapper(F(relation + '__bug_count') * Power(Value(0.5), age), output_field=FloatField()))
+    return Coalesce(Cast(Round(weighted), IntegerField()), 0)
+
+
+IN_PROCESS_ENGINES = ('memory', 'mmap')
+
+
+def _match_index():
+    # numpy is imported only by processes using an in-process engine
+    from .engine import get_match_index
+    return get_match_index()
+
+
+def match(devices=None, countries=None, after=None, **window):
+    """
+    Returns testers ordered by experience as ROW_FIELDS tuples, a lazy queryset or a list from the in-memory engine.
+    Time windows (since, until, decay) and active_since are always answered by the database, in-process engines
+    only hold total bug counts.
+    """
+    if window:
+        return tester_query(devices, countries, after, **window)
+    if settings.MATCHING_ENGINE in IN_PROCESS_ENGINES:
+        return _match_index().match(devices, countries, after)
+    return tester_query(devices, countries, after)
+
+
+def stream_match(devices=None, countries=None, after=None, limit=None, **window):
+    """
+    Iterator over the testers of match(), at most limit of them. Database results are read in keyset pages of
+    MATCH_STREAM_CHUNK_SIZE rows, a query per page, so streams don't need a server side cursor, which PgBouncer
+    in transaction pooling mode doesn't support, and never hold the whole result in memory.
+    """
+    testers = match(devices, countries, after, **window)
+    if isinstance(testers, list):
+        return iter(testers[:limit] if limit is not None else testers)
+    # Pages are read after the view returns, from the database the router chose for the view
+    return _keyset_pages(testers.db, devices, countries, after, limit, window)
+
+
+def _keyset_pages(db, devices, countries, after, limit, window):
+    while limit is None or limit > 0:
+        size = settings.MATCH_STREAM_CHUNK_SIZE if limit is None else min(settings.MATCH_STREAM_CHUNK_SIZE, limit)
+        page = list(tester_query(devices, countries, after, **window).using(db)[:size])
+        yield from page
+        if len(page) < size:
+            return
+        if limit is not None:
+            limit -= size
+        experience, first_name, last_name, _, tester_id = page[-1]
+        after = (experience, last_name, first_name, tester_id)
+
+
+def match_many(queries):
+    # Ranks testers for many (devices, countries, limit) queries with one read of the experience rows
+    if settings.MATCHING_ENGINE in IN_PROCESS_ENGINES:
+        index = _match_index()
+        return [index.match(devices, countries)[:limit] for devices, countries, limit in queries]
+
+    experience_rows = TesterDeviceExperience.objects.filter(bug_count__gt=0)
+    if all(devices for devices, _, _ in queries):
+        experience_rows = experience_rows.filter(device_id__in={d for devices, _, _ in queries for d in devices})
+
+    tester_experience = defaultdict(dict)
+    for tester_id, device_id, bug_count in experience_rows.values_list('tester_id', 'device_id', 'bug_count'):
+        tester_experience[tester_id][device_id] = bug_count
+
+    # Testers in the database name order, a stable sort by experience gives the same ordering as tester_query
+    testers = list(Tester.objects.order_by('last_name', 'first_name', 'id')
+                   .values_list('first_name', 'last_name', 'country', 'id'))
+
+    results = []
+    for devices, countries, limit in queries:
+        devices, countries = set(devices), set(countries)
+        ranked = []
+        for first_name, last_name, country, tester_id in testers:
+            if countries and country not in countries:
+                continue
+            counts = tester_experience.get(tester_id, {})
+            experience = sum(c for d, c in counts.items() if d in devices) if devices else sum(counts.values())
+            ranked.append((experience, first_name, last_name, country, tester_id))
+        ranked.sort(key=lambda row: -row[0])
+        results.append(ranked[:limit])
+    return results
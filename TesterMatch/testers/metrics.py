@@ -0,0 +1,97 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1000, 10000, 100000, 1000000, 10000000)
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus format, kept separately for every value of the 'view' label.
+    """
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view, value):
+        with self._lock:
+            counts, total = self._series.get(view, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._series[view] = (counts, total + value)
+
+    def clear(self):
+        with self._lock:
+            self._series = {}
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            series = sorted((view, list(counts), total) for view, (counts, total) in self._series.items())
+
+        for view, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ['+Inf'], counts):
+                cumulative += count
+                lines.append('{}_bucket{{view="{}",le="{}"}} {}'.format(self.name, view, bound, cumulative))
+            lines.append('{}_sum{{view="{}"}} {}'.format(self.name, view, total))
+            lines.append('{}_count{{view="{}"}} {}'.format(self.name, view, cumulative))
+        return lines
+
+
+REQUEST_DURATION = Histogram('testermatch_request_duration_seconds', 'Wall time of requests', DURATION_BUCKETS)
+DB_QUERIES = Histogram('testermatch_db_queries', 'Number of database queries per request', QUERY_COUNT_BUCKETS)
+DB_DURATION = Histogram('testermatch_db_duration_seconds', 'Time spent in database queries per request',
+                        DURATION_BUCKETS)
+SERIALIZATION_DURATION = Histogram('testermatch_serialization_duration_seconds',
+                                   'Time spent serializing and rendering responses', DURATION_BUCKETS)
+RESPONSE_SIZE = Histogram('testermatch_response_bytes', 'Size of response bodies', SIZE_BUCKETS)
+
+HISTOGRAMS = (REQUEST_DURATION, DB_QUERIES, DB_DURATION, SERIALIZATION_DURATION, RESPONSE_SIZE)
+
+
+class RequestTimings:
+    # Durations of a single request, attached to it by PerformanceMiddleware
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_duration = 0.0
+        self.phases = OrderedDict()
+
+    def add(self, phase, duration):
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_queries += 1
+            self.db_duration += time.perf_counter() - started
+
+
+@contextmanager
+def timed(request, phase):
+    # Adds the duration of the block to a named phase reported in the Server-Timing header
+    timings = getattr(getattr(request, '_request', request), 'timings', None)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.add(phase, time.perf_counter() - started)
+
+
+def render_metrics(extra_lines=()):
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
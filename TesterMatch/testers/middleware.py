@@ -0,0 +1,88 @@
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connections
+
+from . import metrics
+
+
+def _add_db_wrapper(wrapper):
+    for connection in connections.all():
+        connection.execute_wrappers.append(wrapper)
+
+
+def _remove_db_wrapper(wrapper):
+    for connection in connections.all():
+        connection.execute_wrappers.remove(wrapper)
+
+
+class PerformanceMiddleware:
+    """
+    Records wall time, database queries and time, serialization time and response size of every view
+    into the histograms in testers.metrics and reports them in the Server-Timing header.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        timings = metrics.RequestTimings()
+        request.timings = timings
+
+        # Queries are counted on the primary and on the replicas
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timings.db_wrapper))
+            response = self.get_response(request)
+        return self._observe(request, response, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        timings = metrics.RequestTimings()
+        request.timings = timings
+
+        # Connections are per thread, queries of async views run in the thread sync_to_async uses for the request
+        started = time.perf_counter()
+        await sync_to_async(_add_db_wrapper)(timings.db_wrapper)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(_remove_db_wrapper)(timings.db_wrapper)
+        return self._observe(request, response, time.perf_counter() - started)
+
+    def _observe(self, request, response, duration):
+        timings = request.timings
+        serialization = timings.phases.get('serialization', 0.0)
+        response_bytes = None if response.streaming else len(response.content)
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is not None:
+            view = resolver_match.view_name
+            metrics.REQUEST_DURATION.observe(view, duration)
+            metrics.DB_QUERIES.observe(view, timings.db_queries)
+            metrics.DB_DURATION.observe(view, timings.db_duration)
+            metrics.SERIALIZATION_DURATION.observe(view, serialization)
+            if response_bytes is not None:
+                metrics.RESPONSE_SIZE.observe(view, response_bytes)
+
+        server_timing = ['total;dur={:.2f}'.format(duration * 1000),
+                         'db;dur={:.2f};desc="{} queries"'.format(timings.db_duration * 1000, timings.db_queries)]
+        server_timing += ['{};dur={:.2f}'.format(phase, phase_duration * 1000)
+                          for phase, phase_duration in timings.phases.items()]
+        response['Server-Timing'] = ', '.join(server_timing)
+        return response
+
+    def process_template_response(self, request, response):
+        # Called right before DRF responses are rendered, rendering counts as serialization
+        started = time.perf_counter()
+        response.add_post_render_callback(
+            lambda rendered: request.timings.add('serialization', time.perf_counter() - started))
+        return response
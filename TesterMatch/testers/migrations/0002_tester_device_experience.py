@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_experience(apps, schema_editor):
+    Bug = apps.get_model('testers', 'Bug')
+    Tester = apps.get_model('testers', 'Tester')
+    TesterDeviceExperience = apps.get_model('testers', 'TesterDeviceExperience')
+
+    schema_editor.execute(
+        'INSERT INTO {experience} (tester_id, device_id, bug_count) '
+        'SELECT td.tester_id, td.device_id, COUNT(b.id) '
+        'FROM {tester_device} td '
+        'LEFT JOIN {bug} b ON b.tester_id = td.tester_id AND b.device_id = td.device_id '
+        'GROUP BY td.tester_id, td.device_id'.format(
+            experience=TesterDeviceExperience._meta.db_table,
+            tester_device=Tester.devices.through._meta.db_table,
+            bug=Bug._meta.db_table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testers', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TesterDeviceExperience',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bug_count', models.PositiveIntegerField(default=0)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='testers.Device')),
+                ('tester', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='device_experience', to='testers.Tester')),
+            ],
+            options={
+                'unique_together': {('tester', 'device')},
+            },
+        ),
+        migrations.RunPython(populate_experience, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testers', '0003_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataversion',
+            name='token',
+            field=models.CharField(default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testers', '0004_data_version_token'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bug',
+            index=models.Index(fields=['tester', 'device'], name='testers_bug_tester_device_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tester',
+            index=models.Index(fields=['country'], name='testers_tester_country_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='testerdeviceexperience',
+            index=models.Index(fields=['tester', 'device', 'bug_count'], name='testers_exp_tester_device_idx'),
+        ),
+        # Auto-created tester_device table only has the (tester_id, device_id) unique index
+        migrations.RunSQL(
+            'CREATE INDEX testers_tester_devices_device_tester_idx ON testers_tester_devices (device_id, tester_id)',
+            'DROP INDEX testers_tester_devices_device_tester_idx',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testers', '0005_matching_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankingSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country', models.CharField(blank=True, max_length=2, unique=True)),
+                ('version', models.CharField(max_length=64)),
+                ('content', models.BinaryField()),
+                ('created_at', models.DateTimeField()),
+            ],
+        ),
+    ]
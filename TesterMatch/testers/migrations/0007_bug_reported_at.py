@@ -0,0 +1,72 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def create_brin_index(apps, schema_editor):
+    # Bugs are inserted roughly in the order of reported_at, a BRIN index of a few pages covers range scans on PostgreSQL
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE INDEX testers_bug_reported_at_brin ON testers_bug USING brin (reported_at)')
+
+
+def drop_brin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX testers_bug_reported_at_brin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testers', '0006_ranking_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TesterDeviceDayExperience',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.IntegerField()),
+                ('bug_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        # Report time of existing bugs is unknown, only bugs created from now on get the default
+        migrations.AddField(
+            model_name='bug',
+            name='reported_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='bug',
+            name='reported_at',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='bug',
+            index=models.Index(fields=['reported_at'], name='testers_bug_reported_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tester',
+            index=models.Index(fields=['last_login'], name='testers_tester_last_login_idx'),
+        ),
+        migrations.AddField(
+            model_name='testerdevicedayexperience',
+            name='device',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='testers.device'),
+        ),
+        migrations.AddField(
+            model_name='testerdevicedayexperience',
+            name='tester',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='day_experience', to='testers.tester'),
+        ),
+        migrations.AddIndex(
+            model_name='testerdevicedayexperience',
+            index=models.Index(fields=['tester', 'day', 'device', 'bug_count'], name='testers_day_exp_tester_day_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='testerdevicedayexperience',
+            unique_together={('tester', 'device', 'day')},
+        ),
+        migrations.RunPython(create_brin_index, drop_brin_index),
+    ]
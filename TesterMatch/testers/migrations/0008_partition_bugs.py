@@ -0,0 +1,26 @@
+from django.db import migrations
+
+from testers.partitioning import partition_tables, partitioning_settings, unpartition_tables
+
+
+def partition(apps, schema_editor):
+    # Only applied when BUG_PARTITION_KEY is set, changing it later requires migrating back to 0007 and forward
+    partitioning = partitioning_settings()
+    if partitioning is not None and schema_editor.connection.vendor == 'postgresql':
+        partition_tables(schema_editor, *partitioning)
+
+
+def unpartition(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        unpartition_tables(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testers', '0007_bug_reported_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testers', '0008_partition_bugs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataversion',
+            name='updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:55
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_total_experience(apps, schema_editor):
+    Tester = apps.get_model('testers', 'Tester')
+    TesterDeviceExperience = apps.get_model('testers', 'TesterDeviceExperience')
+    totals = TesterDeviceExperience.objects.filter(tester_id=OuterRef('pk')).order_by() \
+        .values('tester_id').annotate(total=Sum('bug_count')).values('total')
+    Tester.objects.update(total_experience=Coalesce(Subquery(totals), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testers', '0009_data_version_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tester',
+            name='total_experience',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_total_experience, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='tester',
+            index=models.Index(fields=['country', '-total_experience', 'last_name', 'first_name', 'id'],
+                               name='testers_country_ranking_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tester',
+            index=models.Index(fields=['-total_experience', 'last_name', 'first_name', 'id'],
+                               name='testers_tester_ranking_idx'),
+        ),
+    ]
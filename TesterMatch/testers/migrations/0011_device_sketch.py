@@ -0,0 +1,40 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_sketches(apps, schema_editor):
+    # Same as testers.sketches.rebuild_sketches with the models of this migration
+    DeviceSketch = apps.get_model('testers', 'DeviceSketch')
+    TesterDeviceExperience = apps.get_model('testers', 'TesterDeviceExperience')
+    sketches = {}
+    rows = TesterDeviceExperience.objects.filter(bug_count__gt=0).order_by('device_id', '-bug_count', 'tester_id') \
+        .values_list('device_id', 'tester_id', 'bug_count')
+    for device_id, tester_id, bug_count in rows.iterator():
+        sketch = sketches.setdefault(device_id, DeviceSketch(device_id=device_id, counters={}, floor=0))
+        if len(sketch.counters) < settings.APPROX_SKETCH_COUNTERS:
+            sketch.counters[str(tester_id)] = [bug_count, 0]
+        elif not sketch.floor:
+            sketch.floor = bug_count
+    DeviceSketch.objects.bulk_create(sketches.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testers', '0010_tester_total_experience'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceSketch',
+            fields=[
+                ('device', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='testers.device')),
+                ('counters', models.JSONField(default=dict)),
+                ('floor', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(build_sketches, migrations.RunPython.noop),
+    ]
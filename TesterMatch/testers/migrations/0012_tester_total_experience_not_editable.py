@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testers', '0011_device_sketch'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tester',
+            name='total_experience',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 SUPPORTED_COUNTRIES = (('GB', 'United Kingdom'), ('US', ' United States of America'), ('JP', 'Japan'))
 
@@ -16,6 +17,25 @@ class Tester(models.Model):
     country = models.CharField(max_length=2, choices=SUPPORTED_COUNTRIES)
     last_login = models.DateTimeField()
     devices = models.ManyToManyField(Device)
+    # Bugs reported on devices the tester owns, the sum of their experience rows kept by testers.experience
+    total_experience = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['country'], name='testers_tester_country_idx'),
+            models.Index(fields=['last_login'], name='testers_tester_last_login_idx'),
+            # Rankings on all devices are read in order from the index, without aggregating experience rows
+            models.Index(fields=['country', '-total_experience', 'last_name', 'first_name', 'id'],
+                         name='testers_country_ranking_idx'),
+            models.Index(fields=['-total_experience', 'last_name', 'first_name', 'id'],
+                         name='testers_tester_ranking_idx'),
+        ]
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # Only testers.experience writes the total, updating a loaded tester must not overwrite it with a stale
+        # value. Inserts, deleted rows and deferred fields are left to the usual save.
+        values = [v for v in values if v[0].name != 'total_experience']
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
 
     def __str__(self):
         return '{} - {} - {} - {} - {}'.format(self.id, self.first_name, self.last_name, self.country, self.last_login)
@@ -24,6 +44,85 @@ class Tester(models.Model):
 class Bug(models.Model):
     device = models.ForeignKey(Device, on_delete=models.CASCADE)
     tester = models.ForeignKey(Tester, on_delete=models.CASCADE)
+    # Unknown for bugs imported without a report time, these only count towards experience without a time window
+    reported_at = models.DateTimeField(null=True, blank=True, default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Counting bugs of a tester per device without touching the table
+            models.Index(fields=['tester', 'device'], name='testers_bug_tester_device_idx'),
+            models.Index(fields=['reported_at'], name='testers_bug_reported_at_idx'),
+        ]
 
     def __str__(self):
         return '{} - {} - {}'.format(self.id, self.device_id, self.tester_id)
+
+
+class TesterDeviceExperience(models.Model):
+    # Bugs reported by a tester on a device they still own, maintained by signal handlers in testers.signals
+    tester = models.ForeignKey(Tester, on_delete=models.CASCADE, related_name='device_experience')
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='+')
+    bug_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('tester', 'device')
+        indexes = [
+            # Joining experience to testers reads only the index
+            models.Index(fields=['tester', 'device', 'bug_count'], name='testers_exp_tester_device_idx'),
+        ]
+
+    def __str__(self):
+        return '{} - {} - {}'.format(self.tester_id, self.device_id, self.bug_count)
+
+
+class TesterDeviceDayExperience(models.Model):
+    # Bugs reported by a tester on a device they still own per day of the report, day is the number of days since
+    # 1970-01-01 in UTC. Maintained together with TesterDeviceExperience.
+    tester = models.ForeignKey(Tester, on_delete=models.CASCADE, related_name='day_experience')
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='+')
+    day = models.IntegerField()
+    bug_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('tester', 'device', 'day')
+        indexes = [
+            # Summing a time window of a tester reads only the index
+            models.Index(fields=['tester', 'day', 'device', 'bug_count'], name='testers_day_exp_tester_day_idx'),
+        ]
+
+    def __str__(self):
+        return '{} - {} - {} - {}'.format(self.tester_id, self.device_id, self.day, self.bug_count)
+
+
+class DeviceSketch(models.Model):
+    # Space-Saving summary of bugs per tester on a device they own, maintained by testers.sketches. Counters map
+    # tester ids to [count, error], floor bounds the bug count of every tester without a counter.
+    device = models.OneToOneField(Device, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    counters = models.JSONField(default=dict)
+    floor = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return '{} - {} counters - floor {}'.format(self.device_id, len(self.counters), self.floor)
+
+
+class DataVersion(models.Model):
+    # Counters bumped on every change of matching data (id 1) and of devices (id 2), used to invalidate caches.
+    # Random token makes sure a version is never reused after a rolled back bump or a restored backup.
+    version = models.BigIntegerField(default=0)
+    token = models.CharField(max_length=32, default='')
+    updated_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '{}.{}'.format(self.version, self.token)
+
+
+class RankingSnapshot(models.Model):
+    # Rendered JSON of all testers ranked by experience on all devices, per country or for all countries (''),
+    # computed by testers.snapshots for the data version it was built from
+    country = models.CharField(max_length=2, blank=True, unique=True)
+    version = models.CharField(max_length=64)
+    content = models.BinaryField()
+    created_at = models.DateTimeField()
+
+    def __str__(self):
+        return '{} - {} - {}'.format(self.country or 'all', self.version, self.created_at)
@@ -0,0 +1,82 @@
+import heapq
+import multiprocessing
+import os
+import tempfile
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+# Spawned worker processes only import this module, so it must not depend on Django being set up
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_worker = {}
+
+
+class ParallelRanker:
+    """
+    Ranks testers of a MatchIndex in a pool of processes, each shard of testers is ranked separately and
+    the shards are combined with a k-way merge.
+
+    Bug counts of owned devices are written to a memory mapped file which all workers read, so the matrix is
+    shared through the page cache instead of being copied to every process.
+    """
+
+    def __init__(self, counts, owned, country_codes, workers):
+        self.workers = workers
+        self.testers = counts.shape[0]
+
+        fd, self.path = tempfile.mkstemp(prefix='testermatch-', suffix='.npy')
+        os.close(fd)
+        owned_counts = np.lib.format.open_memmap(self.path, mode='w+', dtype=counts.dtype, shape=counts.shape)
+        np.multiply(counts, owned, out=owned_counts)
+        owned_counts.flush()
+        del owned_counts
+
+        # Forking a threaded server process would copy its held locks and open database connections
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker, initargs=(self.path, country_codes))
+        # Requests may still use a replaced index, the pool is stopped once nothing references the ranker
+        weakref.finalize(self, _shutdown, self.executor, self.path)
+
+    def shards(self):
+        bounds = np.linspace(0, self.testers, self.workers + 1).astype(int)
+        return [(int(start), int(stop)) for start, stop in zip(bounds, bounds[1:]) if start < stop]
+
+    def rank(self, columns=None, codes=None):
+        # Returns (row, experience) pairs, rows are in name order so ties keep the database ordering
+        futures = [self.executor.submit(_rank_shard, start, stop, columns, codes) for start, stop in self.shards()]
+        shards = [zip((-experience).tolist(), rows.tolist()) for rows, experience in (f.result() for f in futures)]
+        return [(row, -negative_experience) for negative_experience, row in heapq.merge(*shards)]
+
+
+def _shutdown(executor, path):
+    executor.shutdown(wait=False, cancel_futures=True)
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _init_worker(path, country_codes):
+    try:
+        _worker['owned_counts'] = np.load(path, mmap_mode='r')
+    except FileNotFoundError:
+        # Processes are spawned on demand, the ranker may have been stopped while this one was starting
+        return
+    _worker['country_codes'] = country_codes
+
+
+def _rank_shard(start, stop, columns, codes):
+    owned_counts = _worker['owned_counts'][start:stop]
+    experience = owned_counts.sum(axis=1) if columns is None else owned_counts[:, columns].sum(axis=1)
+    experience = experience.astype(np.int64)
+    rows = np.arange(start, stop)
+
+    if codes:
+        selected = np.isin(_worker['country_codes'][start:stop], codes)
+        rows, experience = rows[selected], experience[selected]
+
+    order = np.argsort(-experience, kind='stable')
+    return rows[order], experience[order]
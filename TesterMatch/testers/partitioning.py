@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .models import Bug, TesterDeviceDayExperience, TesterDeviceExperience
+
+# Bugs and the experience tables derived from them are partitioned on the same column
+PARTITIONED_MODELS = (Bug, TesterDeviceExperience, TesterDeviceDayExperience)
+PARTITION_KEYS = {'device': 'device_id', 'tester': 'tester_id'}
+
+
+def partitioning_settings():
+    # Returns the partition key column and number of partitions, or None when tables aren't partitioned
+    key = settings.BUG_PARTITION_KEY
+    if not key:
+        return None
+    if key not in PARTITION_KEYS:
+        raise ImproperlyConfigured('BUG_PARTITION_KEY has to be one of: {}'.format(', '.join(PARTITION_KEYS)))
+    if settings.BUG_PARTITIONS < 1:
+        raise ImproperlyConfigured('BUG_PARTITIONS has to be a positive number')
+    return PARTITION_KEYS[key], settings.BUG_PARTITIONS
+
+
+def partition_key(connection, model):
+    # Column the table of the model is partitioned on, None for regular tables and other databases
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT a.attname FROM pg_partitioned_table p '
+            'JOIN pg_attribute a ON a.attrelid = p.partrelid AND a.attnum = p.partattrs[0] '
+            'WHERE p.partrelid = to_regclass(%s)', [model._meta.db_table])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def partition_tables(schema_editor, key, partitions):
+    """
+    Recreates bug and experience tables as hash partitioned on key, copying rows, indexes and constraints.
+    Primary and unique keys are extended with the partition key, ids stay unique through their sequence.
+    """
+    for model in PARTITIONED_MODELS:
+        _rebuild_table(schema_editor, model._meta.db_table, key, partitions)
+
+
+def unpartition_tables(schema_editor):
+    for model in PARTITIONED_MODELS:
+        if partition_key(schema_editor.connection, model) is not None:
+            _rebuild_table(schema_editor, model._meta.db_table)
+
+
+def table_definitions(connection, table):
+    """
+    Returns (name, definition) of the indexes of a table which don't belong to constraints, (name, type,
+    definition) of its primary key, unique and foreign key constraints, whether id is an identity column
+    and the name of its sequence.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT indexname, indexdef FROM pg_indexes i WHERE tablename = %s AND NOT EXISTS '
+                       '(SELECT 1 FROM pg_constraint c WHERE c.conindid = to_regclass(i.indexname)) '
+                       'ORDER BY indexname', [table])
+        indexes = cursor.fetchall()
+        cursor.execute('SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint '
+                       'WHERE conrelid = %s::regclass AND contype IN (\'p\', \'u\', \'f\') ORDER BY conname',
+                       [table])
+        constraints = cursor.fetchall()
+        cursor.execute('SELECT attidentity != \'\' FROM pg_attribute '
+                       'WHERE attrelid = %s::regclass AND attname = \'id\'', [table])
+        identity = cursor.fetchone()[0]
+        cursor.execute('SELECT pg_get_serial_sequence(%s, \'id\')', [table])
+        sequence = cursor.fetchone()[0]
+    return indexes, constraints, identity, sequence
+
+
+def _rebuild_table(schema_editor, table, key=None, partitions=None):
+    qn = schema_editor.quote_name
+    old_table = table + '_unpartitioned' if key else table + '_partitioned'
+
+    # Indexes and constraints are recreated from their definitions after the old table is dropped
+    indexes, constraints, identity, sequence = table_definitions(schema_editor.connection, table)
+
+    schema_editor.execute('ALTER TABLE {} RENAME TO {}'.format(qn(table), qn(old_table)))
+    schema_editor.execute('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS){}'
+                          .format(qn(table), qn(old_table),
+                                  ' PARTITION BY HASH ({})'.format(qn(key)) if key else ''))
+    for remainder in range(partitions or 0):
+        schema_editor.execute('CREATE TABLE {} PARTITION OF {} FOR VALUES WITH (MODULUS {}, REMAINDER {})'.format(
+            qn('{}_p{}'.format(table, remainder)), qn(table), partitions, remainder))
+    schema_editor.execute('INSERT INTO {} OVERRIDING SYSTEM VALUE SELECT * FROM {}'.format(qn(table), qn(old_table)))
+
+    if not identity:
+        # Tables created by older Django versions use serial columns, the sequence moves to the new table
+        schema_editor.execute('ALTER SEQUENCE {} OWNED BY {}.id'.format(sequence, qn(table)))
+    schema_editor.execute('DROP TABLE {}'.format(qn(old_table)))
+    if identity:
+        # New identity sequence takes over the name of the dropped one and continues after the copied ids
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('SELECT pg_get_serial_sequence(%s, \'id\')', [table])
+            new_sequence = cursor.fetchone()[0]
+        schema_editor.execute('ALTER SEQUENCE {} RENAME TO {}'.format(new_sequence, sequence.split('.')[-1]))
+        schema_editor.execute('SELECT setval(%s, coalesce(max(id), 0) + 1, false) FROM {}'.format(qn(table)),
+                              [sequence])
+
+    for _, definition in indexes:
+        schema_editor.execute(definition)
+    for name, constraint_type, definition in constraints:
+        if constraint_type in ('p', 'u'):
+            # Unique keys of the experience tables already contain both columns, primary keys get the key added
+            columns = [c.strip() for c in definition[definition.index('(') + 1:definition.rindex(')')].split(',')]
+            if not key and constraint_type == 'p':
+                columns = ['id']
+            elif key and key not in columns:
+                columns.append(key)
+            definition = '{} ({})'.format('PRIMARY KEY' if constraint_type == 'p' else 'UNIQUE',
+                                          ', '.join(qn(c) for c in columns))
+        schema_editor.execute('ALTER TABLE {} ADD CONSTRAINT {} {}'.format(qn(table), qn(name), definition))
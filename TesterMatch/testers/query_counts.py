@@ -0,0 +1,111 @@
+import re
+from collections import Counter
+from contextlib import ExitStack
+
+from django.db import connections
+
+# Literals and parameter lists which differ between executions of the same statement
+_NORMALIZE_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'"s\d+_x\d+"'), '"?"'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)'), '(...)'),
+    (re.compile(r'(?:\(\.\.\.\)\s*,\s*)+\(\.\.\.\)'), '(...)'),
+]
+
+
+def normalize_sql(sql):
+    for pattern, replacement in _NORMALIZE_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+class _RowCountingCursor:
+    # Database cursor proxy adding the rows returned by fetch calls and iteration to a query record
+
+    def __init__(self, cursor, record):
+        self._cursor = cursor
+        self._record = record
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._record['rows'] += 1
+            yield row
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._record['rows'] += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._record['rows'] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._record['rows'] += len(rows)
+        return rows
+
+
+class QueryRecorder:
+    """
+    Records SQL statements executed on all connections inside the block together with the number of rows
+    fetched from each of them, also rows read after the block by lazy iteration.
+
+    Used by the tests to pin query counts and find statements executed once per row (N+1 queries).
+    """
+
+    def __init__(self):
+        self.queries = []
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self._record))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def _record(self, execute, sql, params, many, context):
+        record = {'sql': sql, 'rows': 0}
+        self.queries.append(record)
+        wrapper = context['cursor']
+        if not isinstance(wrapper.cursor, _RowCountingCursor):
+            wrapper.cursor = _RowCountingCursor(wrapper.cursor, record)
+        else:
+            wrapper.cursor._record = record
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    @property
+    def rows(self):
+        return sum(q['rows'] for q in self.queries)
+
+    def statements(self):
+        # Number of executions of every normalised statement
+        return Counter(normalize_sql(q['sql']) for q in self.queries)
+
+    def report(self):
+        lines = ['{} queries fetching {} rows'.format(len(self), self.rows)]
+        lines += ['{:>5} x {}'.format(count, sql) for sql, count in self.statements().most_common()]
+        return '\n'.join(lines)
+
+
+def growing_statements(recordings):
+    """
+    Statements executed more often as the data grows, from recordings of the same operation ordered by data
+    size. Returns a report of them with their execution counts, empty when the number of queries is constant.
+    """
+    counts = [recording.statements() for recording in recordings]
+    growing = sorted(sql for sql in set().union(*counts) if len({c[sql] for c in counts}) > 1)
+    return '\n'.join('{} x {}'.format(' -> '.join(str(c[sql]) for c in counts), sql) for sql in growing)
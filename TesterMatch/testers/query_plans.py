@@ -0,0 +1,56 @@
+import datetime
+import re
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+
+from .matching import tester_query
+from .models import Bug, Tester, TesterDeviceDayExperience, TesterDeviceExperience
+
+TesterDevice = Tester.devices.through
+
+# SQLite automatic indexes are built by scanning the whole table for every query
+_SEQUENTIAL_SCAN_PATTERNS = {
+    'postgresql': [re.compile(r'Seq Scan on (\w+)')],
+    'sqlite': [re.compile(r'\bSCAN (?:TABLE )?(\w+)(?! USING)(?:\s|$)'),
+               re.compile(r'\bSEARCH (?:TABLE )?(\w+) USING AUTOMATIC')],
+}
+
+
+def standard_query_shapes(devices, countries):
+    """
+    Queries run by match-testers and by the experience consistency check, mapped to the tables which
+    must be read through an index. Testers may be scanned when they are ranked by experience on selected devices
+    without a country filter.
+    """
+    experience = TesterDeviceExperience._meta.db_table
+    day_experience = TesterDeviceDayExperience._meta.db_table
+    tester = Tester._meta.db_table
+    since = datetime.date.today() - datetime.timedelta(days=90)
+
+    return {
+        'all devices, all countries': (tester_query(), {tester}),
+        'all devices, countries': (tester_query(countries=countries), {tester}),
+        'devices, all countries': (tester_query(devices=devices), {experience}),
+        'devices, countries': (tester_query(devices=devices, countries=countries), {experience, tester}),
+        'devices, time window': (tester_query(devices=devices, since=since), {day_experience}),
+        'devices, decay, active testers': (tester_query(devices=devices, decay=30, active_since=since),
+                                           {day_experience, tester}),
+        'live experience': (Tester.objects.annotate(experience=Count('bug', filter=Q(bug__device__in=F('devices'))))
+                            .values_list('id', 'experience'),
+                            {Bug._meta.db_table, TesterDevice._meta.db_table}),
+    }
+
+
+def explain(query_set):
+    # Test databases are tiny, PostgreSQL is told to avoid sequential scans to show which indexes can be used
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return query_set.explain()
+
+
+def sequential_scans(plan):
+    patterns = _SEQUENTIAL_SCAN_PATTERNS.get(connection.vendor, [])
+    return {table for pattern in patterns for table in pattern.findall(plan)}
@@ -0,0 +1,57 @@
+import functools
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+# Replica alias used for reads of the current request, None sends them to the primary
+_replica = ContextVar('replica', default=None)
+
+
+def read_from_replica(view):
+    """
+    Sends database reads of a read-only view to one randomly chosen replica from DATABASE_REPLICAS.
+    Works for sync and async views, the context is copied to threads running sync_to_async code.
+    """
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            token = _replica.set(_choose_replica())
+            try:
+                return await view(*args, **kwargs)
+            finally:
+                _replica.reset(token)
+    else:
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            token = _replica.set(_choose_replica())
+            try:
+                return view(*args, **kwargs)
+            finally:
+                _replica.reset(token)
+    return wrapper
+
+
+def _choose_replica():
+    return random.choice(settings.DATABASE_REPLICAS) if settings.DATABASE_REPLICAS else None
+
+
+class ReplicaRouter:
+    """
+    Reads inside views wrapped with read_from_replica go to a replica, everything else including
+    writes, populate_db and migrations uses the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _replica.get() or 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas contain the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
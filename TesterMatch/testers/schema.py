@@ -0,0 +1,76 @@
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.urls import include, re_path
+from django.utils.http import parse_etags
+
+SCHEMA_FORMATS = {'.json': 'application/json', '.yaml': 'application/yaml'}
+
+_schemas = {}
+_ui_views = {}
+_lock = threading.Lock()
+
+
+def _schema_patterns():
+    from .urls import schema_urlpatterns
+    return [re_path(r'^', include(schema_urlpatterns))]
+
+
+def generate_schema(schema_format):
+    # drf_yasg and the swagger annotations of the views are imported only here. The schema has no host,
+    # so the same document works behind any domain.
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+    from drf_yasg.generators import OpenAPISchemaGenerator
+    from .api_docs import api_info
+
+    schema = OpenAPISchemaGenerator(api_info, patterns=_schema_patterns()).get_schema(request=None, public=True)
+    codec = OpenAPICodecJson if schema_format == '.json' else OpenAPICodecYaml
+    return codec(validators=[]).encode(schema)
+
+
+def schema_path(schema_format):
+    return os.path.join(settings.OPENAPI_SCHEMA_DIR, 'swagger' + schema_format)
+
+
+def get_schema(schema_format):
+    """
+    Returns the schema and its ETag, read from OPENAPI_SCHEMA_DIR when generate_schema wrote it there at build time,
+    otherwise generated on the first request of every process.
+    """
+    with _lock:
+        if schema_format not in _schemas:
+            if settings.OPENAPI_SCHEMA_DIR and os.path.exists(schema_path(schema_format)):
+                with open(schema_path(schema_format), 'rb') as f:
+                    content = f.read()
+            else:
+                content = generate_schema(schema_format)
+            _schemas[schema_format] = content, '"{}"'.format(hashlib.sha1(content).hexdigest())
+        return _schemas[schema_format]
+
+
+def schema_view(request, schema_format):
+    content, etag = get_schema(schema_format)
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type=SCHEMA_FORMATS[schema_format])
+    response['ETag'] = etag
+    response['Cache-Control'] = 'public, max-age={}'.format(settings.OPENAPI_SCHEMA_MAX_AGE)
+    return response
+
+
+def docs_ui_view(request, renderer):
+    # Swagger UI and ReDoc pages load the schema from schema_view, set as SPEC_URL in the settings
+    with _lock:
+        if renderer not in _ui_views:
+            from drf_yasg.views import get_schema_view
+            from rest_framework import permissions
+            from .api_docs import api_info
+
+            _ui_views[renderer] = get_schema_view(
+                api_info, public=True, patterns=_schema_patterns(), permission_classes=(permissions.AllowAny,),
+            ).with_ui(renderer, cache_timeout=0)
+    return _ui_views[renderer](request)
@@ -1,5 +1,9 @@
+from json.encoder import encode_basestring
+
+from django.conf import settings
 from rest_framework import serializers
-from .models import Tester, Device
+from .lookups import device_ids
+from .models import Tester, Device, SUPPORTED_COUNTRIES
 
 
 class TesterSerializer(serializers.ModelSerializer):
@@ -14,3 +18,61 @@ class DeviceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Device
         fields = ('description', 'id')
+
+
+class MatchQuerySerializer(serializers.Serializer):
+    devices = serializers.ListField(child=serializers.IntegerField(), required=False, default=list,
+                                    help_text='devices for which experience should be calculated, empty means all')
+    countries = serializers.ListField(child=serializers.ChoiceField(choices=[c[0] for c in SUPPORTED_COUNTRIES]),
+                                      required=False, default=list,
+                                      help_text='countries from which testers should be included, empty means any')
+    limit = serializers.IntegerField(min_value=1, max_value=settings.MATCH_MAX_LIMIT, required=False, default=None,
+                                     help_text='maximum number of testers to return')
+
+
+class MatchBatchSerializer(serializers.Serializer):
+    queries = MatchQuerySerializer(many=True)
+
+    def validate_queries(self, queries):
+        if not queries:
+            raise serializers.ValidationError('At least one query is required')
+        if len(queries) > settings.MATCH_BATCH_MAX_QUERIES:
+            raise serializers.ValidationError(
+                'At most {} queries can be sent at once'.format(settings.MATCH_BATCH_MAX_QUERIES))
+
+        existing = device_ids()
+        for i, query in enumerate(queries):
+            if not existing.issuperset(query['devices']):
+                raise serializers.ValidationError('Query {} has invalid devices'.format(i))
+            query['devices'] = list(dict.fromkeys(query['devices']))
+        return queries
+
+
+# Fast path rendering rows straight to JSON, producing the same bytes as JSONRenderer with the serializers above
+_TESTER_JSON = '{{"experience":{},"first_name":{},"last_name":{},"country":{}}}'
+_DEVICE_JSON = '{{"description":{},"id":{}}}'
+
+
+def _encode(text):
+    # JSONRenderer escapes line and paragraph separators which are invalid in JavaScript strings
+    return text.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode('utf-8')
+
+
+def tester_json(row):
+    experience, first_name, last_name, country = row[:4]
+    return _TESTER_JSON.format(int(experience), encode_basestring(first_name), encode_basestring(last_name),
+                               encode_basestring(country))
+
+
+def render_tester(row):
+    return _encode(tester_json(row))
+
+
+def render_testers(rows):
+    # Rows are (experience, first_name, last_name, country, ...) tuples
+    return _encode('[' + ','.join(map(tester_json, rows)) + ']')
+
+
+def render_devices(rows):
+    # Rows are (description, id) tuples
+    return _encode('[' + ','.join(_DEVICE_JSON.format(encode_basestring(d), int(i)) for d, i in rows) + ']')
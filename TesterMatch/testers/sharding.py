@@ -0,0 +1,58 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Worker processes are spawned and import this module before Django is set up, so it must not import models.
+# Forked workers would share the database connections of the parent process.
+
+
+def _init_worker(settings_dict):
+    import django
+    django.setup()
+
+    # Connects to the same database as the parent, which may be a test database
+    from django.db import DEFAULT_DB_ALIAS, connections
+    connections[DEFAULT_DB_ALIAS].settings_dict.update(settings_dict)
+
+
+def _count_shard(table_name, staging_name, path, start, end):
+    from .loading import read_shard
+    return sum(1 for _ in read_shard(path, start, end))
+
+
+def _load_shard(table_name, staging_name, path, start, end, first_id, batch_size):
+    from django.db import connection
+    from .loading import SHARDED_TABLES, StagingTable, read_shard
+
+    table = SHARDED_TABLES[table_name]
+    values = map(table[2], read_shard(path, start, end))
+    if connection.vendor != 'postgresql':
+        # Other databases don't take parallel writers, shards are parsed here and staged by the parent process
+        return list(values)
+
+    return StagingTable(table, staging_name).load(values, batch_size, first_id)
+
+
+def stage_shards(shards, workers, settings_dict, batch_size):
+    """
+    Loads (table name, staging table, path, start, end) shards in worker processes, each with its own connection,
+    into staging tables created beforehand. Rows of files without ids are counted first, so the ids of every shard
+    continue after the previous shards of the file. Returns the first id (None for files with ids) and the number
+    of staged rows of every shard on PostgreSQL, or the parsed rows on other databases.
+    """
+    from .loading import SHARDED_TABLES
+
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(settings_dict,)) as executor:
+        counts = [executor.submit(_count_shard, *shard) if 'id' not in SHARDED_TABLES[shard[0]][1] else None
+                  for shard in shards]
+        first_ids, next_ids = [], {}
+        for shard, count in zip(shards, counts):
+            if count is None:
+                first_ids.append(None)
+            else:
+                first_ids.append(next_ids.get(shard[1], 1))
+                next_ids[shard[1]] = first_ids[-1] + count.result()
+
+        futures = [executor.submit(_load_shard, *shard, first_id, batch_size)
+                   for shard, first_id in zip(shards, first_ids)]
+        return [(first_id, f.result()) for first_id, f in zip(first_ids, futures)]
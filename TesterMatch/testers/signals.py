@@ -0,0 +1,80 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import experience
+from .models import Bug, Device, Tester
+from .versioning import bump_data_version
+
+
+@receiver(pre_save, sender=Bug)
+def remember_bug_pair(sender, instance, **kwargs):
+    # Needed to move the bug between experience rows when its tester, device or report time changes
+    instance._previous_report = None
+    if instance.pk is not None:
+        instance._previous_report = Bug.objects.filter(pk=instance.pk) \
+            .values_list('tester_id', 'device_id', 'reported_at').first()
+
+
+@receiver(post_save, sender=Bug)
+def bug_saved(sender, instance, created, **kwargs):
+    previous_report = getattr(instance, '_previous_report', None)
+    current_report = (instance.tester_id, instance.device_id, instance.reported_at)
+    if previous_report == current_report:
+        return
+
+    if previous_report is None or previous_report[:2] != current_report[:2]:
+        if previous_report is not None:
+            experience.increment(*previous_report[:2], delta=-1)
+        experience.increment(*current_report[:2], delta=1)
+
+    if previous_report is not None:
+        experience.increment_day(*previous_report, delta=-1)
+    experience.increment_day(*current_report, delta=1)
+
+
+@receiver(post_delete, sender=Bug)
+def bug_deleted(sender, instance, **kwargs):
+    experience.increment(instance.tester_id, instance.device_id, delta=-1)
+    experience.increment_day(instance.tester_id, instance.device_id, instance.reported_at, delta=-1)
+
+
+@receiver(m2m_changed, sender=Tester.devices.through)
+def tester_devices_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    instance_field, related_field = ('device_id', 'tester_id') if reverse else ('tester_id', 'device_id')
+
+    if action == 'post_add':
+        experience.add_ownership(**{instance_field: instance.pk, related_field + '__in': pk_set})
+    elif action == 'post_remove':
+        experience.remove_ownership(**{instance_field: instance.pk, related_field + '__in': pk_set})
+    elif action == 'post_clear':
+        experience.remove_ownership(**{instance_field: instance.pk})
+
+
+@receiver(pre_delete, sender=Device)
+def remember_device_owners(sender, instance, **kwargs):
+    # Ownership and experience rows of the device are deleted by the cascade without m2m signals
+    instance._owner_ids = list(Tester.devices.through.objects.filter(device_id=instance.pk)
+                               .values_list('tester_id', flat=True))
+
+
+@receiver(post_delete, sender=Device)
+def device_deleted(sender, instance, **kwargs):
+    owner_ids = getattr(instance, '_owner_ids', None)
+    if owner_ids:
+        experience.refresh_total_experience(owner_ids)
+
+
+@receiver(post_save, sender=Bug)
+@receiver(post_save, sender=Tester)
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Bug)
+@receiver(post_delete, sender=Tester)
+@receiver(post_delete, sender=Device)
+def matching_data_changed(sender, **kwargs):
+    bump_data_version(devices=sender is Device)
+
+
+@receiver(m2m_changed, sender=Tester.devices.through)
+def tester_devices_version_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_data_version()
@@ -0,0 +1,123 @@
+"""
+Approximate bug counts for match-testers mode=approx.
+
+Every device keeps a Space-Saving summary with APPROX_SKETCH_COUNTERS counters, a count and its maximum error for
+the testers with the most bugs on the device. Like experience rows, only bugs on owned devices are counted. A tester
+without a counter has at most floor bugs on the device. The estimate is the count of a counter, or 0 without one,
+and it differs from the exact count by at most the floor of the device. Summaries are updated together with the
+experience rows and rebuilt from them by rebuild_experience.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import DeviceSketch, Tester, TesterDeviceExperience
+
+# Testers ranked at once by approximate_match are loaded in batches of this size
+_TESTER_BATCH_SIZE = 500
+
+
+def update_summary(counters, floor, deltas, size):
+    """
+    Adds {tester_id: delta} to counters {tester_id: [count, error]} of at most size testers, returns the new floor.
+    Counts never drop below the exact ones: a new counter starts at the floor, the bound of uncounted testers.
+    """
+    for tester_id, delta in deltas.items():
+        key = str(tester_id)
+        counter = counters.get(key)
+        if counter is not None:
+            counter[0] += delta
+            # A count of 0 is exact, the tester is left to the floor
+            if counter[0] <= 0:
+                del counters[key]
+        elif delta > 0:
+            if len(counters) >= size:
+                evicted = min(counters, key=lambda k: counters[k][0])
+                floor = max(floor, counters.pop(evicted)[0])
+            counters[key] = [floor + delta, floor]
+        # Uncounted testers losing bugs stay under the floor
+    return floor
+
+
+def add_counts(device_id, deltas):
+    # Applies {tester_id: delta} of bugs on owned devices to the summary of the device
+    if not deltas:
+        return
+    with transaction.atomic():
+        sketch, _ = DeviceSketch.objects.select_for_update().get_or_create(device_id=device_id)
+        sketch.floor = update_summary(sketch.counters, sketch.floor, deltas, settings.APPROX_SKETCH_COUNTERS)
+        sketch.save(update_fields=['counters', 'floor'])
+
+
+def rebuild_sketches(device_ids=None):
+    """
+    Exact summaries of all devices, or only of the given ones, from the experience rows. The floor is the largest
+    count left out. Returns the number of stored summaries.
+    """
+    if device_ids is None:
+        DeviceSketch.objects.all().delete()
+        return _build_sketches(TesterDeviceExperience.objects.all())
+
+    device_ids = sorted(device_ids)
+    batch_size = connection.features.max_query_params or len(device_ids) or 1
+    built = 0
+    for i in range(0, len(device_ids), batch_size):
+        batch = device_ids[i:i + batch_size]
+        DeviceSketch.objects.filter(device_id__in=batch).delete()
+        built += _build_sketches(TesterDeviceExperience.objects.filter(device_id__in=batch))
+    return built
+
+
+def _build_sketches(experience_rows):
+    size = settings.APPROX_SKETCH_COUNTERS
+    sketches = {}
+    rows = experience_rows.filter(bug_count__gt=0).order_by('device_id', '-bug_count', 'tester_id') \
+        .values_list('device_id', 'tester_id', 'bug_count')
+    for device_id, tester_id, bug_count in rows.iterator():
+        sketch = sketches.setdefault(device_id, DeviceSketch(device_id=device_id, counters={}, floor=0))
+        if len(sketch.counters) < size:
+            sketch.counters[str(tester_id)] = [bug_count, 0]
+        elif not sketch.floor:
+            sketch.floor = bug_count
+
+    DeviceSketch.objects.bulk_create(sketches.values(), batch_size=1000)
+    return len(sketches)
+
+
+def approximate_match(devices=None, countries=None, limit=20):
+    """
+    Returns the top limit testers ranked by estimated experience on the devices (all when empty) as ROW_FIELDS
+    tuples, together with the error bound: the exact experience of every tester, returned or not, differs from
+    the estimate by at most this number. Ties are ordered by name.
+    """
+    sketches = DeviceSketch.objects.filter(device_id__in=devices) if devices else DeviceSketch.objects.all()
+    estimates, error_bound = Counter(), 0
+    for counters, floor in sketches.values_list('counters', 'floor').iterator():
+        error_bound += floor
+        for tester_id, (count, _) in counters.items():
+            estimates[int(tester_id)] += count
+
+    testers = Tester.objects.filter(country__in=countries) if countries else Tester.objects.all()
+    fields = ('first_name', 'last_name', 'country', 'id')
+
+    # Testers are loaded in the order of their estimates until the next ones can't make it into the result
+    ranked = [tester_id for tester_id, _ in estimates.most_common()]
+    rows = []
+    for i in range(0, len(ranked), _TESTER_BATCH_SIZE):
+        batch = ranked[i:i + _TESTER_BATCH_SIZE]
+        rows += [(estimates[t], f, l, c, t) for f, l, c, t in testers.filter(id__in=batch).values_list(*fields)]
+        rows.sort(key=lambda row: (-row[0], row[2], row[1], row[4]))
+        if len(rows) >= limit and estimates[batch[-1]] < rows[limit - 1][0]:
+            break
+    rows = rows[:limit]
+
+    # Testers without counters are estimated at 0 and follow in name order
+    if len(rows) < limit:
+        for first_name, last_name, country, tester_id in testers.order_by('last_name', 'first_name', 'id') \
+                .values_list(*fields).iterator():
+            if tester_id not in estimates:
+                rows.append((0, first_name, last_name, country, tester_id))
+                if len(rows) == limit:
+                    break
+    return rows, error_bound
@@ -0,0 +1,59 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .matching import match
+from .models import RankingSnapshot, SUPPORTED_COUNTRIES
+from .serializers import render_testers
+from .versioning import get_data_version
+
+# Country of the snapshot ranking testers from all countries
+ALL_COUNTRIES = ''
+
+
+def snapshot_countries():
+    return [ALL_COUNTRIES] + [c[0] for c in SUPPORTED_COUNTRIES]
+
+
+def refresh_snapshots(force=False):
+    """
+    Renders the ranking of all testers on all devices for every country and for all countries.
+    Snapshots already built from the current data version are kept unless force is set. Returns the
+    countries which were refreshed.
+    """
+    # Version is read first, changes made while rendering make the snapshots stale instead of wrongly fresh
+    version = get_data_version()
+    current = set(RankingSnapshot.objects.filter(version=version).values_list('country', flat=True))
+
+    refreshed = []
+    for country in snapshot_countries():
+        if country in current and not force:
+            continue
+        content = render_testers(match(countries=[country] if country else None))
+        RankingSnapshot.objects.update_or_create(country=country, defaults={
+            'version': version, 'content': content, 'created_at': timezone.now()})
+        refreshed.append(country)
+    return refreshed
+
+
+def get_snapshot(countries):
+    """
+    Returns (content, fresh) for a query of all devices and at most one country, or None when there is no
+    snapshot for it. Snapshots of an older data version are served until they are older than
+    RANKING_SNAPSHOT_MAX_STALENESS seconds.
+    """
+    if len(countries) > 1:
+        return None
+
+    snapshot = RankingSnapshot.objects.filter(country=countries[0] if countries else ALL_COUNTRIES) \
+        .values_list('version', 'created_at', 'content').first()
+    if snapshot is None:
+        return None
+
+    version, created_at, content = snapshot
+    if version == get_data_version():
+        return bytes(content), True
+    if timezone.now() - created_at <= timedelta(seconds=settings.RANKING_SNAPSHOT_MAX_STALENESS):
+        return bytes(content), False
+    return None
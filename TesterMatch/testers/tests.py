@@ -1,19 +1,195 @@
+import csv
+import gzip
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
 from django.core.management import call_command, CommandError
-from django.test import TestCase
+from django.db import connection, DatabaseError, IntegrityError, router, transaction
+from django.db.models import Count, F, Q
+from django.db.utils import ConnectionDoesNotExist
+from django.forms import modelform_factory
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
 from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase
 from rest_framework.utils import json
 
-from .models import Device, Tester, Bug
+from .benchmark import generate_dataset, percentile
+from .datafile import InvalidDataFile, read_data_file, write_data_file
+from .engine import MatchIndex, np
+from .experience import day_experience_mismatches, day_number, experience_mismatches, rebuild_experience, \
+    stored_experience
+from .loading import read_rows, read_shard, shard_ranges
+from .lookups import device_ids
+from .matching import encode_cursor, TESTER_FIELDS, tester_query
+from .metrics import Histogram, HISTOGRAMS
+from .models import Device, DeviceSketch, Tester, Bug, RankingSnapshot, TesterDeviceDayExperience, \
+    TesterDeviceExperience, SUPPORTED_COUNTRIES
+from .partitioning import PARTITIONED_MODELS, partition_key, partition_tables, table_definitions, unpartition_tables
+from .query_counts import growing_statements, normalize_sql, QueryRecorder
+from .query_plans import explain, sequential_scans, standard_query_shapes
+from .routers import read_from_replica
+from . import schema
+from .serializers import DeviceSerializer, TesterSerializer, render_devices, render_tester, render_testers
+from .sketches import approximate_match, update_summary
+from .snapshots import refresh_snapshots, snapshot_countries
+from .views import device_list_async, match_testers_async
 
 
 class PopulateDbTest(TestCase):
     def test_command(self):
-        call_command('populate_db')
+        call_command('populate_db', stdout=StringIO())
+        self.assertEqual(Device.objects.count(), 10)
+        self.assertEqual(Tester.objects.count(), 9)
+        self.assertEqual(Bug.objects.count(), 1000)
+        self.assertEqual(Tester.devices.through.objects.all().count(), 36)
+        self.assertEqual(TesterDeviceExperience.objects.count(), 36)
+        self.assertEqual(experience_mismatches(), {})
+        self.assertEqual(RankingSnapshot.objects.count(), len(SUPPORTED_COUNTRIES) + 1)
+
+    def test_command_fast(self):
+        out = StringIO()
+        call_command('populate_db', '--fast', '--batch-size', '300', stdout=out)
         self.assertEqual(Device.objects.count(), 10)
         self.assertEqual(Tester.objects.count(), 9)
         self.assertEqual(Bug.objects.count(), 1000)
         self.assertEqual(Tester.devices.through.objects.all().count(), 36)
+        self.assertEqual(experience_mismatches(), {})
+        self.assertIn('testers_bug: 1000 rows loaded', out.getvalue())
+
+        # Sequences continue after imported ids
+        self.assertEqual(Device.objects.create(description='Pixel').id, 11)
+
+    def test_command_fast_same_as_default(self):
+        call_command('populate_db', stdout=StringIO())
+        expected = self.get_imported_rows()
+        Device.objects.all().delete()
+        Tester.objects.all().delete()
+
+        call_command('populate_db', '--fast', stdout=StringIO())
+        self.assertEqual(self.get_imported_rows(), expected)
+
+    def test_shard_ranges(self):
+        path = 'testers/initial_data/bugs.csv'
+        for shards in (1, 2, 3, 7):
+            ranges = shard_ranges(path, shards)
+            self.assertEqual(len(ranges), shards)
+            self.assertEqual([row for start, end in ranges for row in read_shard(path, start, end)],
+                             list(read_rows(path)))
+
+        # Small files give fewer shards than requested, never empty ones
+        ranges = shard_ranges('testers/initial_data/devices.csv', 100)
+        self.assertEqual(len(ranges), 10)
+        self.assertTrue(all(start < end for start, end in ranges))
+
+    @staticmethod
+    def get_imported_rows():
+        return [list(Device.objects.order_by('pk').values_list()),
+                list(Tester.objects.order_by('pk').values_list()),
+                list(Bug.objects.order_by('pk').values_list()),
+                list(Tester.devices.through.objects.order_by('tester_id', 'device_id')
+                     .values_list('tester_id', 'device_id'))]
+
+    def test_command_incremental_empty(self):
+        call_command('populate_db', '--incremental', stdout=StringIO())
+        self.assertEqual(Bug.objects.count(), 1000)
+        self.assertEqual(Tester.devices.through.objects.all().count(), 36)
+        self.assertEqual(experience_mismatches(), {})
+
+    def test_command_incremental(self):
+        call_command('populate_db', stdout=StringIO())
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        changed = self.write_changed_data(data_dir.name)
+
+        out = StringIO()
+        call_command('populate_db', '--incremental', '--batch-size', '100', '--data-dir', data_dir.name, stdout=out)
+        self.assertIn('devices: 1 inserted, 1 updated, 0 deleted', out.getvalue())
+        self.assertIn('testers: 0 inserted, 0 updated, 1 deleted', out.getvalue())
+        self.assertIn('bugs: 1 inserted, 1 updated, {} deleted'.format(changed['deleted_bugs']), out.getvalue())
+        self.assertIn('device tester relations: 1 added, {} removed'.format(changed['removed_relations']),
+                      out.getvalue())
+        self.assertEqual(experience_mismatches(), {})
+        self.assertEqual(day_experience_mismatches(), {})
+        self.assertEqual(Bug.objects.get(id=1001).reported_at.isoformat(), '2020-01-02T03:04:05+00:00')
+        self.assertEqual(list(TesterDeviceDayExperience.objects.values_list('tester_id', 'device_id', 'bug_count')),
+                         [(1, 11, 1)])
+        incremental_rows = self.get_imported_rows()
+
+        Device.objects.all().delete()
+        Tester.objects.all().delete()
+        call_command('populate_db', '--data-dir', data_dir.name, stdout=StringIO())
+        self.assertEqual(self.get_imported_rows(), incremental_rows)
+
+        out = StringIO()
+        call_command('populate_db', '--incremental', '--data-dir', data_dir.name, stdout=out)
+        self.assertIn('No changes', out.getvalue())
+
+    def test_command_incremental_device_without_owners(self):
+        # Device lost its owners before, its emptied summary is removed with it
+        call_command('populate_db', stdout=StringIO())
+        Device.objects.get(id=10).tester_set.clear()
+        self.assertTrue(DeviceSketch.objects.filter(device_id=10).exists())
+
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        for name, device_column in (('devices.csv', 0), ('bugs.csv', 1), ('testers.csv', None),
+                                    ('tester_device.csv', 1)):
+            with open('testers/initial_data/' + name) as f:
+                rows = [row for row in csv.reader(f) if row and (device_column is None or row[device_column] != '10')]
+            with open(os.path.join(data_dir.name, name), 'w', newline='') as f:
+                csv.writer(f).writerows(rows)
+
+        out = StringIO()
+        call_command('populate_db', '--incremental', '--data-dir', data_dir.name, stdout=out)
+        self.assertIn('devices: 0 inserted, 0 updated, 1 deleted', out.getvalue())
+        connection.check_constraints()
+        self.assertFalse(DeviceSketch.objects.filter(device_id=10).exists())
+        self.assertEqual(experience_mismatches(), {})
+
+    @staticmethod
+    def write_changed_data(data_dir):
+        # Initial data with a new device, a renamed device, a removed tester, a new bug and a moved bug
+        def read(name):
+            with open('testers/initial_data/' + name) as f:
+                return [row for row in csv.reader(f) if row]
+
+        def write(name, rows):
+            with open(os.path.join(data_dir, name), 'w', newline='') as f:
+                csv.writer(f).writerows(rows)
+
+        devices = read('devices.csv') + [['11', 'Pixel']]
+        devices[1][1] = 'iPhone 4 (renamed)'
+        write('devices.csv', devices)
+
+        testers = read('testers.csv')
+        write('testers.csv', [t for t in testers if t[0] != '9'])
+
+        bugs = read('bugs.csv')
+        kept_bugs = [b for b in bugs if b[2] != '9']
+        kept_bugs[1][1] = '11'
+        kept_bugs.append(['1001', '11', '1', '2020-01-02 03:04:05'])
+        write('bugs.csv', kept_bugs)
+
+        relations = read('tester_device.csv')
+        kept_relations = [r for r in relations if r[0] != '9'] + [['1', '11']]
+        write('tester_device.csv', kept_relations)
+
+        return {'deleted_bugs': len(bugs) - len(kept_bugs) + 1,
+                'removed_relations': len(relations) - len(kept_relations) + 1}
 
     def test_command_non_empty_device(self):
         Device.objects.create(description='IPhone 3G')
@@ -42,10 +218,357 @@ class PopulateDbTest(TestCase):
         self.assertEqual(Bug.objects.count(), 1)
 
 
+# Workers stage shards on their own connections, so the staging tables are committed like in a real import
+class ParallelPopulateDbTest(TransactionTestCase):
+
+    def test_command_workers_same_as_default(self):
+        call_command('populate_db', stdout=StringIO())
+        expected = PopulateDbTest.get_imported_rows()
+        relations = list(Tester.devices.through.objects.order_by('pk').values_list('tester_id', 'device_id'))
+        Device.objects.all().delete()
+        Tester.objects.all().delete()
+        tables = [Bug._meta.db_table, Tester.devices.through._meta.db_table]
+        if connection.vendor == 'postgresql':
+            definitions = [table_definitions(connection, table) for table in tables]
+
+        out = StringIO()
+        call_command('populate_db', '--workers', '3', '--batch-size', '100', stdout=out)
+        self.assertEqual(out.getvalue().count('Staged'), 6)
+        self.assertEqual(PopulateDbTest.get_imported_rows(), expected)
+        self.assertEqual(list(Tester.devices.through.objects.order_by('pk').values_list('tester_id', 'device_id')),
+                         relations)
+        self.assertEqual(experience_mismatches(), {})
+        self.assertFalse([t for t in connection.introspection.table_names() if '_staging_' in t])
+        if connection.vendor == 'postgresql':
+            # Staging tables swapped in have the indexes, constraints and sequences of the tables they replaced
+            self.assertEqual([table_definitions(connection, table) for table in tables], definitions)
+            self.assertEqual(Bug.objects.create(device_id=1, tester_id=1).id, 1001)
+
+        with self.assertRaises(CommandError):
+            call_command('populate_db', '--workers', '2', stdout=StringIO())
+        for options in (('--workers', '0'), ('--workers', '2', '--incremental')):
+            with self.assertRaises(CommandError):
+                call_command('populate_db', *options, stdout=StringIO())
+
+
+class ExperienceTest(TestCase):
+
+    def setUp(self):
+        self.device_iphone = Device.objects.create(description='IPhone')
+        self.device_nokia = Device.objects.create(description='Nokia')
+        self.tester = Tester.objects.create(first_name='John', last_name='Smith', country='GB',
+                                            last_login=timezone.now())
+        self.other_tester = Tester.objects.create(first_name='Kate', last_name='Red', country='US',
+                                                  last_login=timezone.now())
+
+    def assertExperience(self, expected):
+        self.assertEqual(stored_experience(), expected)
+        self.assertEqual(dict(Tester.objects.values_list('id', 'total_experience')), expected)
+        self.assertEqual(experience_mismatches(), {})
+        self.assertEqual(day_experience_mismatches(), {})
+
+    def test_bugs_on_owned_devices(self):
+        self.tester.devices.add(self.device_iphone)
+        bug = Bug.objects.create(tester=self.tester, device=self.device_iphone)
+        Bug.objects.create(tester=self.tester, device=self.device_nokia)
+        self.assertExperience({self.tester.id: 1, self.other_tester.id: 0})
+
+        bug.delete()
+        self.assertExperience({self.tester.id: 0, self.other_tester.id: 0})
+
+    def test_device_added_and_removed(self):
+        Bug.objects.create(tester=self.tester, device=self.device_nokia)
+        Bug.objects.create(tester=self.tester, device=self.device_nokia)
+        self.tester.devices.add(self.device_nokia, self.device_iphone)
+        self.assertExperience({self.tester.id: 2, self.other_tester.id: 0})
+
+        self.tester.devices.remove(self.device_nokia)
+        self.assertExperience({self.tester.id: 0, self.other_tester.id: 0})
+
+        self.tester.devices.add(self.device_nokia)
+        self.tester.devices.clear()
+        self.assertExperience({self.tester.id: 0, self.other_tester.id: 0})
+        self.assertFalse(TesterDeviceExperience.objects.exists())
+
+    def test_reverse_relation(self):
+        Bug.objects.create(tester=self.other_tester, device=self.device_iphone)
+        self.device_iphone.tester_set.add(self.tester, self.other_tester)
+        self.assertExperience({self.tester.id: 0, self.other_tester.id: 1})
+
+        self.device_iphone.tester_set.remove(self.other_tester)
+        self.assertExperience({self.tester.id: 0, self.other_tester.id: 0})
+
+    def test_device_deleted(self):
+        self.tester.devices.add(self.device_iphone, self.device_nokia)
+        self.other_tester.devices.add(self.device_iphone)
+        Bug.objects.create(tester=self.tester, device=self.device_iphone)
+        Bug.objects.create(tester=self.tester, device=self.device_nokia)
+        Bug.objects.create(tester=self.other_tester, device=self.device_iphone)
+        self.assertExperience({self.tester.id: 2, self.other_tester.id: 1})
+
+        self.device_iphone.delete()
+        self.assertExperience({self.tester.id: 1, self.other_tester.id: 0})
+
+    def test_total_experience_ranking(self):
+        # Rankings on all devices read the stored totals, without aggregating experience rows
+        self.tester.devices.add(self.device_iphone)
+        Bug.objects.create(tester=self.tester, device=self.device_iphone)
+        for countries in (None, ['GB', 'US']):
+            query_set = tester_query(countries=countries)
+            self.assertNotIn('GROUP BY', str(query_set.query))
+            self.assertEqual([row[4] for row in query_set], [self.tester.id, self.other_tester.id])
+
+        Tester.objects.filter(id=self.other_tester.id).update(total_experience=5)
+        self.assertEqual(experience_mismatches(), {self.other_tester.id: (5, 0)})
+        call_command('rebuild_experience', stdout=StringIO())
+        self.assertExperience({self.tester.id: 1, self.other_tester.id: 0})
+
+    def test_stale_tester_saved(self):
+        self.tester.devices.add(self.device_iphone)
+        stale = Tester.objects.get(id=self.tester.id)
+        Bug.objects.create(tester=self.tester, device=self.device_iphone)
+
+        stale.first_name = 'Johnny'
+        stale.save()
+        stale.save(update_fields=['last_name', 'total_experience'])
+        self.assertEqual(Tester.objects.get(id=self.tester.id).first_name, 'Johnny')
+        self.assertExperience({self.tester.id: 1, self.other_tester.id: 0})
+        self.assertNotIn('total_experience', modelform_factory(Tester, fields='__all__').base_fields)
+
+    def test_deleted_tester_saved(self):
+        # Saving keeps the usual semantics, a deleted tester is inserted again
+        tester = Tester.objects.get(id=self.tester.id)
+        Tester.objects.filter(id=tester.id).delete()
+        tester.first_name = 'Johnny'
+        tester.save()
+        self.assertEqual(Tester.objects.get(id=tester.id).first_name, 'Johnny')
+
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            Tester.objects.filter(id=tester.id).delete()
+            tester.save(force_update=True)
+
+    def test_tester_saved_with_force_insert(self):
+        tester = Tester.objects.get(id=self.tester.id)
+        tester.pk = None
+        tester.save(force_insert=True)
+        self.assertEqual(Tester.objects.filter(first_name=tester.first_name, last_name=tester.last_name).count(), 2)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Tester.objects.get(id=self.tester.id).save(force_insert=True)
+
+    def test_deferred_tester_saved(self):
+        tester = Tester.objects.only('first_name').get(id=self.tester.id)
+        tester.first_name = 'Johnny'
+        with self.assertNumQueries(2):
+            # Update of the loaded field and the data version bump
+            tester.save()
+        self.assertEqual(Tester.objects.get(id=self.tester.id).first_name, 'Johnny')
+
+    def test_bug_moved(self):
+        self.tester.devices.add(self.device_iphone)
+        self.other_tester.devices.add(self.device_iphone)
+        bug = Bug.objects.create(tester=self.tester, device=self.device_iphone)
+
+        bug.tester = self.other_tester
+        bug.save()
+        self.assertExperience({self.tester.id: 0, self.other_tester.id: 1})
+
+        bug.device = self.device_nokia
+        bug.save()
+        self.assertExperience({self.tester.id: 0, self.other_tester.id: 0})
+
+    def test_rebuild_command(self):
+        self.tester.devices.add(self.device_iphone)
+        Bug.objects.bulk_create([Bug(tester=self.tester, device=self.device_iphone) for _ in range(3)])
+        with self.assertRaises(CommandError):
+            call_command('rebuild_experience', '--check-only', stdout=StringIO(), stderr=StringIO())
+
+        call_command('rebuild_experience', stdout=StringIO())
+        self.assertExperience({self.tester.id: 3, self.other_tester.id: 0})
+
+    def test_day_buckets(self):
+        now = timezone.now()
+        self.tester.devices.add(self.device_iphone)
+        Bug.objects.create(tester=self.tester, device=self.device_nokia, reported_at=now - timedelta(days=3))
+        bug = Bug.objects.create(tester=self.tester, device=self.device_iphone, reported_at=now - timedelta(days=2))
+        Bug.objects.create(tester=self.tester, device=self.device_iphone, reported_at=None)
+        self.assertExperience({self.tester.id: 2, self.other_tester.id: 0})
+        self.assertEqual(list(TesterDeviceDayExperience.objects.values_list('day', 'bug_count')),
+                         [(day_number(now) - 2, 1)])
+
+        bug.reported_at = now
+        bug.save()
+        self.assertExperience({self.tester.id: 2, self.other_tester.id: 0})
+
+        self.tester.devices.add(self.device_nokia)
+        self.assertExperience({self.tester.id: 3, self.other_tester.id: 0})
+        self.tester.devices.remove(self.device_iphone)
+        self.assertExperience({self.tester.id: 1, self.other_tester.id: 0})
+
+        bug.delete()
+        Bug.objects.filter(device=self.device_nokia).update(reported_at=now)
+        call_command('rebuild_experience', stdout=StringIO())
+        self.assertEqual(list(TesterDeviceDayExperience.objects.values_list('day', 'bug_count')),
+                         [(day_number(now), 1)])
+
+
+class QueryPlanTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('populate_db', stdout=StringIO())
+
+    def test_standard_query_shapes_use_indexes(self):
+        devices = list(Device.objects.values_list('id', flat=True)[:3])
+        for shape, (query_set, indexed_tables) in standard_query_shapes(devices, ['US', 'GB']).items():
+            with self.subTest(shape=shape):
+                plan = explain(query_set)
+                self.assertFalse(sequential_scans(plan) & indexed_tables,
+                                 'Sequential scan in query plan of "{}":\n{}'.format(shape, plan))
+
+    def test_sequential_scans(self):
+        plans = {
+            'postgresql': ('Hash Join\n  ->  Seq Scan on testers_bug\n  ->  Index Scan using idx on testers_tester',
+                           {'testers_bug'}),
+            'sqlite': ('2 0 0 SCAN testers_bug\n5 0 0 SCAN testers_tester USING INDEX idx\n'
+                       '7 0 0 SEARCH testers_device\n'
+                       '9 0 0 SEARCH testers_tester_devices USING AUTOMATIC COVERING INDEX (tester_id=?)',
+                       {'testers_bug', 'testers_tester_devices'}),
+        }
+        plan, expected = plans[connection.vendor]
+        self.assertEqual(sequential_scans(plan), expected)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Tables are partitioned only on PostgreSQL')
+class PartitioningTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # Tables are partitioned while empty, pending deferred foreign key checks would block the DDL. The test
+        # database may already be partitioned by the migration with other settings.
+        with connection.schema_editor() as schema_editor:
+            unpartition_tables(schema_editor)
+            partition_tables(schema_editor, 'device_id', 4)
+        call_command('populate_db', stdout=StringIO())
+
+    def test_partitioned_tables(self):
+        for model in PARTITIONED_MODELS:
+            self.assertEqual(partition_key(connection, model), 'device_id')
+        self.assertEqual(experience_mismatches(), {})
+
+        bug = Bug.objects.filter(tester__devices=F('device')).first()
+        new_bug = Bug.objects.create(tester_id=bug.tester_id, device_id=bug.device_id)
+        self.assertEqual(Bug.objects.filter(id=new_bug.id).count(), 1)
+        self.assertEqual(experience_mismatches(), {})
+        self.assertEqual(day_experience_mismatches(), {})
+
+    def test_match(self):
+        devices = list(Device.objects.values_list('id', flat=True)[:3])
+        owned = set(Tester.devices.through.objects.values_list('tester_id', 'device_id'))
+        expected = Counter(t for t, d in Bug.objects.filter(device__in=devices).values_list('tester_id', 'device_id')
+                           if (t, d) in owned)
+        ranking = {tester_id: experience for experience, _, _, _, tester_id in tester_query(devices)}
+        self.assertEqual(ranking, {t: expected[t] for t in Tester.objects.values_list('id', flat=True)})
+
+    def test_partition_pruning(self):
+        device = Device.objects.first().id
+        for query_set, table in ((tester_query([device]), TesterDeviceExperience._meta.db_table),
+                                 (tester_query([device], since=timezone.now().date()),
+                                  TesterDeviceDayExperience._meta.db_table)):
+            plan = explain(query_set)
+            self.assertEqual(len(set(re.findall(table + r'_p\d+', plan))), 1, plan)
+
+    def test_incremental(self):
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        changed = PopulateDbTest.write_changed_data(data_dir.name)
+
+        out = StringIO()
+        call_command('populate_db', '--incremental', '--data-dir', data_dir.name, stdout=out)
+        self.assertIn('bugs: 1 inserted, 1 updated, {} deleted'.format(changed['deleted_bugs']), out.getvalue())
+        self.assertEqual(Bug.objects.values('id').distinct().count(), Bug.objects.count())
+        self.assertEqual(experience_mismatches(), {})
+        self.assertEqual(day_experience_mismatches(), {})
+
+
+class BenchmarkTest(TestCase):
+
+    def test_generate_dataset(self):
+        generate_dataset(testers=50, devices=20, bugs=500, ownership_density=0.5, country_skew=2, seed=1,
+                         batch_size=64)
+        self.assertEqual(Tester.objects.count(), 50)
+        self.assertEqual(Device.objects.count(), 20)
+        self.assertEqual(Bug.objects.count(), 500)
+        self.assertAlmostEqual(Tester.devices.through.objects.count() / (50 * 20), 0.5, delta=0.1)
+        self.assertEqual(experience_mismatches(), {})
+
+        # With a skew testers from the first country are the most common
+        countries = Tester.objects.values('country').annotate(n=Count('id')).order_by('-n')
+        self.assertEqual(countries[0]['country'], SUPPORTED_COUNTRIES[0][0])
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual([percentile(values, p) for p in (50, 95, 99, 100)], [50, 95, 99, 100])
+        self.assertEqual(percentile([3.0], 99), 3.0)
+
+    def test_command(self):
+        output = tempfile.NamedTemporaryFile(suffix='.json')
+        self.addCleanup(output.close)
+        call_command('benchmark_matching', '--testers', '20', '--devices', '10', '--bugs', '200', '--requests', '3',
+                     '--output', output.name, stdout=StringIO())
+
+        with open(output.name) as f:
+            report = json.load(f)
+        self.assertEqual(report['dataset']['bugs'], 200)
+        self.assertEqual(len(report['results']), 12)
+        for result in report['results']:
+            self.assertEqual(result['requests'], 3)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['queries_per_request'], 0)
+            self.assertGreater(result['peak_memory_bytes'], 0)
+
+        with self.assertRaises(CommandError):
+            call_command('benchmark_matching', '--bugs', '10', stdout=StringIO())
+
+    def test_command_workers(self):
+        output = tempfile.NamedTemporaryFile(suffix='.json')
+        self.addCleanup(output.close)
+        call_command('benchmark_matching', '--testers', '20', '--devices', '10', '--bugs', '200', '--requests', '2',
+                     '--engine', 'memory', '--workers', '1', '2', '--output', output.name, stdout=StringIO())
+
+        with open(output.name) as f:
+            results = json.load(f)['results']
+        self.assertEqual([r['workers'] for r in results], [1] * 12 + [2] * 12)
+
+
+class LoadTestCommandTest(LiveServerTestCase):
+
+    def test_command(self):
+        generate_dataset(testers=20, devices=5, bugs=100)
+        output = tempfile.NamedTemporaryFile(suffix='.json')
+        self.addCleanup(output.close)
+        call_command('load_test', 'live={}/match-testers/'.format(self.live_server_url),
+                     'missing={}/missing/'.format(self.live_server_url), '--concurrency', '1', '2',
+                     '--requests', '4', '--workers', '2', '--output', output.name, stdout=StringIO())
+
+        with open(output.name) as f:
+            live, missing = json.load(f)['deployments']
+        self.assertEqual([level['concurrency'] for level in live['levels']], [1, 2])
+        self.assertEqual(live['sustained_concurrency'], 2)
+        self.assertEqual(live['sustained_concurrency_per_worker'], 1)
+        self.assertGreater(live['max_requests_per_s_per_worker'], 0)
+        self.assertEqual(missing['levels'][0]['errors'], 4)
+        self.assertEqual(missing['sustained_concurrency'], 0)
+
+        with self.assertRaises(CommandError):
+            call_command('load_test', 'http://127.0.0.1/', stdout=StringIO())
+
+
 class MatchTestersTest(APITestCase):
 
     def setUp(self):
         self.url = 'http://testserver/match-testers/'
+        caches[settings.MATCH_CACHE_ALIAS].clear()
 
     @classmethod
     def setUpTestData(cls):
@@ -179,3 +702,1164 @@ class MatchTestersTest(APITestCase):
         devices = [self.device_android.id, self.device_nokia.id, 500]
         response = self.client.get(self.url, {'devices': devices})
         self.assertEqual(response.status_code, 400)
+
+    def test_malformed_device(self):
+        for devices in ('²', '1,²', '-1', '+1', ' 1', '1_0', '0', str(2 ** 63), '9' * 5000):
+            with self.subTest(devices=devices):
+                response = self.client.get(self.url, {'devices': devices})
+                self.assertEqual(response.status_code, 400)
+
+    def test_pages(self):
+        expected = json.loads(self.client.get(self.url).content)
+        testers = []
+        url, pages = self.url + '?limit=4', 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = json.loads(response.content)
+            self.assertLessEqual(len(page), 4)
+            testers += page
+            pages += 1
+            url = response.get('Link', '')[1:].partition('>')[0]
+        self.assertEqual(testers, expected)
+        self.assertEqual(pages, 2)
+
+    def test_pages_with_filters(self):
+        query = {'devices': [self.device_android.id, self.device_iphone.id], 'countries': ['US']}
+        expected = json.loads(self.client.get(self.url, query).content)
+
+        response = self.client.get(self.url, dict(query, limit=2))
+        self.assertEqual(json.loads(response.content), expected[:2])
+        self.assertIn('rel="next"', response['Link'])
+
+        next_url = response['Link'][1:].partition('>')[0]
+        response = self.client.get(next_url)
+        self.assertEqual(json.loads(response.content), expected[2:])
+        self.assertFalse(response.has_header('Link'))
+
+    def test_stream_ndjson(self):
+        expected = json.loads(self.client.get(self.url).content)
+        response = self.client.get(self.url, {'stream': 'ndjson'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+    def test_stream_json(self):
+        expected = self.client.get(self.url, {'countries': ['US']}).content
+        response = self.client.get(self.url, {'countries': ['US'], 'stream': 'json'})
+        self.assertEqual(b''.join(response.streaming_content), expected)
+
+        response = self.client.get(self.url, {'countries': ['GB'], 'devices': [self.device_nokia.id],
+                                              'stream': 'json', 'limit': 1})
+        self.assertEqual(json.loads(b''.join(response.streaming_content)),
+                         [{'experience': 0, 'first_name': 'Bob', 'last_name': 'Blue', 'country': 'GB'}])
+
+    @override_settings(MATCH_STREAM_CHUNK_SIZE=2)
+    def test_stream_pages(self):
+        # Streams are read in keyset pages of MATCH_STREAM_CHUNK_SIZE testers
+        expected = json.loads(self.client.get(self.url).content)
+        for limit in (None, 3, 4, 100):
+            with self.subTest(limit=limit):
+                query = dict({'stream': 'json'}, **({'limit': limit} if limit else {}))
+                response = self.client.get(self.url, query)
+                self.assertEqual(json.loads(b''.join(response.streaming_content)), expected[:limit])
+
+    def test_invalid_pagination(self):
+        huge = '9' * 23
+        for query in ({'limit': 0}, {'limit': 'ten'}, {'cursor': 'abc'}, {'stream': 'xml'},
+                      {'limit': settings.MATCH_MAX_LIMIT + 1}, {'limit': huge}, {'limit': huge, 'stream': 'json'},
+                      {'limit': huge, 'since': '2020-01-01'}, {'limit': '1' * 5000}, {'limit': ' 1'},
+                      {'cursor': encode_cursor((10 ** 30, 'a', 'b', 'US', 1))},
+                      {'cursor': encode_cursor((1, 'a', 'b', 'US', -10 ** 30))}):
+            with self.subTest(query=query):
+                response = self.client.get(self.url, query)
+                self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(self.url, {'limit': settings.MATCH_MAX_LIMIT})
+        self.assertEqual(response.status_code, 200)
+
+    def test_batch(self):
+        queries = [{}, {'countries': ['US', 'GB']}, {'devices': [self.device_android.id, self.device_iphone.id]},
+                   {'devices': [self.device_android.id, self.device_nokia.id], 'countries': ['US', 'JP']},
+                   {'devices': [self.device_nokia.id], 'countries': ['GB'], 'limit': 1}]
+        expected = [json.loads(self.client.get(self.url, query).content) for query in queries]
+
+        response = self.client.post(self.url + 'batch/', {'queries': queries}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), expected)
+
+    def test_batch_query_count(self):
+        # Number of queries doesn't depend on the number of combinations in the batch
+        queries = [{'devices': [self.device_android.id]}, {'countries': ['JP']}]
+        self.client.post(self.url + 'batch/', {'queries': queries}, format='json')
+        with CaptureQueriesContext(connection) as single:
+            self.client.post(self.url + 'batch/', {'queries': queries}, format='json')
+        with self.assertNumQueries(len(single)):
+            self.client.post(self.url + 'batch/', {'queries': queries * 50}, format='json')
+        self.assertLessEqual(len(single), 3)
+
+    def test_invalid_batch(self):
+        for queries in ([], [{'countries': ['GG']}], [{'devices': [self.device_nokia.id, 500]}],
+                        [{'limit': 0}], [{'limit': 10 ** 30}], [{}] * (settings.MATCH_BATCH_MAX_QUERIES + 1)):
+            response = self.client.post(self.url + 'batch/', {'queries': queries}, format='json')
+            self.assertEqual(response.status_code, 400)
+
+
+@override_settings(MATCHING_ENGINE='memory', DATA_VERSION_CHECK_INTERVAL=0)
+class MemoryEngineMatchTestersTest(MatchTestersTest):
+
+    def test_same_ordering_as_database(self):
+        # Testers with equal experience and names must keep the database tiebreak
+        for first_name in ('Amy', 'amy', 'Zoe', 'Amy'):
+            tester = Tester.objects.create(first_name=first_name, last_name='Smith', country='GB',
+                                           last_login=timezone.now())
+            tester.devices.add(self.device_nokia)
+            Bug.objects.create(tester=tester, device=self.device_nokia)
+
+        params = [{}, {'countries': ['GB']}, {'devices': [self.device_nokia.id]},
+                  {'devices': [self.device_iphone.id, self.device_nokia.id], 'countries': ['US', 'GB']}]
+        for query in params:
+            memory_response = self.client.get(self.url, query)
+            with self.settings(MATCHING_ENGINE='database'):
+                database_response = self.client.get(self.url, query)
+            self.assertEqual(json.loads(memory_response.content), json.loads(database_response.content))
+
+    def test_rows_added_while_loading(self):
+        # A tester and device added between the reads of the index are left for the next data version
+        added = []
+
+        def add_after_devices_read(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if not added and 'testers_device' in sql and 'testers_tester' not in sql:
+                added.append(True)
+                tester = Tester.objects.create(first_name='New', last_name='Tester', country='GB',
+                                               last_login=timezone.now())
+                device = Device.objects.create(description='New device')
+                tester.devices.add(device, self.device_nokia)
+                Bug.objects.create(tester=tester, device=device)
+                Bug.objects.create(tester=tester, device=self.device_nokia)
+            return result
+
+        with connection.execute_wrapper(add_after_devices_read):
+            index = MatchIndex.from_database('1.test')
+        self.assertTrue(added)
+        self.assertNotIn('Tester', index.last_names)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_cursor_of_changed_tester(self):
+        # A tester renamed after the cursor was issued is placed by the database, the same as the ORM query
+        for first_name in ('Amy', 'amy', 'Zoe', 'Bea'):
+            tester = Tester.objects.create(first_name=first_name, last_name='Smith', country='GB',
+                                           last_login=timezone.now())
+            tester.devices.add(self.device_nokia)
+            Bug.objects.create(tester=tester, device=self.device_nokia)
+
+        response = self.client.get(self.url, {'devices': [self.device_nokia.id], 'limit': 3})
+        next_page = response['Link'][1:].partition('>')[0]
+        last = json.loads(response.content)[-1]
+        tester = Tester.objects.get(first_name=last['first_name'], last_name=last['last_name'])
+        tester.first_name = 'Ann'
+        tester.save()
+
+        memory_response = self.client.get(next_page)
+        with self.settings(MATCHING_ENGINE='database'):
+            database_response = self.client.get(next_page)
+        self.assertEqual(json.loads(memory_response.content), json.loads(database_response.content))
+
+    def test_refreshes_after_change(self):
+        response = self.client.get(self.url, {'countries': ['JP']})
+        self.assertEqual(json.loads(response.content)[0]['experience'], 5)
+
+        Bug.objects.create(tester=self.tester_micheal, device=self.device_iphone)
+        response = self.client.get(self.url, {'countries': ['JP']})
+        self.assertEqual(json.loads(response.content)[0]['experience'], 6)
+
+
+@override_settings(MATCHING_WORKERS=2)
+class ParallelMatchTestersTest(MemoryEngineMatchTestersTest):
+
+    def test_same_ranking_as_single_process(self):
+        rng = random.Random(0)
+        counts = np.array([[rng.randrange(5) for _ in range(6)] for _ in range(50)], dtype=np.uint32)
+        owned = np.array([[rng.random() < 0.5 for _ in range(6)] for _ in range(50)], dtype=np.bool_)
+        index = MatchIndex('1.test', tester_ids=list(range(1, 51)), first_names=['First'] * 50,
+                           last_names=['Last'] * 50, countries=[rng.choice('GB US JP'.split()) for _ in range(50)],
+                           device_ids=list(range(1, 7)), counts=counts, owned=owned)
+
+        for devices, countries in ((None, None), ([1], None), ([2, 3, 5], ['US']), ([9], ['GB', 'JP'])):
+            with self.settings(MATCHING_WORKERS=1):
+                expected = index.rank(devices, countries)
+            for workers in (2, 3, 7):
+                with self.settings(MATCHING_WORKERS=workers):
+                    self.assertEqual(index.rank(devices, countries), expected)
+
+
+@override_settings(MATCHING_ENGINE='mmap', DATA_VERSION_CHECK_INTERVAL=0)
+class MmapEngineMatchTestersTest(MatchTestersTest):
+
+    def setUp(self):
+        super().setUp()
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        data_file = self.settings(MATCH_DATA_FILE=os.path.join(data_dir.name, 'match.data'))
+        data_file.enable()
+        self.addCleanup(data_file.disable)
+        self.export()
+
+    @staticmethod
+    def export():
+        call_command('export_match_data', settings.MATCH_DATA_FILE, stdout=StringIO())
+
+    def test_no_database_queries(self):
+        testers = Tester.objects.count()
+        with self.assertNumQueries(0):
+            for query in ({}, {'countries': ['US']}, {'devices': [self.device_nokia.id], 'limit': 1}):
+                self.assertEqual(self.client.get(self.url, query).status_code, 200)
+            next_page = self.client.get(self.url, {'limit': 2})['Link'][1:-len('>; rel="next"')]
+            self.assertEqual(self.client.get(next_page).status_code, 200)
+            response = self.client.get(self.url, {'devices': [self.device_iphone.id], 'stream': 'ndjson'})
+            self.assertEqual(len(b''.join(response.streaming_content).splitlines()), testers)
+            response = self.client.post(self.url + 'batch/', {'queries': [{'countries': ['JP']}]}, format='json')
+            self.assertEqual(response.status_code, 200)
+
+    def test_same_ranking_as_database(self):
+        params = [{}, {'countries': ['GB']}, {'devices': [self.device_nokia.id]},
+                  {'devices': [self.device_iphone.id, self.device_nokia.id], 'countries': ['US', 'GB']}]
+        for query in params:
+            mmap_response = self.client.get(self.url, query)
+            with self.settings(MATCHING_ENGINE='database'):
+                database_response = self.client.get(self.url, query)
+            self.assertEqual(json.loads(mmap_response.content), json.loads(database_response.content))
+
+    def test_time_window_not_supported(self):
+        response = self.client.get(self.url, {'since': '2020-01-01'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('not supported', json.loads(response.content))
+
+    def test_replaced_file(self):
+        Bug.objects.create(tester=self.tester_micheal, device=self.device_iphone)
+        response = self.client.get(self.url, {'countries': ['JP']})
+        self.assertEqual(json.loads(response.content)[0]['experience'], 5)
+
+        self.export()
+        response = self.client.get(self.url, {'countries': ['JP']})
+        self.assertEqual(json.loads(response.content)[0]['experience'], 6)
+
+
+class MatchDataFileTest(TestCase):
+
+    def setUp(self):
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        self.path = os.path.join(data_dir.name, 'match.data')
+
+    def test_round_trip(self):
+        counts = np.array([[1, 0, 7], [0, 2, 3]], dtype=np.uint32)
+        owned = np.array([[True, False, True], [False, True, False]])
+        index = MatchIndex('3.abc', tester_ids=[5, 9], first_names=['Zoë', ''], last_names=['Łukasz', 'Smith'],
+                           countries=['GB', 'XX'], device_ids=[1, 2, 4], counts=counts, owned=owned)
+        write_data_file(index, self.path)
+
+        loaded = read_data_file(self.path)
+        self.assertEqual(loaded.version, '3.abc')
+        self.assertEqual(loaded.device_ids, [1, 2, 4])
+        self.assertEqual(list(loaded.country_codes), [0, 3])
+        np.testing.assert_array_equal(loaded.counts, counts)
+        np.testing.assert_array_equal(loaded.owned, owned)
+        self.assertEqual(loaded.match(), index.match())
+        self.assertEqual(loaded.match([4], ['GB']), [(7, 'Zoë', 'Łukasz', 'GB', 5)])
+        self.assertEqual(loaded.match(after=(8, 'Łukasz', 'Zoë', 5)), [(2, '', 'Smith', 'XX', 9)])
+
+        # Arrays are read-only views of the mapped file
+        self.assertFalse(loaded.counts.flags.owndata)
+        self.assertFalse(loaded.counts.flags.writeable)
+
+    def test_invalid_file(self):
+        for content in (b'', b'not a match data file'):
+            with open(self.path, 'wb') as f:
+                f.write(content)
+            with self.assertRaises(InvalidDataFile):
+                read_data_file(self.path)
+
+    def test_command(self):
+        Tester.objects.create(first_name='Ann', last_name='Lee', country='JP', last_login=timezone.now())
+        out = StringIO()
+        call_command('export_match_data', self.path, stdout=out)
+        self.assertIn('Exported 1 testers and 0 devices', out.getvalue())
+        self.assertEqual(read_data_file(self.path).match(), [(0, 'Ann', 'Lee', 'JP', Tester.objects.get().id)])
+
+
+class MatchTestersCacheTest(APITestCase):
+
+    def setUp(self):
+        self.url = 'http://testserver/match-testers/'
+        self.stats_url = 'http://testserver/match-testers/cache-stats/'
+        caches[settings.MATCH_CACHE_ALIAS].clear()
+
+        self.device_iphone = Device.objects.create(description='IPhone')
+        self.device_nokia = Device.objects.create(description='Nokia')
+        self.tester = Tester.objects.create(first_name='John', last_name='Smith', country='GB',
+                                            last_login=timezone.now())
+        self.tester.devices.add(self.device_iphone, self.device_nokia)
+        Bug.objects.create(tester=self.tester, device=self.device_iphone)
+
+    def get_stats(self):
+        return json.loads(self.client.get(self.stats_url).content)
+
+    def test_hits_and_misses(self):
+        first = self.client.get(self.url, {'devices': [self.device_iphone.id, self.device_nokia.id],
+                                           'countries': ['US', 'GB']})
+        second = self.client.get(self.url, {'devices': '{},{}'.format(self.device_nokia.id, self.device_iphone.id),
+                                            'countries': ['GB', 'US']})
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual(self.get_stats(), {'hits': 1, 'misses': 1})
+
+        self.client.get(self.url, {'countries': ['GB']})
+        self.assertEqual(self.get_stats(), {'hits': 1, 'misses': 2})
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_invalidated_by_changes(self):
+        changes = (lambda: Bug.objects.create(tester=self.tester, device=self.device_nokia),
+                   lambda: self.tester.devices.remove(self.device_iphone),
+                   lambda: Tester.objects.filter(pk=self.tester.pk).first().save(),
+                   lambda: Device.objects.create(description='Android'))
+
+        response = self.client.get(self.url)
+        for change in changes:
+            change()
+            new_response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(new_response.status_code, 200)
+            self.assertNotEqual(new_response['ETag'], response['ETag'])
+            response = new_response
+
+        self.assertEqual(json.loads(response.content)[0]['experience'], 1)
+        self.assertEqual(self.get_stats(), {'hits': 0, 'misses': 5})
+
+
+class FileBasedMatchTestersCacheTest(MatchTestersCacheTest):
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache_settings = dict(settings.CACHES)
+        cache_settings[settings.MATCH_CACHE_ALIAS] = {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': cache_dir.name,
+        }
+        caches_override = self.settings(CACHES=cache_settings)
+        caches_override.enable()
+        self.addCleanup(caches_override.disable)
+        super().setUp()
+
+
+class MetricsTest(APITestCase):
+
+    def setUp(self):
+        for histogram in HISTOGRAMS:
+            histogram.clear()
+        caches[settings.MATCH_CACHE_ALIAS].clear()
+
+        device = Device.objects.create(description='IPhone')
+        tester = Tester.objects.create(first_name='John', last_name='Smith', country='GB', last_login=timezone.now())
+        tester.devices.add(device)
+        Bug.objects.create(tester=tester, device=device)
+        self.device = device
+
+    def test_server_timing(self):
+        response = self.client.get('/match-testers/', {'devices': [self.device.id]})
+        phases = {p.strip().split(';')[0]: p.strip() for p in response['Server-Timing'].split(',')}
+        self.assertEqual(set(phases), {'total', 'db', 'validation', 'serialization'})
+        self.assertRegex(phases['db'], r'db;dur=[0-9.]+;desc="[1-9][0-9]* queries"')
+
+    def test_metrics_endpoint(self):
+        self.client.get('/match-testers/')
+        self.client.get('/match-testers/')
+        self.client.get('/devices/')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        content = response.content.decode('utf-8')
+        self.assertIn('testermatch_request_duration_seconds_count{view="match_testers"} 2', content)
+        self.assertIn('testermatch_request_duration_seconds_count{view="device_list"} 1', content)
+        self.assertIn('testermatch_db_queries_bucket{view="device_list",le="+Inf"} 1', content)
+        self.assertIn('# TYPE testermatch_response_bytes histogram', content)
+        self.assertIn('testermatch_match_cache_requests_total{result="hit"} 1', content)
+
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', 'Test', (0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe('view', value)
+        self.assertEqual(histogram.render()[2:], [
+            'test_seconds_bucket{view="view",le="0.1"} 2',
+            'test_seconds_bucket{view="view",le="1"} 3',
+            'test_seconds_bucket{view="view",le="+Inf"} 4',
+            'test_seconds_sum{view="view"} 2.65',
+            'test_seconds_count{view="view"} 4',
+        ])
+
+
+class FastSerializationTest(APITestCase):
+    names = ('Smith', 'O\'Brien "Bob"', 'Zoë', '日本', 'back\\slash', 'tab\tnew\nline', 'ctrl\x01',
+             'line\u2028para\u2029', '')
+
+    def test_render_testers(self):
+        rows = [(i * 3, name, name[::-1], 'US', i) for i, name in enumerate(self.names)]
+        expected = JSONRenderer().render(
+            TesterSerializer([dict(zip(TESTER_FIELDS, row)) for row in rows], many=True).data)
+        self.assertEqual(render_testers(rows), expected)
+        self.assertEqual(render_testers([]), JSONRenderer().render(TesterSerializer([], many=True).data))
+        self.assertEqual(render_tester(rows[1]), JSONRenderer().render(TesterSerializer(
+            dict(zip(TESTER_FIELDS, rows[1]))).data))
+
+    def test_render_devices(self):
+        devices = [Device.objects.create(description=name) for name in self.names]
+        expected = JSONRenderer().render(DeviceSerializer(devices, many=True).data)
+        self.assertEqual(render_devices((d.description, d.id) for d in devices), expected)
+
+        response = self.client.get('/devices/')
+        self.assertEqual(response.content, expected)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_match_testers_response(self):
+        device = Device.objects.create(description='IPhone')
+        for name in self.names:
+            tester = Tester.objects.create(first_name=name, last_name=name, country='JP', last_login=timezone.now())
+            tester.devices.add(device)
+
+        response = self.client.get('/match-testers/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        testers = Tester.objects.order_by('last_name', 'first_name', 'id')
+        expected = JSONRenderer().render(TesterSerializer(
+            [dict(experience=0, first_name=t.first_name, last_name=t.last_name, country=t.country) for t in testers],
+            many=True).data)
+        self.assertEqual(response.content, expected)
+
+    def test_browsable_api(self):
+        for url in ('/match-testers/', '/devices/'):
+            response = self.client.get(url, HTTP_ACCEPT='text/html')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['Content-Type'].startswith('text/html'))
+
+
+# Async views are routed only with ASYNC_VIEWS set, AsyncViewsTest serves them next to the sync ones
+urlpatterns = [
+    path('match-testers/', match_testers_async, name='match_testers'),
+    path('devices/', device_list_async, name='device_list'),
+    path('sync/', include('testers.urls')),
+]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.device_iphone = Device.objects.create(description='IPhone')
+        cls.device_nokia = Device.objects.create(description='Nokia')
+        for i, (country, bugs) in enumerate((('GB', 2), ('US', 5), ('US', 1), ('JP', 3))):
+            tester = Tester.objects.create(first_name='First {}'.format(i), last_name='Last {}'.format(i),
+                                           country=country, last_login=timezone.now())
+            tester.devices.add(cls.device_iphone if i % 2 else cls.device_nokia)
+            for _ in range(bugs):
+                Bug.objects.create(tester=tester, device=cls.device_iphone if i % 2 else cls.device_nokia)
+
+    def setUp(self):
+        caches[settings.MATCH_CACHE_ALIAS].clear()
+
+    async def test_approx_mode(self):
+        query = {'mode': 'approx', 'devices': self.device_iphone.id, 'limit': 1}
+        response = await self.async_client.get('/match-testers/', query)
+        expected = await sync_to_async(self.client.get)('/sync/match-testers/', query)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Experience-Error-Bound'], expected['Experience-Error-Bound'])
+        self.assertEqual(json.loads(response.content), json.loads(expected.content))
+        self.assertEqual(len(json.loads(response.content)), 1)
+
+    async def test_same_as_sync_view(self):
+        queries = [{}, {'countries': ['US', 'JP']}, {'devices': [self.device_iphone.id]},
+                   {'devices': '{},{}'.format(self.device_iphone.id, self.device_nokia.id), 'countries': 'US,GB'},
+                   {'limit': 2}]
+        for query in queries:
+            await sync_to_async(caches[settings.MATCH_CACHE_ALIAS].clear)()
+            response = await self.async_client.get('/match-testers/', query)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/json')
+
+            await sync_to_async(caches[settings.MATCH_CACHE_ALIAS].clear)()
+            expected = await sync_to_async(self.client.get)('/sync/match-testers/', query)
+            self.assertEqual(response.content, expected.content)
+            self.assertEqual(response['ETag'], expected['ETag'])
+
+    async def test_pages(self):
+        expected = json.loads((await self.async_client.get('/match-testers/')).content)
+        response = await self.async_client.get('/match-testers/', {'limit': 3})
+        self.assertEqual(json.loads(response.content), expected[:3])
+
+        response = await self.async_client.get(response['Link'][1:].partition('>')[0])
+        self.assertEqual(json.loads(response.content), expected[3:])
+        self.assertFalse(response.has_header('Link'))
+
+    async def test_not_modified(self):
+        response = await self.async_client.get('/match-testers/')
+        response = await self.async_client.get('/match-testers/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_stream(self):
+        expected = json.loads((await self.async_client.get('/match-testers/', {'countries': ['US']})).content)
+
+        response = await self.async_client.get('/match-testers/', {'countries': ['US'], 'stream': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual([json.loads(line) for line in content.decode('utf-8').splitlines()], expected)
+
+        response = await self.async_client.get('/match-testers/', {'stream': 'json', 'limit': 1})
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(json.loads(content)), 1)
+
+    async def test_invalid_parameters(self):
+        for query in ({'countries': ['US', 'GG']}, {'devices': [self.device_iphone.id, 500]}, {'devices': 'abc'},
+                      {'limit': 0}, {'cursor': 'abc'}, {'stream': 'xml'}):
+            response = await self.async_client.get('/match-testers/', query)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('has invalid value', json.loads(response.content))
+
+        response = await self.async_client.post('/match-testers/')
+        self.assertEqual(response.status_code, 405)
+
+    async def test_devices(self):
+        response = await self.async_client.get('/devices/')
+        expected = await sync_to_async(self.client.get)('/sync/devices/')
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response['ETag'], expected['ETag'])
+
+        response = await self.async_client.get('/devices/', headers={'If-None-Match': expected['ETag']})
+        self.assertEqual(response.status_code, 304)
+        response = await self.async_client.get('/devices/', {'ids': self.device_nokia.id})
+        self.assertEqual(json.loads(response.content), [{'description': 'Nokia', 'id': self.device_nokia.id}])
+
+    async def test_server_timing(self):
+        response = await self.async_client.get('/match-testers/', {'devices': [self.device_nokia.id]})
+        self.assertRegex(response['Server-Timing'], r'db;dur=[0-9.]+;desc="[1-9][0-9]* queries"')
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRouterTest(TestCase):
+
+    def setUp(self):
+        caches[settings.MATCH_CACHE_ALIAS].clear()
+
+    def test_read_only_view(self):
+        view = read_from_replica(lambda: (Tester.objects.all().db, router.db_for_write(Tester)))
+        read_db, write_db = view()
+        self.assertIn(read_db, settings.DATABASE_REPLICAS)
+        self.assertEqual(write_db, 'default')
+        self.assertEqual(Tester.objects.all().db, 'default')
+
+        with self.settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(view()[0], 'default')
+
+    async def test_async_view(self):
+        @read_from_replica
+        async def view():
+            return await sync_to_async(lambda: Device.objects.all().db)()
+
+        self.assertIn(await view(), settings.DATABASE_REPLICAS)
+
+    @mock.patch('testers.routers._choose_replica', return_value='missing')
+    @mock.patch.dict('testers.catalogue._catalogue', catalogue=None)
+    def test_endpoints_read_from_replica(self, _):
+        # Reads of the endpoints go to the replica alias, which doesn't exist here
+        for url in ('/match-testers/', '/devices/'):
+            with self.assertRaises(ConnectionDoesNotExist):
+                self.client.get(url)
+
+        # Streamed testers are read after the view returns
+        with self.assertRaises(ConnectionDoesNotExist):
+            b''.join(self.client.get('/match-testers/', {'stream': 'ndjson'}).streaming_content)
+
+
+@override_settings(DATA_VERSION_CHECK_INTERVAL=60)
+class DeviceLookupTest(APITestCase):
+
+    def setUp(self):
+        caches[settings.MATCH_CACHE_ALIAS].clear()
+        self.device = Device.objects.create(description='IPhone')
+
+    def test_device_ids_follow_changes(self):
+        self.assertIn(self.device.id, device_ids())
+        with self.assertNumQueries(0):
+            device_ids()
+
+        other = Device.objects.create(description='Nokia')
+        self.assertIn(other.id, device_ids())
+        self.device.delete()
+        self.assertNotIn(self.device.id, device_ids())
+
+    def test_device_ids_kept_on_other_changes(self):
+        device_ids()
+        tester = Tester.objects.create(first_name='John', last_name='Smith', country='GB', last_login=timezone.now())
+        tester.devices.add(self.device)
+        Bug.objects.create(tester=tester, device=self.device)
+        with self.assertNumQueries(0):
+            device_ids()
+
+    def test_validation_without_queries(self):
+        # Only the matching query runs, a repeated request is served from the response cache
+        device_ids()
+        query = {'devices': [self.device.id], 'countries': 'US,GB'}
+        with self.assertNumQueries(1):
+            self.client.get('/match-testers/', query)
+        with self.assertNumQueries(0):
+            response = self.client.get('/match-testers/', query)
+        self.assertEqual(response.status_code, 200)
+
+    def test_repeated_devices(self):
+        tester = Tester.objects.create(first_name='John', last_name='Smith', country='GB', last_login=timezone.now())
+        tester.devices.add(self.device)
+        Bug.objects.create(tester=tester, device=self.device)
+
+        expected = self.client.get('/match-testers/', {'devices': [self.device.id]}).content
+        for devices in ([self.device.id, self.device.id], '{0},{0}'.format(self.device.id)):
+            response = self.client.get('/match-testers/', {'devices': devices, 'countries': 'GB,GB'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, expected)
+
+    def test_malformed_devices(self):
+        for devices in ('abc', '1.5', '-1', '', '{},x'.format(self.device.id)):
+            with self.assertNumQueries(0):
+                response = self.client.get('/match-testers/', {'devices': devices})
+            self.assertEqual(response.status_code, 400)
+
+
+@override_settings(DATA_VERSION_CHECK_INTERVAL=60)
+class DeviceListTest(APITestCase):
+
+    def setUp(self):
+        self.devices = [Device.objects.create(description='Device {}'.format(i)) for i in range(5)]
+
+    def test_not_modified(self):
+        response = self.client.get('/devices/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([d['id'] for d in json.loads(response.content)], [d.id for d in self.devices])
+        self.assertRegex(response['ETag'], r'^"[0-9a-f]{40}"$')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+        # Polls are answered from the cached list without queries
+        with self.assertNumQueries(0):
+            not_modified = self.client.get('/devices/', HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(not_modified['ETag'], response['ETag'])
+            not_modified = self.client.get('/devices/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(not_modified.status_code, 304)
+
+        Device.objects.create(description='New')
+        changed = self.client.get('/devices/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(json.loads(changed.content)[-1]['description'], 'New')
+
+        # ETag is a hash of the content, bugs and testers don't change it
+        Tester.objects.create(first_name='John', last_name='Smith', country='GB', last_login=timezone.now())
+        self.assertEqual(self.client.get('/devices/')['ETag'], changed['ETag'])
+
+    def test_compressed(self):
+        response = self.client.get('/devices/')
+        compressed = self.client.get('/devices/', HTTP_ACCEPT_ENCODING='deflate, gzip;q=0.8')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+        self.assertEqual(gzip.decompress(compressed.content), response.content)
+        self.assertNotEqual(compressed['ETag'], response['ETag'])
+        self.assertEqual(self.client.get('/devices/', HTTP_ACCEPT_ENCODING='gzip').content, compressed.content)
+
+        # Codings with q=0 are refused, also when a wildcard accepts the others
+        for accepted in ('gzip;q=0', 'gzip; q=0.0, deflate', 'br;q=0, gzip;Q=0, *;q=0.5', '*;q=0'):
+            with self.subTest(accepted=accepted):
+                refused = self.client.get('/devices/', HTTP_ACCEPT_ENCODING=accepted)
+                self.assertFalse(refused.has_header('Content-Encoding'))
+                self.assertEqual(refused.content, response.content)
+        self.assertEqual(self.client.get('/devices/', HTTP_ACCEPT_ENCODING='br;q=0, *;q=0.1')['Content-Encoding'],
+                         'gzip')
+
+    def test_ids(self):
+        ids = [self.devices[3].id, self.devices[1].id, 999]
+        for query in ({'ids': ids}, {'ids': ','.join(map(str, ids))}):
+            response = self.client.get('/devices/', query)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content), [{'description': 'Device 1', 'id': self.devices[1].id},
+                                                            {'description': 'Device 3', 'id': self.devices[3].id}])
+
+    def test_pages(self):
+        pages, url = [], '/devices/?limit=2'
+        while url:
+            response = self.client.get(url)
+            pages.append([d['id'] for d in json.loads(response.content)])
+            url = response['Link'][1:-len('>; rel="next"')] if response.has_header('Link') else None
+        self.assertEqual(pages, [[d.id for d in self.devices[i:i + 2]] for i in (0, 2, 4)])
+
+        ids = [d.id for d in self.devices[1:4]]
+        response = self.client.get('/devices/', {'ids': ids, 'limit': 2})
+        next_page = self.client.get(response['Link'][1:-len('>; rel="next"')])
+        self.assertEqual([d['id'] for d in json.loads(next_page.content)], ids[2:])
+        self.assertNotEqual(next_page['ETag'], response['ETag'])
+
+    def test_invalid_parameters(self):
+        for query in ({'ids': 'abc'}, {'ids': '1,-2'}, {'ids': ''}, {'limit': 0}, {'cursor': 'abc'}, {'ids': '²'},
+                      {'ids': '1,²'}, {'ids': 2 ** 63}, {'limit': '²'}, {'limit': settings.DEVICE_LIST_MAX_LIMIT + 1},
+                      {'limit': '9' * 5000}):
+            with self.subTest(query=query):
+                response = self.client.get('/devices/', query)
+                self.assertEqual(response.status_code, 400)
+
+
+class QueryCountTest(APITestCase):
+    # Queries must not grow with the data, growing_statements reports the SQL of an N+1 regression. Sizes stay
+    # below one bulk insert batch on SQLite, the number of batches grows with the data by design.
+    sizes = (6, 18, 54)
+
+    def setUp(self):
+        caches[settings.MATCH_CACHE_ALIAS].clear()
+
+    def record(self, sizes, prepare, operation):
+        # The first run creates the data versions and ranking snapshots, it isn't recorded
+        prepare(sizes[0])
+        operation(sizes[0])
+        recordings = []
+        for size in sizes:
+            prepare(size)
+            with QueryRecorder() as recorder:
+                operation(size)
+            recordings.append(recorder)
+        self.assertEqual(growing_statements(recordings), '',
+                         'Queries grow with the data:\n' + growing_statements(recordings))
+        return recordings
+
+    def generate(self, size):
+        Device.objects.all().delete()
+        Tester.objects.all().delete()
+        generate_dataset(testers=size, devices=size // 2, bugs=size * 5, seed=size)
+        caches[settings.MATCH_CACHE_ALIAS].clear()
+
+    @staticmethod
+    def write_data(data_dir, size):
+        def write(name, header, rows):
+            with open(os.path.join(data_dir, name), 'w', newline='') as f:
+                csv.writer(f).writerows([header] + rows)
+
+        write('devices.csv', ['deviceId', 'description'], [[i, 'Device {}'.format(i)] for i in range(1, 6)])
+        write('testers.csv', ['testerId', 'firstName', 'lastName', 'country', 'lastLogin'],
+              [[i, 'First', 'Last {}'.format(i), 'US', '2013-08-04 23:57:38'] for i in range(1, size + 1)])
+        write('tester_device.csv', ['testerId', 'deviceId'], [[i, i % 5 + 1] for i in range(1, size + 1)])
+        # Every other bug is reported on the device owned by the tester
+        write('bugs.csv', ['bugId', 'deviceId', 'testerId'],
+              [[i, (i % size + 1 + i % 2) % 5 + 1, i % size + 1] for i in range(1, size * 3 + 1)])
+
+    def test_match_testers(self):
+        def get(query):
+            def operation(size):
+                response = self.client.get('/match-testers/', query)
+                self.assertEqual(response.status_code, 200)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            return operation
+
+        def prepare(size):
+            self.generate(size)
+            # Data and device versions are read together, device ids once, then the matching testers or one page
+            expected_rows.append(2 + size // 2 + min(testers.count(), fetched))
+
+        devices = [1, 2]
+        countries = ['US', 'GB']
+        # Paginated queries fetch one tester more than the limit
+        for query, testers, fetched in (({'devices': devices}, Tester.objects.all(), 100),
+                                        ({'devices': devices, 'countries': countries, 'limit': 5},
+                                         Tester.objects.filter(country__in=countries), 6),
+                                        ({'stream': 'ndjson'}, Tester.objects.all(), 100)):
+            with self.subTest(query=query):
+                expected_rows = []
+                recordings = self.record(self.sizes, prepare, get(query))
+                self.assertEqual([len(r) for r in recordings], [3] * len(self.sizes), recordings[0].report())
+                self.assertEqual([r.rows for r in recordings], expected_rows[1:])
+
+    def test_device_list(self):
+        def get(size):
+            self.assertEqual(len(json.loads(self.client.get('/devices/').content)), size // 2)
+
+        recordings = self.record(self.sizes, self.generate, get)
+        self.assertEqual([len(r) for r in recordings], [2] * len(self.sizes))
+        self.assertEqual([r.rows for r in recordings], [size // 2 + 2 for size in self.sizes])
+
+        # Later requests and pages are served from the catalogue
+        with self.assertNumQueries(0):
+            self.client.get('/devices/')
+            self.client.get('/devices/', {'limit': 2})
+
+    def test_populate_db(self):
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+
+        def populate(*options):
+            return lambda size: call_command('populate_db', '--data-dir', data_dir.name, *options, stdout=StringIO())
+
+        def new_data(size):
+            Device.objects.all().delete()
+            Tester.objects.all().delete()
+            self.write_data(data_dir.name, size)
+
+        def changed_data(size):
+            new_data(size)
+            populate()(size)
+            with open(os.path.join(data_dir.name, 'bugs.csv'), 'a', newline='') as f:
+                csv.writer(f).writerow([size * 3 + 1, 1, 1])
+
+        for options, prepare in (((), new_data), (('--fast',), new_data), (('--incremental',), changed_data)):
+            with self.subTest(options=options):
+                recordings = self.record(self.sizes, prepare, populate(*options))
+                self.assertLessEqual(len(recordings[-1]), 60, recordings[-1].report())
+
+    def test_recorder(self):
+        nokia = Device.objects.create(description='Nokia')
+        with QueryRecorder() as recorder:
+            list(Device.objects.filter(id__in=[nokia.id + 1, nokia.id + 2, nokia.id + 3]))
+            list(Device.objects.filter(id__in=[nokia.id + 4, nokia.id + 5]))
+            list(Device.objects.filter(description='Nokia'))
+        self.assertEqual(len(recorder), 3)
+        self.assertEqual(recorder.rows, 1)
+        self.assertEqual([q['rows'] for q in recorder.queries], [0, 0, 1])
+        self.assertEqual(list(recorder.statements().values()), [2, 1])
+        self.assertIn('2 x SELECT', recorder.report())
+
+        self.assertEqual(normalize_sql("SELECT 1 FROM t WHERE a IN (%s, %s) AND b = 'it''s' LIMIT 21"),
+                         'SELECT ? FROM t WHERE a IN (...) AND b = ? LIMIT ?')
+
+        def fetch(size):
+            for device in Device.objects.all()[:size]:
+                device.tester_set.count()
+
+        Device.objects.bulk_create(Device(description=str(i)) for i in range(3))
+        recordings = []
+        for size in (1, 2, 4):
+            with QueryRecorder() as recorder:
+                fetch(size)
+            recordings.append(recorder)
+        self.assertRegex(growing_statements(recordings), r'^1 -> 2 -> 4 x SELECT COUNT\(\*\)')
+
+
+@override_settings(DATA_VERSION_CHECK_INTERVAL=0)
+class RankingSnapshotTest(APITestCase):
+
+    def setUp(self):
+        caches[settings.MATCH_CACHE_ALIAS].clear()
+        self.device = Device.objects.create(description='IPhone')
+        for i, country in enumerate(('GB', 'US', 'US', 'JP')):
+            tester = Tester.objects.create(first_name='First {}'.format(i), last_name='Last', country=country,
+                                           last_login=timezone.now())
+            tester.devices.add(self.device)
+            for _ in range(i):
+                Bug.objects.create(tester=tester, device=self.device)
+
+    def get(self, query):
+        caches[settings.MATCH_CACHE_ALIAS].clear()
+        return self.client.get('/match-testers/', query).content
+
+    def test_snapshots_match_live_query(self):
+        queries = [{}] + [{'countries': c[0]} for c in SUPPORTED_COUNTRIES]
+        expected = [self.get(query) for query in queries]
+
+        self.assertEqual(sorted(refresh_snapshots()), sorted(snapshot_countries()))
+        self.assertEqual(RankingSnapshot.objects.count(), len(SUPPORTED_COUNTRIES) + 1)
+        self.assertEqual([self.get(query) for query in queries], expected)
+        self.assertEqual(refresh_snapshots(), [])
+        self.assertEqual(len(refresh_snapshots(force=True)), len(SUPPORTED_COUNTRIES) + 1)
+
+    def test_served_from_snapshot(self):
+        refresh_snapshots()
+        RankingSnapshot.objects.filter(country='US').update(content=b'[]')
+        self.assertEqual(self.get({'countries': 'US'}), b'[]')
+
+        # Other shapes of queries aren't served from snapshots
+        for query in ({'countries': 'US', 'limit': 10}, {'countries': 'US,GB'},
+                      {'countries': 'US', 'devices': self.device.id}):
+            self.assertNotEqual(self.get(query), b'[]')
+
+    def test_staleness_bound(self):
+        refresh_snapshots()
+        RankingSnapshot.objects.update(content=b'[]')
+        Bug.objects.create(tester=Tester.objects.first(), device=self.device)
+        self.assertNotEqual(self.get({}), b'[]')
+
+        with self.settings(RANKING_SNAPSHOT_MAX_STALENESS=60):
+            self.assertEqual(self.get({}), b'[]')
+        # Stale snapshots aren't cached
+        self.assertNotEqual(self.client.get('/match-testers/').content, b'[]')
+
+        RankingSnapshot.objects.update(created_at=timezone.now() - timedelta(seconds=61))
+        with self.settings(RANKING_SNAPSHOT_MAX_STALENESS=60):
+            self.assertNotEqual(self.get({}), b'[]')
+
+    def test_revalidated_across_refresh(self):
+        refresh_snapshots()
+        RankingSnapshot.objects.update(content=b'[]')
+        Bug.objects.create(tester=Tester.objects.first(), device=self.device)
+
+        # A stale snapshot has no ETag, it would be the ETag of the fresh ranking of the same data version
+        with self.settings(RANKING_SNAPSHOT_MAX_STALENESS=60):
+            response = self.client.get('/match-testers/')
+        self.assertEqual(response.content, b'[]')
+        self.assertFalse(response.has_header('ETag'))
+
+        refresh_snapshots()
+        response = self.client.get('/match-testers/')
+        self.assertNotEqual(response.content, b'[]')
+        response = self.client.get('/match-testers/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('refresh_rankings', stdout=out)
+        self.assertIn('Refreshed ranking snapshots: all countries, GB, US, JP', out.getvalue())
+        out = StringIO()
+        call_command('refresh_rankings', stdout=out)
+        self.assertIn('Ranking snapshots are up to date', out.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command('refresh_rankings', '--interval', '0', stdout=StringIO())
+
+
+class TimeWindowTest(APITestCase):
+
+    def setUp(self):
+        self.url = 'http://testserver/match-testers/'
+        caches[settings.MATCH_CACHE_ALIAS].clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.today = now.date()
+        cls.device_iphone = Device.objects.create(description='IPhone')
+        cls.device_nokia = Device.objects.create(description='Nokia')
+
+        def add_tester(last_name, devices, bugs, days_since_login=0):
+            tester = Tester.objects.create(first_name='Tester', last_name=last_name, country='GB',
+                                           last_login=now - timedelta(days=days_since_login))
+            tester.devices.add(*devices)
+            for device, days_ago in bugs:
+                Bug.objects.create(tester=tester, device=device,
+                                   reported_at=now - timedelta(days=days_ago) if days_ago is not None else None)
+
+        add_tester('Old', [cls.device_iphone], [(cls.device_iphone, 100)] * 4 + [(cls.device_iphone, None)])
+        add_tester('New', [cls.device_iphone, cls.device_nokia],
+                   [(cls.device_iphone, 1), (cls.device_iphone, 1), (cls.device_nokia, 10)])
+        add_tester('Idle', [cls.device_nokia], [(cls.device_nokia, 5)] * 3, days_since_login=400)
+
+    def get_ranking(self, **query):
+        response = self.client.get(self.url, query)
+        self.assertEqual(response.status_code, 200)
+        return [(t['experience'], t['last_name']) for t in json.loads(response.content)]
+
+    def days_ago(self, days):
+        return str(self.today - timedelta(days=days))
+
+    def test_window(self):
+        self.assertEqual(self.get_ranking(), [(5, 'Old'), (3, 'Idle'), (3, 'New')])
+        self.assertEqual(self.get_ranking(since=self.days_ago(30)), [(3, 'Idle'), (3, 'New'), (0, 'Old')])
+        self.assertEqual(self.get_ranking(since=self.days_ago(30), devices=self.device_iphone.id),
+                         [(2, 'New'), (0, 'Idle'), (0, 'Old')])
+        self.assertEqual(self.get_ranking(until=self.days_ago(50)), [(4, 'Old'), (0, 'Idle'), (0, 'New')])
+        self.assertEqual(self.get_ranking(since=self.days_ago(5), until=self.days_ago(5)),
+                         [(3, 'Idle'), (0, 'New'), (0, 'Old')])
+
+    def test_decay(self):
+        # Old: 4 * 0.5 ** 10, New: 2 * 0.5 ** 0.1 + 0.5 ** 1, Idle: 3 * 0.5 ** 0.5
+        self.assertEqual(self.get_ranking(decay=10), [(2, 'Idle'), (2, 'New'), (0, 'Old')])
+        # Weights are relative to the end of the window
+        self.assertEqual(self.get_ranking(decay=100, until=self.days_ago(50)), [(3, 'Old'), (0, 'Idle'), (0, 'New')])
+
+    def test_active_since(self):
+        self.assertEqual(self.get_ranking(active_since=self.days_ago(30)), [(5, 'Old'), (3, 'New')])
+        self.assertEqual(self.get_ranking(active_since=self.days_ago(30), since=self.days_ago(30)),
+                         [(3, 'New'), (0, 'Old')])
+
+    def test_pages_and_stream(self):
+        query = {'decay': 10, 'since': self.days_ago(30)}
+        expected = json.loads(self.client.get(self.url, query).content)
+
+        testers, url = [], self.url + '?decay=10&since={}&limit=1'.format(self.days_ago(30))
+        while url:
+            response = self.client.get(url)
+            testers += json.loads(response.content)
+            url = response.get('Link', '')[1:].partition('>')[0]
+        self.assertEqual(testers, expected)
+
+        with self.settings(MATCH_STREAM_CHUNK_SIZE=1):
+            response = self.client.get(self.url, dict(query, stream='json'))
+            self.assertEqual(json.loads(b''.join(response.streaming_content)), expected)
+
+    def test_invalid_window(self):
+        for query in ({'since': '2020-13-01'}, {'until': 'today'}, {'active_since': ''}, {'decay': 0},
+                      {'decay': 'fast'}, {'decay': '²'}, {'decay': 2 ** 63}, {'decay': '9' * 5000},
+                      {'since': self.days_ago(1), 'until': self.days_ago(2)}):
+            response = self.client.get(self.url, query)
+            self.assertEqual(response.status_code, 400)
+
+
+@override_settings(MATCHING_ENGINE='memory', DATA_VERSION_CHECK_INTERVAL=0)
+class MemoryEngineTimeWindowTest(TimeWindowTest):
+    pass
+
+
+class ApproxMatchTest(APITestCase):
+
+    def setUp(self):
+        caches[settings.MATCH_CACHE_ALIAS].clear()
+
+    @staticmethod
+    def exact_experience(devices=None):
+        bugs = Q(bug__device__in=F('devices'))
+        if devices:
+            bugs &= Q(bug__device__in=devices)
+        return Tester.objects.annotate(experience=Count('bug', filter=bugs))
+
+    def test_summary_error_bound(self):
+        # Counted testers are never underestimated and no estimate is off by more than the floor
+        rng = random.Random(1)
+        counters, floor, exact = {}, 0, Counter()
+        for _ in range(2000):
+            tester_id = min(int(rng.paretovariate(1)), 50)
+            delta = 1 if rng.random() < 0.8 or not exact[tester_id] else -rng.randint(1, exact[tester_id])
+            exact[tester_id] += delta
+            floor = update_summary(counters, floor, {tester_id: delta}, 8)
+
+            self.assertLessEqual(len(counters), 8)
+            for t, count in exact.items():
+                counter = counters.get(str(t))
+                if counter is None:
+                    self.assertLessEqual(count, floor)
+                else:
+                    self.assertTrue(counter[0] - counter[1] <= count <= counter[0])
+        self.assertGreater(floor, 0)
+
+    def test_incremental_rebuild(self):
+        # Rebuilding the experience of a tester only rebuilds the summaries of devices the tester owns
+        generate_dataset(testers=30, devices=5, bugs=300, ownership_density=0.5, seed=1)
+        tester = next(t for t in Tester.objects.prefetch_related('devices') if 0 < len(t.devices.all()) < 5)
+        owned = {d.id for d in tester.devices.all()}
+        DeviceSketch.objects.update(floor=7)
+
+        rebuild_experience([tester.id])
+        floors = dict(DeviceSketch.objects.values_list('device_id', 'floor'))
+        self.assertEqual({d for d, floor in floors.items() if floor == 7}, set(range(1, 6)) - owned)
+        self.assertEqual(approximate_match(sorted(owned), None, 10),
+                         (list(tester_query(devices=sorted(owned))[:10]), 0))
+
+    def test_exact_without_evictions(self):
+        generate_dataset(testers=30, devices=5, bugs=300, seed=1)
+        for devices, countries in ((None, None), ([1, 2], None), (None, ['US', 'GB']), ([3], ['US'])):
+            with self.subTest(devices=devices, countries=countries):
+                testers, error_bound = approximate_match(devices, countries, 10)
+                self.assertEqual(error_bound, 0)
+                self.assertEqual(testers, list(tester_query(devices=devices, countries=countries)[:10]))
+
+    def test_top_testers_overlap(self):
+        generate_dataset(testers=300, devices=20, bugs=6000, ownership_density=0.5, country_skew=1, seed=3)
+        with self.settings(APPROX_SKETCH_COUNTERS=16):
+            call_command('rebuild_experience', stdout=StringIO())
+            # Bugs of the most experienced testers update the summaries one by one
+            rng = random.Random(3)
+            for tester in Tester.objects.filter(id__gt=270).prefetch_related('devices'):
+                for device in tester.devices.all():
+                    for _ in range(rng.randint(2, 8)):
+                        Bug.objects.create(tester=tester, device=device)
+
+        # Summaries don't count testers by country, rankings of a single country are less accurate
+        for devices, countries, overlap in ((None, None, 16), (list(range(1, 11)), None, 16), (None, ['GB'], 12)):
+            with self.subTest(devices=devices, countries=countries):
+                testers, error_bound = approximate_match(devices, countries, 20)
+                exact = self.exact_experience(devices)
+                if countries:
+                    exact = exact.filter(country__in=countries)
+                experience = dict(exact.values_list('id', 'experience'))
+                top = exact.order_by('-experience', 'last_name', 'first_name', 'id').values_list('id', flat=True)
+
+                self.assertGreater(error_bound, 0)
+                self.assertEqual(len(testers), 20)
+                self.assertGreaterEqual(len(set(top[:20]) & {t[4] for t in testers}), overlap)
+                for estimate, _, _, _, tester_id in testers:
+                    self.assertLessEqual(abs(estimate - experience[tester_id]), error_bound)
+
+    def test_view(self):
+        generate_dataset(testers=30, devices=5, bugs=300, seed=1)
+        response = self.client.get('/match-testers/', {'mode': 'approx'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Experience-Error-Bound'], '0')
+        self.assertEqual(json.loads(response.content), json.loads(render_testers(tester_query()[:20])))
+        self.assertNotIn('Experience-Error-Bound', self.client.get('/match-testers/'))
+
+        query = {'mode': 'approx', 'devices': '1,2', 'countries': 'US', 'limit': 3}
+        response = self.client.get('/match-testers/', query)
+        self.assertEqual(json.loads(response.content),
+                         json.loads(render_testers(tester_query(devices=[1, 2], countries=['US'])[:3])))
+
+        for query in ({'mode': 'fast'}, {'mode': 'approx', 'stream': 'json'},
+                      {'mode': 'approx', 'since': '2020-01-01'},
+                      {'mode': 'approx', 'cursor': encode_cursor((1, 'a', 'b', 'US', 1))}):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get('/match-testers/', query).status_code, 400)
+        with self.settings(MATCHING_ENGINE='mmap'):
+            self.assertEqual(self.client.get('/match-testers/', {'mode': 'approx'}).status_code, 400)
+
+
+class SchemaTest(TestCase):
+
+    def setUp(self):
+        schema._schemas.clear()
+        self.addCleanup(schema._schemas.clear)
+
+    def test_generated_once(self):
+        with mock.patch('testers.schema.generate_schema', wraps=schema.generate_schema) as generate:
+            response = self.client.get('/swagger.json')
+            self.client.get('/swagger.json')
+        self.assertEqual(generate.call_count, 1)
+        self.assertEqual(response['Cache-Control'], 'public, max-age={}'.format(settings.OPENAPI_SCHEMA_MAX_AGE))
+
+        parameters = json.loads(response.content)['paths']['/match-testers/']['get']['parameters']
+        self.assertIn('since', [p['name'] for p in parameters])
+        self.assertIn('/match-testers/batch/', json.loads(response.content)['paths'])
+
+        response = self.client.get('/swagger.json', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_build_artifact(self):
+        schema_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(schema_dir.cleanup)
+        call_command('generate_schema', schema_dir.name, stdout=StringIO())
+        with open(os.path.join(schema_dir.name, 'swagger.yaml'), 'ab') as f:
+            f.write(b'# build artifact\n')
+
+        with override_settings(OPENAPI_SCHEMA_DIR=schema_dir.name):
+            with mock.patch('testers.schema.generate_schema') as generate:
+                response = self.client.get('/swagger.yaml')
+        generate.assert_not_called()
+        self.assertEqual(response['Content-Type'], 'application/yaml')
+        self.assertTrue(response.content.endswith(b'# build artifact\n'))
+
+    def test_ui(self):
+        for url in ('/swagger/', '/redoc/'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'/swagger.json', response.content)
+
+    def test_workers_start_without_drf_yasg_and_numpy(self):
+        code = ('import sys, django; django.setup(); from django.urls import resolve; resolve("/match-testers/"); '
+                'print(sorted({"drf_yasg", "numpy"} & set(sys.modules)))')
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), '[]')
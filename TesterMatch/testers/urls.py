@@ -1,8 +1,25 @@
+from django.conf import settings
 from django.urls import path
 
-from .views import match_testers, DeviceList
+from .views import match_testers, match_testers_async, match_testers_batch, match_testers_cache_stats, \
+    prometheus_metrics, device_list_async, DeviceList
 
-urlpatterns = [
-    path('match-testers/', match_testers, name='match_testers'),
-    path('devices/', DeviceList.as_view(), name='device_list'),
-]
+
+def _urlpatterns(match_testers_view, device_list_view):
+    return [
+        path('match-testers/', match_testers_view, name='match_testers'),
+        path('match-testers/batch/', match_testers_batch, name='match_testers_batch'),
+        path('match-testers/cache-stats/', match_testers_cache_stats, name='match_testers_cache_stats'),
+        path('devices/', device_list_view, name='device_list'),
+        path('metrics', prometheus_metrics, name='metrics'),
+    ]
+
+
+# Async views don't block the event loop of an ASGI worker while waiting for the database
+if settings.ASYNC_VIEWS:
+    urlpatterns = _urlpatterns(match_testers_async, device_list_async)
+else:
+    urlpatterns = _urlpatterns(match_testers, DeviceList.as_view())
+
+# Swagger schema is generated from the DRF views, async views serve the same API as JSON
+schema_urlpatterns = _urlpatterns(match_testers, DeviceList.as_view())
@@ -0,0 +1,76 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import DataVersion
+
+_DATA_VERSION_ID = 1
+# Devices change much less often than testers and bugs, the device catalogue has its own counter
+_DEVICE_VERSION_ID = 2
+
+_last_read = {'version': None, 'checked_at': 0.0}
+_last_device_read = {'version': None, 'checked_at': 0.0}
+
+
+def bump_data_version(devices=False):
+    # devices is set when the change also affects the device catalogue
+    _bump(_DATA_VERSION_ID)
+    if devices:
+        _bump(_DEVICE_VERSION_ID)
+
+    # Changes made by this process are visible to it immediately
+    _last_read['version'] = None
+    if devices:
+        _last_device_read['version'] = None
+
+
+def _bump(pk):
+    token = uuid.uuid4().hex
+    now = timezone.now()
+    if not DataVersion.objects.filter(pk=pk).update(version=F('version') + 1, token=token, updated_at=now):
+        DataVersion.objects.get_or_create(pk=pk, defaults={'version': 1, 'token': token, 'updated_at': now})
+
+
+def get_data_version():
+    # The counter is read from the database at most once per DATA_VERSION_CHECK_INTERVAL seconds
+    if settings.MATCHING_ENGINE == 'mmap':
+        # Match data files carry the version of the data they were exported from
+        from .engine import get_match_index
+        return get_match_index().version
+
+    if _last_read['version'] is None or \
+            time.monotonic() - _last_read['checked_at'] >= settings.DATA_VERSION_CHECK_INTERVAL:
+        _read_versions()
+
+    return _last_read['version']
+
+
+def _read_versions():
+    # Both counters are read with one query, requests validating devices and caching responses need both
+    now = time.monotonic()
+    rows = {pk: row for pk, *row in DataVersion.objects.filter(pk__in=(_DATA_VERSION_ID, _DEVICE_VERSION_ID))
+            .values_list('pk', 'version', 'token', 'updated_at')}
+    data, devices = rows.get(_DATA_VERSION_ID), rows.get(_DEVICE_VERSION_ID)
+    _last_read.update(version='{}.{}'.format(*data[:2]) if data else '0', checked_at=now)
+    _last_device_read.update(version=('{}.{}'.format(*devices[:2]), devices[2]) if devices else ('0', None),
+                             checked_at=now)
+
+
+def stored_data_version():
+    version = DataVersion.objects.filter(pk=_DATA_VERSION_ID).values_list('version', 'token').first()
+    return '{}.{}'.format(*version) if version else '0'
+
+
+def get_device_version():
+    """
+    Returns the version of the device catalogue and the time of its last change, None before the first change.
+    Read at most once per DATA_VERSION_CHECK_INTERVAL seconds like the data version.
+    """
+    if _last_device_read['version'] is None or \
+            time.monotonic() - _last_device_read['checked_at'] >= settings.DATA_VERSION_CHECK_INTERVAL:
+        _read_versions()
+
+    return _last_device_read['version']
@@ -1,62 +1,462 @@
-from django.db.models import Count, Q, F
-from drf_yasg import openapi
-from drf_yasg.utils import swagger_auto_schema
+import datetime
+import hashlib
+import json
+import re
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotAllowed, HttpResponseNotModified, JsonResponse, \
+    StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.utils import timezone
+from django.utils.http import http_date, parse_etags
 from rest_framework import status, generics
 from rest_framework.decorators import api_view
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from testers import caching
+from testers.metrics import render_metrics, timed
+from testers.serializers import TesterSerializer, DeviceSerializer, MatchBatchSerializer, \
+    render_devices, render_tester, render_testers
+from .catalogue import InvalidDeviceCursor, decode_device_cursor, encode_device_cursor, get_catalogue
+from .lookups import COUNTRY_CODES, devices_exist
+from .matching import match, match_many, decode_cursor, encode_cursor, InvalidCursor, stream_match, TESTER_FIELDS
+from .models import Device
+from .routers import read_from_replica
+from .sketches import approximate_match
+from .snapshots import get_snapshot
+
+JSON_CONTENT_TYPE = JSONRenderer.media_type
+STREAM_FORMATS = {'ndjson': 'application/x-ndjson', 'json': JSON_CONTENT_TYPE}
+# Opening bytes, separator and terminator of every tester and closing bytes of streamed responses
+STREAM_SYNTAX = {'ndjson': (b'', b'', b'\n', b''), 'json': (b'[', b',', b'', b']')}
+MATCH_MODES = ('exact', 'approx')
+# Number of testers of approximate rankings without a limit
+APPROX_DEFAULT_LIMIT = 20
+# Maximum difference between estimated and exact experience of approximate rankings
+ERROR_BOUND_HEADER = 'Experience-Error-Bound'
+# Integer query parameters are ASCII digits, int() alone would also accept other Unicode digits, signs and spaces
+INTEGER_PATTERN = re.compile(r'[0-9]{1,20}')
+BIGINT_MAX = 2 ** 63 - 1
+
+
+class InvalidParameter(ValueError):
+    message = 'Query parameter \'{}\' has invalid value'
+
+    def __init__(self, name):
+        super().__init__(self.message.format(name))
+
+
+class UnsupportedParameter(InvalidParameter):
+    message = 'Query parameter \'{}\' is not supported without a database'
+
+
+def _parse_match_query(query):
+    """
+    Returns devices, countries, limit, cursor, stream format, time window and mode from match-testers query
+    parameters, existence of the devices is checked separately. The window only contains the given parameters.
+    """
+    # Accepting different formats of array in query params, repeated values are ignored
+    countries = _split_values(query, 'countries')
+    if not COUNTRY_CODES.issuperset(countries):
+        raise InvalidParameter('countries')
+
+    devices = list(dict.fromkeys(_parse_integer(d, 'devices') for d in _split_values(query, 'devices')))
+
+    limit = query.get('limit')
+    if limit is not None:
+        limit = _parse_integer(limit, 'limit', maximum=settings.MATCH_MAX_LIMIT)
+
+    cursor = query.get('cursor')
+    if cursor is not None:
+        try:
+            cursor = decode_cursor(cursor)
+        except InvalidCursor:
+            raise InvalidParameter('cursor')
+
+    stream = query.get('stream')
+    if stream is not None and stream not in STREAM_FORMATS:
+        raise InvalidParameter('stream')
+
+    window = {name: _parse_date(query, name) for name in ('since', 'until', 'active_since') if name in query}
+    if window.get('since') and window.get('until') and window['since'] > window['until']:
+        raise InvalidParameter('until')
+
+    decay = query.get('decay')
+    if decay is not None:
+        window['decay'] = _parse_integer(decay, 'decay')
+
+    # Match data files only hold total bug counts, time windows need the database
+    if window and settings.MATCHING_ENGINE == 'mmap':
+        raise UnsupportedParameter(next(iter(window)))
+
+    mode = query.get('mode', 'exact')
+    if mode not in MATCH_MODES:
+        raise InvalidParameter('mode')
+    if mode == 'approx':
+        if settings.MATCHING_ENGINE == 'mmap':
+            raise UnsupportedParameter('mode')
+        # Approximate rankings are a single page of total counts
+        for name in ('cursor', 'stream', *window):
+            if query.get(name) is not None:
+                raise InvalidParameter(name)
+
+    return devices, countries, limit, cursor, stream, window, mode
+
 
-from testers.serializers import TesterSerializer, DeviceSerializer
-from .models import Tester, SUPPORTED_COUNTRIES, Device
+def _parse_integer(value, name, minimum=1, maximum=BIGINT_MAX):
+    # Values outside the range of a database bigint can't be compared with ids or passed as LIMIT
+    if not INTEGER_PATTERN.fullmatch(value) or not minimum <= int(value) <= maximum:
+        raise InvalidParameter(name)
+    return int(value)
 
-SUPPORTED_COUNTRIES_VALUES = [c[0] for c in SUPPORTED_COUNTRIES]
 
-# Values needed for generating swagger schema
-testers_response = openapi.Response('response description', TesterSerializer(many=True))
+def _parse_date(query, name):
+    try:
+        return datetime.date.fromisoformat(query[name])
+    except ValueError:
+        raise InvalidParameter(name)
 
-devices_param = openapi.Parameter('devices', openapi.IN_QUERY,
-                                  description="devices for which experience should be calculated, empty means all",
-                                  type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_INTEGER))
-countries_param = openapi.Parameter('countries', openapi.IN_QUERY,
-                                    description="countries from which testers should be included, empty means any",
-                                    type=openapi.TYPE_ARRAY,
-                                    explode=True,
-                                    items=openapi.Items(type=openapi.TYPE_STRING, enum=SUPPORTED_COUNTRIES_VALUES),)
+
+def _split_values(query, name):
+    values = query.getlist(name)
+    if len(values) == 1 and ',' not in values[0]:
+        return values
+    return list(dict.fromkeys(v for value in values for v in value.split(',')))
 
 
-@swagger_auto_schema(method='get', manual_parameters=[devices_param, countries_param],
-                     responses={200: testers_response},
-                     operation_description='Returns list of testers ordered by experience')
 @api_view(['GET'])
+@read_from_replica
 def match_testers(request):
-    query_countries = request.GET.getlist('countries')
-    query_devices = request.GET.getlist('devices')
+    with timed(request, 'validation'):
+        try:
+            devices, countries, limit, cursor, stream, window, mode = _parse_match_query(request.GET)
+            if not devices_exist(devices):
+                raise InvalidParameter('devices')
+        except InvalidParameter as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+    if mode == 'approx':
+        as_json = _renders_json(request)
+        content, error_bound = _approx_page(request, devices, countries, limit, as_json,
+                                            request.accepted_renderer.format)
+        response = HttpResponse(content, content_type=JSON_CONTENT_TYPE) if as_json else Response(content)
+        response[ERROR_BOUND_HEADER] = str(error_bound)
+        return response
+
+    if stream:
+        return _stream_testers(stream_match(devices, countries, cursor, limit, **window), stream)
+
+    # Responses are cached per normalised query and data version, unchanged results are returned as 304
+    as_json = _renders_json(request)
+    cache_key = _page_cache_key(devices, countries, cursor, limit, window, request.accepted_renderer.format)
+    etag = caching.response_etag(cache_key)
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+    content, next_cursor, current = _cached_match_page(request, cache_key, devices, countries, cursor, limit, window,
+                                                       as_json)
+    headers = {'ETag': etag} if current else {}
+
+    # JSON responses are rendered by the fast path, other formats (browsable API) by DRF
+    if as_json:
+        response = HttpResponse(content, content_type=JSON_CONTENT_TYPE, headers=headers)
+    else:
+        response = Response(content, headers=headers)
+    return _add_next_link(request, response, next_cursor)
+
+
+@read_from_replica
+async def match_testers_async(request):
+    # Same as match_testers for JSON, database work runs in a thread so it doesn't block the event loop
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    with timed(request, 'validation'):
+        try:
+            devices, countries, limit, cursor, stream, window, mode = _parse_match_query(request.GET)
+            if not await sync_to_async(devices_exist)(devices):
+                raise InvalidParameter('devices')
+        except InvalidParameter as e:
+            return JsonResponse(str(e), safe=False, status=status.HTTP_400_BAD_REQUEST)
+
+    if mode == 'approx':
+        content, error_bound = await sync_to_async(_approx_page)(request, devices, countries, limit, True, 'json')
+        return HttpResponse(content, content_type=JSON_CONTENT_TYPE, headers={ERROR_BOUND_HEADER: str(error_bound)})
+
+    if stream:
+        testers = await sync_to_async(stream_match)(devices, countries, cursor, limit, **window)
+        return _astream_testers(testers, stream)
+
+    cache_key = await sync_to_async(_page_cache_key)(devices, countries, cursor, limit, window, 'json')
+    etag = caching.response_etag(cache_key)
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        return HttpResponseNotModified(headers={'ETag': etag})
+
+    content, next_cursor, current = await sync_to_async(_cached_match_page)(request, cache_key, devices, countries,
+                                                                            cursor, limit, window, True)
+    response = HttpResponse(content, content_type=JSON_CONTENT_TYPE, headers={'ETag': etag} if current else {})
+    return _add_next_link(request, response, next_cursor)
+
+
+def _page_cache_key(devices, countries, cursor, limit, window, response_format):
+    window = {name: str(value) for name, value in window.items()}
+    # Decayed experience without an end of the window changes every day
+    if 'decay' in window and 'until' not in window:
+        window['today'] = str(timezone.now().date())
+    return caching.response_key(devices, countries, limit=limit, cursor=list(cursor) if cursor else None,
+                                format=response_format, **window)
+
+
+def _cached_match_page(request, cache_key, devices, countries, cursor, limit, window, as_json):
+    # Returns the content, the next cursor and whether the page is of the current data version. The ETag is
+    # derived from the current version, so only such pages may carry it.
+    cached = caching.get_response(cache_key)
+    if cached is not None:
+        return (*cached, True)
+
+    # Whole rankings of all devices are precomputed in the database, stale snapshots are served but not cached
+    if as_json and not devices and not window and cursor is None and limit is None and \
+            settings.MATCHING_ENGINE != 'mmap':
+        snapshot = get_snapshot(countries)
+        if snapshot is not None:
+            content, fresh = snapshot
+            if fresh:
+                caching.set_response(cache_key, (content, None))
+            return content, None, fresh
+
+    cached = _match_page(request, devices, countries, cursor, limit, window, as_json)
+    caching.set_response(cache_key, cached)
+    return (*cached, True)
 
-    # Accepting different formats of array in query params
-    query_countries = [c for q_c in query_countries for c in q_c.split(',')]
-    query_devices = [d for q_d in query_devices for d in q_d.split(',')]
 
-    # Checking if all countries in query parameters are valid
-    if not all([c in SUPPORTED_COUNTRIES_VALUES for c in query_countries]):
-        return Response('Query parameter \'countries\' has invalid value', status=status.HTTP_400_BAD_REQUEST)
+def _match_page(request, devices, countries, cursor, limit, window, as_json):
+    testers = match(devices, countries, after=cursor, **window)
 
-    # Checking if all device ids in query parameters are valid
-    if query_devices and not Device.objects.filter(id__in=query_devices).count() == len(query_devices):
-        return Response('Query parameter \'devices\' has invalid value', status=status.HTTP_400_BAD_REQUEST)
+    next_cursor = None
+    if limit is not None:
+        # One extra tester is fetched to know if there is a next page
+        testers = list(testers[:limit + 1])
+        if len(testers) > limit:
+            next_cursor = encode_cursor(testers[limit - 1])
+            testers = testers[:limit]
+    else:
+        testers = list(testers)
+
+    with timed(request, 'serialization'):
+        if as_json:
+            return render_testers(testers), next_cursor
+        return TesterSerializer([dict(zip(TESTER_FIELDS, t)) for t in testers], many=True).data, next_cursor
+
+
+def _approx_page(request, devices, countries, limit, as_json, response_format):
+    # Returns the content and error bound of an approximate ranking, cached like exact pages
+    limit = limit or APPROX_DEFAULT_LIMIT
+    cache_key = caching.response_key(devices, countries, limit=limit, mode='approx', format=response_format)
+    cached = caching.get_response(cache_key)
+    if cached is not None:
+        return cached
+
+    testers, error_bound = approximate_match(devices, countries, limit)
+    with timed(request, 'serialization'):
+        if as_json:
+            content = render_testers(testers)
+        else:
+            content = TesterSerializer([dict(zip(TESTER_FIELDS, t)) for t in testers], many=True).data
+    caching.set_response(cache_key, (content, error_bound))
+    return content, error_bound
+
+
+def _add_next_link(request, response, next_cursor):
+    if next_cursor is not None:
+        next_url = replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor)
+        response['Link'] = '<{}>; rel="next"'.format(next_url)
+    return response
+
+
+def _renders_json(request):
+    return isinstance(request.accepted_renderer, JSONRenderer)
+
+
+def _stream_testers(testers, stream_format):
+    # Testers are an iterator from stream_match, read page by page while the response is generated
+    def content():
+        start, separator, terminator, end = STREAM_SYNTAX[stream_format]
+        yield start
+        for i, tester in enumerate(testers):
+            yield (separator if i else b'') + render_tester(tester) + terminator
+        yield end
+
+    return StreamingHttpResponse(content(), content_type=STREAM_FORMATS[stream_format])
+
+
+def _astream_testers(testers, stream_format):
+    # Chunks of the stream_match iterator are fetched in a thread, so page queries don't block the event loop
+    chunk_size = settings.MATCH_STREAM_CHUNK_SIZE
+
+    async def content():
+        start, separator, terminator, end = STREAM_SYNTAX[stream_format]
+        yield start
+        first = True
+        while True:
+            chunk = await sync_to_async(list)(islice(testers, chunk_size))
+            if not chunk:
+                break
+            for tester in chunk:
+                yield (b'' if first else separator) + render_tester(tester) + terminator
+                first = False
+        yield end
+
+    return StreamingHttpResponse(content(), content_type=STREAM_FORMATS[stream_format])
+
+
+@api_view(['POST'])
+@read_from_replica
+def match_testers_batch(request):
+    serializer = MatchBatchSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    queries = [(q['devices'], q['countries'], q['limit']) for q in serializer.validated_data['queries']]
+    results = match_many(queries)
+
+    with timed(request, 'serialization'):
+        if _renders_json(request):
+            return HttpResponse(b'[' + b','.join(render_testers(r) for r in results) + b']',
+                                content_type=JSON_CONTENT_TYPE)
+        return Response([TesterSerializer([dict(zip(TESTER_FIELDS, t)) for t in r], many=True).data
+                         for r in results])
 
-    query_set = Tester.objects
-    query_set = query_set.filter(country__in=query_countries) if query_countries else query_set.all()
 
-    if query_devices:
-        query_set = query_set.annotate(
-            experience=Count('bug', filter=(Q(bug__device__in=F('devices')) & Q(bug__device__in=query_devices))))
+@api_view(['GET'])
+def match_testers_cache_stats(request):
+    return Response(caching.cache_stats())
+
+
+def prometheus_metrics(request):
+    stats = caching.cache_stats()
+    cache_lines = [
+        '# HELP testermatch_match_cache_requests_total Lookups in the match-testers response cache',
+        '# TYPE testermatch_match_cache_requests_total counter',
+        'testermatch_match_cache_requests_total{{result="hit"}} {}'.format(stats['hits']),
+        'testermatch_match_cache_requests_total{{result="miss"}} {}'.format(stats['misses']),
+    ]
+    return HttpResponse(render_metrics(cache_lines), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _parse_device_query(query):
+    # Returns device ids, limit and the id after the cursor from device list query parameters
+    ids = [_parse_integer(i, 'ids') for i in _split_values(query, 'ids')] if 'ids' in query else None
+
+    limit = query.get('limit')
+    if limit is not None:
+        limit = _parse_integer(limit, 'limit', maximum=settings.DEVICE_LIST_MAX_LIMIT)
+
+    after = query.get('cursor')
+    if after is not None:
+        try:
+            after = decode_device_cursor(after)
+        except InvalidDeviceCursor:
+            raise InvalidParameter('cursor')
+
+    return ids, limit, after
+
+
+def _accepted_encodings(header):
+    # Content codings of an Accept-Encoding header and their quality values, q=0 marks a refused coding
+    qualities = {}
+    for item in header.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding.lower()] = quality
+    return qualities
+
+
+def _device_list_response(request, catalogue, ids, limit, after):
+    """
+    JSON device list. The whole list is sent precompressed when the client accepts it, with a strong ETag and
+    Last-Modified so unchanged lists are answered with 304. Selections by ids or pages are rendered per request
+    from the in-memory list, their ETag also covers the query.
+    """
+    if ids is None and limit is None and after is None:
+        qualities = _accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        # Ties are broken by the order of the catalogue, which puts the smallest encoding first
+        accepted = [e for e in catalogue.encoded if qualities.get(e, qualities.get('*', 0)) > 0]
+        encoding = max(accepted, key=lambda e: qualities.get(e, qualities.get('*')), default=None)
+        response = HttpResponse(catalogue.encoded[encoding] if encoding else catalogue.content,
+                                content_type=JSON_CONTENT_TYPE)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        etag = '"{}{}"'.format(catalogue.etag, '-' + encoding if encoding else '')
+        next_cursor = None
     else:
-        query_set = query_set.annotate(
-            experience=Count('bug', filter=(Q(bug__device__in=F('devices')))))
+        rows = catalogue.select(ids, after, limit + 1 if limit is not None else None)
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_device_cursor(rows[-1][1])
+        with timed(request, 'serialization'):
+            response = HttpResponse(render_devices(rows), content_type=JSON_CONTENT_TYPE)
+        query = json.dumps([sorted(set(ids)) if ids is not None else None, limit, after])
+        etag = '"{}-{}"'.format(catalogue.etag, hashlib.sha1(query.encode('utf-8')).hexdigest()[:16])
 
-    serializer = TesterSerializer(query_set.order_by('-experience', 'last_name', 'first_name'), many=True)
-    return Response(serializer.data)
+    response['ETag'] = etag
+    patch_vary_headers(response, ['Accept-Encoding'])
+    # Clients may keep the list but have to revalidate it on every poll
+    response['Cache-Control'] = 'no-cache'
+    last_modified = None
+    if catalogue.modified_at is not None:
+        last_modified = int(catalogue.modified_at.timestamp())
+        response['Last-Modified'] = http_date(last_modified)
+    return get_conditional_response(request, etag, last_modified, _add_next_link(request, response, next_cursor))
 
 
+@method_decorator(read_from_replica, name='dispatch')
 class DeviceList(generics.ListAPIView):
     queryset = Device.objects.all()
     serializer_class = DeviceSerializer
+
+    def get(self, request, *args, **kwargs):
+        # Defined here so the schema annotations don't change the method of ListAPIView
+        return self.list(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        try:
+            ids, limit, after = _parse_device_query(request.GET)
+        except InvalidParameter as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        catalogue = get_catalogue()
+        if _renders_json(request):
+            return _device_list_response(request, catalogue, ids, limit, after)
+
+        # Browsable API renders the same selection through the serializer
+        rows = catalogue.select(ids, after, limit)
+        return Response(DeviceSerializer([{'description': d, 'id': i} for d, i in rows], many=True).data)
+
+
+@read_from_replica
+async def device_list_async(request):
+    # JSON only counterpart of DeviceList for the ASGI deployment
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    try:
+        ids, limit, after = _parse_device_query(request.GET)
+    except InvalidParameter as e:
+        return JsonResponse(str(e), safe=False, status=status.HTTP_400_BAD_REQUEST)
+
+    catalogue = await sync_to_async(get_catalogue)()
+    return _device_list_response(request, catalogue, ids, limit, after)